@@ -10,12 +10,18 @@ Celery process to download daily open interest from CME website and upload to th
 from . import blueprint
 from ..positions import positions
 from ..dash_utils import apply_layout_with_auth
-from .google_invite import google_calendar_invite
-from ..base.models import IntraDayPositions, TickerData
+from . import template_store, archive_index, archive, invite_tasks
+from . import ladder_export # Compiles the ladders of saved templates (template_store.save_hooks)
+from .products import pdict, resolve_product, product_folder
+from .contract import Contract
+from . import ticker_meta
+from .cache import memoize, file_version, read_pickle
+from . import profiling, main_tables
+from .main_tables import main_table_grid, main_table_overlay, product_positions
 
 
 from dash.dependencies import Input, Output, State
-import dash_table, itertools, time, json, os, re
+import dash_table, itertools, time, json, re
 from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
@@ -26,29 +32,6 @@ from dash import Dash
 import pandas as pd
 import numpy as np
 
-# Making a change to any of these variables will require restarting the server
-# Define all products and relationships traded. Also define 'round' value based on tick value sig digits
-pdict = {
-    'Brent': {'round': 2, 'rel': ['1m Fly', '1m 2x', '1m DC', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
-    'Brent_6m': {'round': 2, 'rel': ['6m Fly', '6m 2x', '12m Fly', '12m 2x']},
-    'Brent_crack': {'round': 2, 'rel': ['1m Crack', '2m Crack', '3m Crack', '6m Crack', '12m Crack']},
-    'Cocoa': {'round': 0, 'rel': ['consecutive fly', 'consecutive 2x']},
-    'Cocoaliffe': {'round': 0, 'rel': ['consecutive fly', 'consecutive 2x']},
-    'Cocoa-cocoaliffe': {'round': 0, 'rel': ['consecutive sp']},
-    'Feedercattle': {'round': 3, 'rel': ['consecutive Fly', 'consecutive 2x']},
-    'Leanhogs': {'round': 3, 'rel': ['consecutive Fly', 'consecutive 2x']},
-    'Livecattle': {'round': 3, 'rel': ['2m Fly', '2m 2x']},
-    'Go': {'round': 2, 'rel': ['1m 2x', '2m 2x', '3m Fly', '3m 2x', '6m Fly', '6m 2x', '12m Fly', '12m 2x']},
-    'Ho': {'round': 0, 'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
-    'Ho-go': {'round': 2, 'rel': ['1m Sp', '2m Sp', '3m Sp', '6m Sp', '12m Sp']},
-    'Naturalgas': {'round': 3, 'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '12m 2x']},
-    'Gasoline(rbob)': {'round': 0, 'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
-    'Soybeanoil': {'round': 2, 'rel': ['consecutive Fly', 'consecutive 2x']},
-    'Sugarno.11': {'round': 2, 'rel': ['consecutive Fly', 'consecutive 2x']},
-    'Wheat': {'round': 2, 'rel': ['consecutive Fly', 'consecutive 2x']},
-    'Kcwheat': {'round': 2, 'rel': ['consecutive Fly', 'consecutive 2x']},
-}
-
 # Define the dash app server to add to the flask website
 def Add_Dash(server):
 
@@ -87,6 +70,8 @@ def Add_Dash(server):
                 children = [baseline_heuristic_html(id = 'base-heuristic'),
                 html.Br(),
                 html.Button('Save', id='Save-heuristic', style = {'background-color' : '#dfe1eb'}),
+                # Risk/position across a range of standard deviation multipliers
+                sensitivity_html(id = 'risk-sensitivity'),
                 # Google calandar invite option to send reminders
                 html.Div(
                     id='cal-invite-div',
@@ -111,7 +96,10 @@ def Add_Dash(server):
                             children='Send',
                             style = {'background-color' : '#dfe1eb'}
                         ),
-                        html.Div(id='invite-link')]
+                        html.Div(id='invite-link'),
+                        # Invite is created by a background task, its status is polled until it is done
+                        dcc.Store(id='invite-task'),
+                        dcc.Interval(id='invite-poll', interval=1000, disabled=True)]
                 )],
                 style = {'display' : 'none'}, className = 'two columns'
             ),
@@ -193,24 +181,29 @@ def Add_Dash(server):
 
         # Get product selected from URL and account for exceptions.
         # Account for naming convention anomalies present in legacy system
-        prod_lookup = url.split('/')[2].capitalize()
+        prod_lookup = resolve_product(url.split('/')[2])
         dur = ''
-        if re.search('rbob', prod_lookup, re.IGNORECASE):
-            prod_lookup = 'Gasoline(rbob)'
         if re.search('6', prod_lookup, re.IGNORECASE):
             dur = '_6m'
-        prod = prod_lookup.split("_")[0]
+        prod = product_folder(prod_lookup)
 
-        pos_df, columns, data, tooltip, style = init_main_table(pdict[prod_lookup]['rel'], prod, dur)
-        contract = url.split('/')[-1]
+        # Read the precomputed snapshot (with current positions), build the table if it isn't ready
+        snap = main_tables.current_snapshot(prod_lookup)
+        if snap:
+            risk_json, columns, data, tooltip, style = snap['risk_json'], snap['columns'], snap['data'], snap['tooltip'], snap['style']
+        else:
+            pos_df, columns, data, tooltip, style = init_main_table(pdict[prod_lookup]['rel'], prod, dur)
+            risk_json = pos_df.to_json(orient='records')
+        data, tooltip = main_tables.oi_overlay(columns, data, tooltip)
+        contract_id = url.split('/')[-1]
 
         # If URL contains a specific contract in addition to product, set that as the active cell
-        if contract:
-            prod2, dur, rel, mmyy, b_s = contract.split("_")
-            active_cell = {'column_id': ' '.join([mmyy, b_s]), 'row_id': ' '.join([prod.capitalize(), dur, rel])}
-            return pos_df.to_json(orient='records'), data, columns, tooltip, style, active_cell
+        if contract_id:
+            contract = Contract.from_id(contract_id)
+            active_cell = {'column_id': contract.column_id, 'row_id': contract.row_id}
+            return risk_json, data, columns, tooltip, style, active_cell
         else:
-            return pos_df.to_json(orient='records'), data, columns, tooltip, style, no_update
+            return risk_json, data, columns, tooltip, style, no_update
 
     #-------------------------------------------------------------------------------------------------------------#
     @app.callback(
@@ -222,12 +215,7 @@ def Add_Dash(server):
             raise PreventUpdate
 
         prod = url.split('/')[2].capitalize()
-        files = update_dropdown(prod)
-
-        mmyy = [x.split("_")[2] for x in files]
-        mmyy =  list(set(mmyy))
-
-        mmyy = [{'label' : i, 'value' : i} for i in mmyy]
+        mmyy = archive_index.month_options(prod)
 
         return [mmyy]
     #-------------------------------------------------------------------------------------------------------------#
@@ -241,13 +229,7 @@ def Add_Dash(server):
             raise PreventUpdate
 
         prod = url.split('/')[2].capitalize()
-        files = update_dropdown(prod)
-
-        rel = [x for x in files if re.search(mmyy, x, re.IGNORECASE)]
-        rel = [' '.join([x.split("_")[0], x.split("_")[1], x.split("_")[3]]) for x in rel]
-        rel = list(set(rel))
-
-        rel = [{'label' : i, 'value' : i} for i in rel]
+        rel = archive_index.relationship_options(prod, mmyy)
 
         return [rel]
     #-------------------------------------------------------------------------------------------------------------#
@@ -266,28 +248,20 @@ def Add_Dash(server):
             raise PreventUpdate
 
         if tnow == int(str(ts)[:10]):
-            if re.search('crack', url, re.IGNORECASE):
-                prod = 'Brent'
-            elif re.search('brent', url, re.IGNORECASE) and re.search('6', url, re.IGNORECASE):
-                prod = 'Brent'
-            elif re.search('rbob', url, re.IGNORECASE):
-                prod = 'Gasoline(rbob)'
-            else:
-                prod = url.split('/')[2].capitalize()
-
-            contract_name = ' '.join([prod, rel[:-2], mmyy, rel[-1]])
+            contract = Contract.from_archive(url.split('/')[2], rel, mmyy)
         elif active_cell['column_id'] == 'Future':
             raise PreventUpdate
         else:
-            contract_name = ' '.join([active_cell['row_id'], active_cell['column_id']])
+            contract = Contract.from_cell(active_cell)
 
-        return [contract_name]
+        return [contract.name]
 
     #-------------------------------------------------------------------------------------------------------------#
     @app.callback(
     [Output('settle-rp', 'columns'),
     Output('settle-rp', 'data')],
     [Input('contract-name', 'children')])
+    @memoize(ttl=3600, key=settle_data_key, namespace='rp')
     def show_settle_data(contract_name):
         # Show settle data (rp, settle price, mean range, median range) from daily RP script
         # (data pulled from legacy process in the form of a pickle file)
@@ -295,14 +269,13 @@ def Add_Dash(server):
         if (not contract_name):
             raise PreventUpdate
 
-        contract_name = contract_name[:-2].lower()
+        contract = Contract.get(contract_name)
         fpath = Path(blueprint.root_path, 'data', 'daily_rp').with_suffix('.pkl')
-        df = pd.read_pickle(fpath)
-        df.rename(columns = {"Price" : "Settle Price"}, inplace = True)
+        df = read_pickle(fpath).rename(columns = {"Price" : "Settle Price"})
 
         columns = [{"name": i, "id": i} for i in df.columns]
         try:
-            data = [df.loc[contract_name].to_dict()]
+            data = [df.loc[contract.risk_key].to_dict()]
         except:
             data = []
             columns = []
@@ -332,20 +305,13 @@ def Add_Dash(server):
         if (not contract_name):
             raise PreventUpdate
 
-        prod, rel = contract_name.split(" ", 1)
-        add, unwind = get_add_unwind_type(contract_name[-1])
+        contract = Contract.get(contract_name)
+        add = contract.add
 
-        if re.search('crack', rel, re.IGNORECASE): #For p_dict lookup
-            prod_lookup = 'Brent_crack'
-        elif re.search('rbob', prod, re.IGNORECASE):
-            prod_lookup = 'Gasoline(rbob)'
-        else:
-            prod_lookup = prod.capitalize()
-
-        str_format = lambda x:"{:,.{}f}".format(x, pdict[prod_lookup]['round'])
+        str_format = lambda x:"{:,.{}f}".format(x, ticker_meta.round_for(contract.prod_lookup))
 
         # Get data from risk report to calculate std and position
-        pos_df = pd.DataFrame([[contract_name[:-2].replace(' ', '_'), 0]], columns = ['contract', 'position'])
+        pos_df = pd.DataFrame([[contract.position_contract, 0]], columns = ['contract', 'position'])
 
         # Try to get standard deviation data if available otherwise leave blank
         # (data generation depends on legacy process and is sometimes not available)
@@ -361,7 +327,7 @@ def Add_Dash(server):
         # Get the current position for contract if it exists else set to 0
         try:
             risk_df = pd.DataFrame(json.loads(risk_json)).set_index('contract')
-            temp_pos = int(risk_df.loc[contract_name[:-2].lower(), 'position'])
+            temp_pos = int(risk_df.loc[contract.risk_key, 'position'])
             if (add == 'Buy' and temp_pos > 0) or (add=='Sell' and temp_pos < 0):
                 curr_pos = temp_pos
             else:
@@ -374,65 +340,99 @@ def Add_Dash(server):
             {'name' : '', 'id' : 'Value', 'editable' : True}
         ]
 
-        base_path = Path(blueprint.root_path, 'data/{}'.format(prod))
-        filepath = Path(base_path, rel.replace(' ', '_')).with_suffix('.heuristic')
-        filepath_exp = Path(base_path, 'expired', rel.replace(' ', '_')).with_suffix('.heuristic')
+        save_pressed = rows and isinstance(ts_save, int) and tnow == int(str(ts_save)[:10])
+        row_update = (rows and rows_previous) and rows != rows_previous
+
+        # Current version of the template saved for contract, only needed when table isn't being saved/edited
+        stored = None if (save_pressed or row_update) else load_template(contract_name, 'heuristic')
 
         # ------------- First check if save button is pressed ----------------------- #
-        if rows and isinstance(ts_save, int) and tnow == int(str(ts_save)[:10]):
+        if save_pressed:
             rows_df = pd.DataFrame(rows).set_index('Params')
             rows_df.loc['Last Updated', 'Value'] = datetime.now().strftime('%h %d %Y %X')
             data = rows_df.reset_index().to_dict('records')
-            json.dump(data, open(filepath, "w+"))
+            template_store.save(contract_name, data, 'heuristic')
         # ----- Check if it is a row update and calculations need to be redone ------ #
-        elif (rows and rows_previous) and rows != rows_previous:
-            prev_df = pd.DataFrame(rows_previous).set_index('Params')
-            rows_df = pd.DataFrame(rows).set_index('Params')
+        elif row_update:
+            values = {x['Params'] : x['Value'] for x in rows}
 
             # determine whether risk or position needs to be calculated
-            change = pd.concat([rows_df,prev_df]).drop_duplicates(keep=False) # Get rows where value changed
-            if not change.empty and re.search('risk', change.index[0], re.IGNORECASE):
-                rows_df.loc['Max Position', 'Value'] = calculate_pos_risk(rows_df)
+            change = [x['Params'] for x, y in zip(rows, rows_previous) if x != y] # Get rows where value changed
+            if change and re.search('risk', change[0], re.IGNORECASE):
+                values['Max Position'] = calculate_pos_risk(values)
             else:
-                rows_df.loc['Risk', 'Value'] = calculate_pos_risk(rows_df, 'risk')
+                values['Risk'] = calculate_pos_risk(values, 'risk')
 
-            data = rows_df.reset_index().to_dict('records')
-        # ----------------- Load file from system if exists ----------------------- #
-        elif os.path.isfile(filepath):
-            data = json.load(open(filepath, "r"))
+            data = [
+                {'Params' : x['Params'], 'Value' : values[x['Params']]} if x['Params'] in ['Max Position', 'Risk'] else x
+                for x in rows
+            ]
+        # ----------------- Load template from store if exists ----------------------- #
+        elif stored and not stored.expired:
+            data = stored.data
             rows_df = pd.DataFrame(data).set_index('Params')
 
             rows_df.loc['Standard Deviation', 'Value'] =  std #to avoid precision error in calc
-            rows_df.loc['Risk', 'Value'] = calculate_pos_risk(rows_df, 'risk')
+            rows_df.loc['Risk', 'Value'] = calculate_pos_risk(rows_df['Value'].to_dict(), 'risk')
             rows_df.loc['Standard Deviation', 'Value'] =  std_str
 
             data = rows_df.reset_index().to_dict('records')
-        # ----------------- Load file from archive if exists ----------------------- #
-        elif os.path.isfile(filepath_exp):
-            data = json.load(open(filepath_exp, "r"))
-        # ------------------ Initialize file for first time ------------------------ #
+        # ------------- Load template from archive (expired contract) ------------------- #
+        elif stored:
+            data = stored.data
+        # ------------------ Initialize template for first time ------------------------ #
         else:
-            if re.search('crack', rel, re.IGNORECASE):
-                prod = 'BRENT-CRACK'
-            else:
-                prod = prod.upper()
-            # Get tick data from product from database
-            tick_data = TickerData.query.filter_by(shiny_id = prod).first()
+            # Get tick data for product from the in-memory ticker table (no database round trip)
+            tick_data = ticker_meta.lookup(contract.prod_lookup)
 
             data = [
                 {'Params' : 'Max Position', 'Value' : ''},
                 {'Params' : 'Standard Deviation', 'Value' : std_str},
                 {'Params' : 'Standard Deviation Mult', 'Value' : tick_data.std_mult},
-                {'Params' : 'Tick Size', 'Value' : tick_data.custom_tick_size},
+                {'Params' : 'Tick Size', 'Value' : tick_data.tick_size},
                 {'Params' : 'Tick Value', 'Value' : tick_data.tick_value},
                 #.............. hidden ..................#
                 {'Params' : 'Last Updated', 'Value' : ''},
             ]
-            data[0]['Value'] = calculate_pos_risk(pd.DataFrame(data).set_index('Params'))
+            data[0]['Value'] = calculate_pos_risk({x['Params'] : x['Value'] for x in data})
 
         return columns, data, {}, None
 
 
+    #-------------------------------------------------------------------------------------------------------------#
+    @app.callback(
+    [Output('risk-sensitivity', 'columns'),
+    Output('risk-sensitivity', 'data')],
+    [Input('base-heuristic', 'data')])
+    def generate_sensitivity_table(rows):
+        # Shows risk at max position and max position at risk for a range of standard deviation multipliers
+        # around the one in the heuristic table, calculated in a single call to pos_risk_grid
+        if not rows:
+            return [], []
+
+        values = {x['Params'] : x['Value'] for x in rows}
+        try:
+            std, std_mult, tick_size, tick_value = [to_float(values[x]) for x in pos_risk_params]
+            max_pos = to_float(values['Max Position'])
+            risk = to_float(values.get('Risk', ''))
+        except (KeyError, ValueError):
+            return [], []
+
+        mults = std_mult * sensitivity_mults
+        risk_grid = pos_risk_grid(std, mults, tick_size, tick_value, max_pos, 'risk')
+        pos_grid = pos_risk_grid(std, mults, tick_size, tick_value, risk)
+
+        columns = [{'name' : i, 'id' : i} for i in ['Std Mult', 'Risk @ Max Position', 'Max Position @ Risk']]
+        data = [
+            {
+                'Std Mult' : '{:g}'.format(m),
+                'Risk @ Max Position' : '{:,.0f}'.format(r) if np.isfinite(r) else '',
+                'Max Position @ Risk' : int(p) if np.isfinite(p) else ''
+            } for m, r, p in zip(mults, risk_grid, pos_grid)
+        ]
+
+        return columns, data
+
     #-------------------------------------------------------------------------------------------------------------#
     @app.callback(
     [Output('notes', 'value'),
@@ -447,111 +447,113 @@ def Add_Dash(server):
         if not contract_name:
             return [''], {'display' : 'none'}
 
-        prod, rel = contract_name.split(" ", 1)
-        base_path = Path(blueprint.root_path, 'data/{}'.format(prod))
-        filepath = Path(base_path, rel.replace(' ', '_')).with_suffix('.notes')
-        filepath_exp = Path(base_path, 'expired', rel.replace(' ', '_')).with_suffix('.notes')
-
         if note and isinstance(ts, int) and tnow == int(str(ts)[:10]):
-            json.dump(note, open(filepath, "w+"))
+            template_store.save(contract_name, note, 'notes')
 
-        if os.path.isfile(filepath):
-            note = json.load(open(filepath, "r"))
-        elif os.path.isfile(filepath_exp):
-            note = json.load(open(filepath_exp, "r"))
-        else:
-            note = ['']
+        # Notes are read from the store, or the archive for expired contracts
+        stored = load_template(contract_name, 'notes')
+        note = stored.data if stored else ['']
 
         return note, {}
 
     #-------------------------------------------------------------------------------------------------------------#
     @app.callback(
     [Output('cal-invite-div', 'style'),
-    Output('invite-link', 'children')],
+    Output('invite-task', 'data')],
     [Input('contract-name', 'children'),
     Input('invite-submit', 'n_clicks_timestamp')],
     [State('invite-title', 'value'),
     State('invite-date', 'date')])
     def calendar_invite(contract_name, ts, title, event_date):
         # Use google calandar API to set up option to send invites by selecting the date and entering a title
+        # The invite is sent to a Celery task so the request doesn't wait on the Google API
         tnow = int(str(time.time())[:10])
 
         if not contract_name:
-            return {'display' : 'none'}, []
+            return {'display' : 'none'}, None
 
         if isinstance(ts, int) and tnow == int(str(ts)[:10]):
-            link = google_calendar_invite.main(event_name=title, start_date=datetime.strptime(event_date, '%Y-%m-%d'))
-            ret = html.A('Event created here', href=link, target="_blank")
-            return {'margin-top' : '40px'}, ret
+            task = invite_tasks.create_invite.delay(title, event_date)
+            return {'margin-top' : '40px'}, {'id' : task.id, 'submitted' : time.time()}
 
-        return {}, []
+        return {}, None
 
     #-------------------------------------------------------------------------------------------------------------#
     @app.callback(
-    [Output('add-unwind-parameters', 'columns'),
-    Output('add-unwind-parameters', 'data'),
-    Output('adding-chart', 'columns'),
-    Output('adding-chart', 'data'),
-    Output('adding-chart-title', 'children'),
-    Output('unwinding-chart', 'columns'),
-    Output('unwinding-chart', 'data'),
-    Output('unwinding-chart-title', 'children')],
-
-    [Input('add-unwind-parameters', 'data_timestamp'),
-    Input('base-heuristic', 'data'),
-    Input('risk-report', 'data'),
-    Input('contract-name', 'children')],
+    [Output('invite-link', 'children'),
+    Output('invite-poll', 'disabled')],
+    [Input('invite-task', 'data'),
+    Input('invite-poll', 'n_intervals')])
+    def invite_status(task, n):
+        # Shows status of the invite task (pending, created with link to event, failed) and stops polling once done,
+        # or once it has been pending for longer than invite_tasks.invite_timeout
+        if not task:
+            return [], True
+
+        status, result = invite_tasks.invite_status(task['id'], task['submitted'])
+
+        if status == 'created':
+            return html.A('Event created here', href=result, target="_blank"), True
+        elif status == 'failed':
+            return html.P('Invite failed ({}), try again'.format(result), style={'color' : '#b03a2e'}), True
+        else:
+            return html.P('Creating invite...'), False
 
-    [State('add-unwind-parameters', 'data_previous'),
-    State('add-unwind-parameters', 'data')])
-    def generate_tables_charts(t, heuristic_tbl, risk_json, contract_name, rows_previous, rows):
+    #-------------------------------------------------------------------------------------------------------------#
+    @memoize(ttl=600, key=tables_charts_key, namespace='ladders')
+    def tables_charts(tnow, t, heuristic_tbl, risk_json, contract_name, rows_previous, rows):
     # Read in values provided by traders and create trading logic
-        tnow = int(str(time.time())[:10])
 
         if ((not heuristic_tbl) and (not rows)) or (not contract_name):
             return [], [], [], [], [], [], [], []
 
-        prod, rel = contract_name.split(" ", 1)
-        add, unwind = get_add_unwind_type(rel[-1])
-
-        if re.search('crack', rel, re.IGNORECASE): #For dict lookup
-            prod = 'Brent_crack'
-        else:
-            prod = prod.capitalize()
+        contract = Contract.get(contract_name)
+        add, unwind = contract.add, contract.unwind
+        prod = contract.prod_lookup
 
-        str_format = lambda x:"{:,.{}f}".format(x, pdict[prod]['round'])
+        str_format = lambda x:"{:,.{}f}".format(x, ticker_meta.round_for(prod))
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 1 : READ IN VALUES FROM HEURISTIC TABLE
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 1')
         try:
             # ....... hidden .......#
             # If any of these fail, return empty elements
         except:
+            profiling.swallowed('STEP 1')
             return [], [], [], [], [], [], [], []
 
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 2 : CALCULATE PRICE TIERS FOR ADDING POSITION AND GENERATE CHART
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 2')
         try:
+            # Adding and unwinding ladders are built once by build_ladders, same as whatif.py and the ladder export
+            chart_df, unwind_chart_df = build_ladders(pd.DataFrame(heuristic_tbl).set_index('Params'), add, unwind, prod)
+            # Chart columns, data and title from chart_df
             # ....... hidden .......#
             # If any of these fail, return empty elements
         except:
+            profiling.swallowed('STEP 2')
             return [], [], [], [], [], [], [], []
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 3 : CREATE SUMMARIZED TIER TABLE FOR ADDING POSITION
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 3')
         try:
             # ....... hidden .......#
             # If any of step 3 fails, only return elements from step 2
         except:
+            profiling.swallowed('STEP 3')
             return [], [], chart_columns, adding_chart_data, adding_chart_title, [], [], []
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 4 : LOOKUP LOGIC FOR ADDING
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 4')
         # This does a function similar to vlookup in excel by looking up position/quantity to be traded at a certain price
         # from the large table generated in step 1
 
@@ -569,13 +571,13 @@ def Add_Dash(server):
                 )
                 data = data_df.reset_index().to_dict('records')
             except:
-                pass
+                profiling.swallowed('STEP 4')
         # Set default value on initialization,
         # check if contract is currently being traded and has a position on. If yes, display that on lookup
         elif risk_json and json.loads(risk_json):
             try:
                 risk_df = pd.DataFrame(json.loads(risk_json)).set_index('contract')
-                pos = risk_df.loc[contract_name[:-2].lower(), 'position']
+                pos = risk_df.loc[contract.risk_key, 'position']
                 change = pd.DataFrame([[ 'Adding Lookup', int(pos) ]], columns = ['Chart', 'Position']).set_index('Chart')
                 data_df = lookup_logic(
                     chart_df = chart_df,
@@ -585,31 +587,37 @@ def Add_Dash(server):
                 )
                 data = data_df.reset_index().to_dict('records')
             except:
-                pass
+                profiling.swallowed('STEP 4')
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 5 : GENERATE CHART FOR UNWINDING PARAMS
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 5')
         try:
+            # Unwinding chart data and title from unwind_chart_df (built in STEP 2)
             # ....... hidden .......#
             # If any of these fail, return all other elements upto step 4
         except:
+            profiling.swallowed('STEP 5')
             return columns, data, chart_columns, adding_chart_data, adding_chart_title, [], [], []
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 6 : ADD UNWINDING PARAMS TO TIER TABLE
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 6')
         # Extends table created in step 3 (summarized tier table) to include logic for unwinding the position as well (if this
         # data is provided by traders in heuristic table)
         try:
             # ....... hidden .......#
             # If any of these fail, return all other elements upto step 5
         except:
+            profiling.swallowed('STEP 6')
             return columns, data, chart_columns, adding_chart_data, adding_chart_title, chart_columns, unwind_chart_data, unwind_chart_title
 
         # ------------------------------------------------------------------------------------------------------------------- #
         # STEP 7 : LOOKUP UNWINDING LOGIC
         # ------------------------------------------------------------------------------------------------------------------- #
+        profiling.mark('STEP 7')
         # Same logic as adding chart lookup
         if rows and isinstance(t, int) and tnow == int(str(t)[:10]):
             try:
@@ -623,11 +631,11 @@ def Add_Dash(server):
                 )
                 data = data_df.reset_index().to_dict('records')
             except:
-                pass
+                profiling.swallowed('STEP 7')
         elif risk_json and json.loads(risk_json):
             try:
                 risk_df = pd.DataFrame(json.loads(risk_json)).set_index('contract')
-                pos = risk_df.loc[contract_name[:-2].lower(), 'position']
+                pos = risk_df.loc[contract.risk_key, 'position']
                 change = pd.DataFrame([['Unwinding Lookup', int(pos)]], columns = ['Chart', 'Position']).set_index('Chart')
                 data_df = lookup_logic(
                     chart_df = unwind_chart_df,
@@ -638,11 +646,35 @@ def Add_Dash(server):
                 )
                 data = data_df.reset_index().to_dict('records')
             except:
-                pass
+                profiling.swallowed('STEP 7')
 
 
         return columns, data, chart_columns, adding_chart_data, adding_chart_title, chart_columns, unwind_chart_data, unwind_chart_title
 
+    #-------------------------------------------------------------------------------------------------------------#
+    @app.callback(
+    [Output('add-unwind-parameters', 'columns'),
+    Output('add-unwind-parameters', 'data'),
+    Output('adding-chart', 'columns'),
+    Output('adding-chart', 'data'),
+    Output('adding-chart-title', 'children'),
+    Output('unwinding-chart', 'columns'),
+    Output('unwinding-chart', 'data'),
+    Output('unwinding-chart-title', 'children')],
+
+    [Input('add-unwind-parameters', 'data_timestamp'),
+    Input('base-heuristic', 'data'),
+    Input('risk-report', 'data'),
+    Input('contract-name', 'children')],
+
+    [State('add-unwind-parameters', 'data_previous'),
+    State('add-unwind-parameters', 'data')])
+    def generate_tables_charts(t, heuristic_tbl, risk_json, contract_name, rows_previous, rows):
+        # The time is read once for the cache key and the tables, so both agree on whether the lookup table was just edited
+        tnow = int(str(time.time())[:10])
+        return tables_charts(tnow, t, heuristic_tbl, risk_json, contract_name, rows_previous, rows)
+
+    profiling.instrument(app)
 
     return app.server
 
@@ -711,131 +743,119 @@ def unwind_tiers(unwind, prod, price, scalp, tick_size, tier_len, tier_qty, tier
     # ....... hidden .......#
     return df
 
-def init_main_table(relationships, prod, dur):
-
-    # Create columns
-    # Read in file that is generated from RP morning scripts
-    df = pd.read_pickle(Path(blueprint.root_path, 'data', 'prod_mmyy.pkl'))
-    df.index = df.index.str.upper()
-    columns = df[df.index == ''.join([prod, dur]).upper()].values.tolist()[0]
-    columns = list(filter(None, columns))
-
-    columns_dict = [
-        {'name' : [i, j], 'id' : ' '.join([i, j])}
-        for i, j in itertools.product(columns, ['B', 'S'])
-    ]
-    columns_dict.insert(0, {'name' : ['', ''], 'id' : 'Future'})
-
-    rows = []
-    rows.extend(relationships)
-
-    # Create tooltip data
-    tooltip_columns = [x['id'] for x in columns_dict]
-    tooltip = []
-    for rel in rows:
-        tooltip.append({i : ' '.join([rel, i]) for i in tooltip_columns})
-
-    # Create rows
-    df = pd.DataFrame(columns=tooltip_columns)
-    df['id'] = list(map(lambda x : ' '.join([prod.split("_")[0], x]), rows))
-    df['Future'] = rows
-    df = df.fillna('')
-
-    query = IntraDayPositions.query.filter(IntraDayPositions.contract.contains(prod.split("_")[0]))
-    pos_df = positions.get_positions(query = query)
-
-    # Add positions to main table
-    if not pos_df.empty:
-        df = main_table_positions(df.set_index('id'), pos_df, prod)
-
-    data = df.to_dict('records')
-
-    style = []
-    header_style = [{
-        'if' : {'column_id' : 'Future'},
-        'backgroundColor': 'rgb(230, 230, 230)',
-        'fontWeight': 'bold'},
-    ]
-
-    style.extend(header_style)
-
-    sell_style=[{
-        'if': {'column_id': str(x), 'filter_query': '{{{0}}} < 0'.format(x)},
-            'backgroundColor': 'rgb(250, 217, 222)',
-        } for x in tooltip_columns
-    ]
-
-    style.extend(sell_style)
+def build_ladders(rows_df, add, unwind, prod):
+    # Builds the adding and unwinding charts (indexed by price, with 'Qty/Level' and 'Position' columns) from a
+    # heuristic table indexed by 'Params'. The only implementation of the ladders: generate_tables_charts (STEP 2),
+    # whatif.py and the ladder export all call it, so the UI and the evaluated/exported ladders can't drift apart
+    # ....... hidden .......#
+    return chart_df, unwind_chart_df
 
-    buy_style=[{
-        'if': {'column_id': str(x), 'filter_query': '{{{0}}} > 0'.format(x)},
-            'backgroundColor': 'rgb(217, 230, 250)',
-        } for x in tooltip_columns
+def init_main_table(relationships, prod, dur):
+    # Builds the main table on request, used when there is no precomputed snapshot (see main_tables.py). Not memoized,
+    # the positions overlay has to reflect the positions at the time of the request
+    grid = main_table_grid(relationships, prod, dur)
+    pos_df = product_positions(prod)
+    data, risk_df = main_table_overlay(grid, pos_df, prod)
+
+    return risk_df, grid['columns'], data, grid['tooltip'], grid['style']
+
+def init_main_tables(prod_lookups):
+    # Batch version of init_main_table for several products (desk view, see desk.py): one positions query, one risk
+    # report and one snapshot read, the snapshots are re-overlaid when positions changed so nothing is memoized here.
+    # Returns risk df and {prod_lookup : (columns, data, tooltip, style)}
+    snaps, risk_df = main_tables.batch(prod_lookups)
+    tables = {
+        x : (snap['columns'], snap['data'], snap['tooltip'], snap['style'])
+        for x, snap in snaps.items()
+    }
+
+    return risk_df, tables
+
+def pos_risk_grid(std, std_mult, tick_size, tick_value, value, to_calculate='position'):
+    # Vectorized conversion between max position and risk. Inputs are broadcast against each other so any of them
+    # can be an array (ex. a range of std multipliers, or one value per contract) or a single value.
+    # Risk is the dollar value of a move of 'std mult' standard deviations on the position
+    risk_per_lot = np.asarray(std, dtype=float) * np.asarray(std_mult, dtype=float) \
+        / np.asarray(tick_size, dtype=float) * np.asarray(tick_value, dtype=float)
+    value = np.asarray(value, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if to_calculate == 'position':
+            return np.floor(value / risk_per_lot) # value is risk
+        else:
+            return value * risk_per_lot # value is max position
+
+def calculate_pos_risk(values, to_calculate='position'):
+    # Single value version of pos_risk_grid for the heuristic table, values is {Params : Value}.
+    # Returns '' if the table is incomplete
+    try:
+        args = [to_float(values[x]) for x in pos_risk_params]
+        if to_calculate == 'position':
+            position = pos_risk_grid(*args, to_float(values['Risk']))
+            return int(position)
+        else:
+            risk = pos_risk_grid(*args, to_float(values['Max Position']), 'risk')
+            return round(float(risk), 2) if np.isfinite(risk) else ''
+    except (KeyError, ValueError, TypeError, OverflowError):
+        return ''
+
+def to_float(x):
+    # Heuristic table values are entered/formatted as strings, ex. '1,250.50'. Blank values are nan
+    if x is None or x == '':
+        return np.nan
+    return float(str(x).replace(',', ''))
+
+def risk_position(risk_json, risk_key):
+    # Position of one contract from the risk report stored in the dcc.Store element, None if it isn't in the report
+    if not risk_json:
+        return None
+    for x in json.loads(risk_json):
+        if x.get('contract') == risk_key:
+            return x.get('position')
+    return None
+
+def settle_data_key(contract_name):
+    # Effective inputs of show_settle_data, the contract and the version of the daily RP pickle
+    if not contract_name:
+        return None
+    fpath = Path(blueprint.root_path, 'data', 'daily_rp').with_suffix('.pkl')
+    return [Contract.get(contract_name).risk_key, file_version(fpath)]
+
+def tables_charts_key(tnow, t, heuristic_tbl, risk_json, contract_name, rows_previous, rows):
+    # Effective inputs of generate_tables_charts, tnow is the time read by the callback. The timestamp only decides if
+    # the lookup table was just edited and only the position of the selected contract is used from the risk report, so
+    # a contract click that cascades through the other callbacks hashes to the same key
+    if ((not heuristic_tbl) and (not rows)) or (not contract_name):
+        return None
+
+    lookup_edit = bool(rows) and isinstance(t, int) and tnow == int(str(t)[:10])
+    contract = Contract.get(contract_name)
+
+    return [
+        contract_name,
+        heuristic_tbl,
+        bool(risk_json and json.loads(risk_json)),
+        risk_position(risk_json, contract.risk_key),
+        bool(rows),
+        [rows_previous, rows] if lookup_edit else None
     ]
-    style.extend(buy_style)
-
-    # Get risk report for current product and add to storage div
-    if not pos_df.empty:
-        risk_df = positions.get_risk_report(pos_df)
-        risk_df.contract = risk_df.contract.str.lower().str.replace("_", " ")
-    else:
-        risk_df = pd.DataFrame()
-
-    return risk_df, columns_dict, data, tooltip, style
 
-def main_table_positions(row_df, pos_df, prod):
-    #...... hidden .......#
-    return row_df.reset_index()
+def load_template(contract_name, kind='heuristic'):
+    # Current template/notes of a contract from the template store, or from the packed archive once the
+    # contract has expired and been compacted. Returns None if neither has it
+    return template_store.load(contract_name, kind) or archive.load(contract_name, kind)
 
-def calculate_pos_risk(df, to_calculate='position'):
-    if to_calculate == 'position':
-        # ............. hidden ............. #
-        return position
-    else:
-        # ............. hidden ............. #
-        return risk
-
-def get_add_unwind_type(string):
-    if string == 'B':
-        add = 'Buy'
-        unwind = 'Sell Back'
-    else:
-        add = 'Sell'
-        unwind = 'Buy Back'
-
-    return add, unwind
-
-def update_dropdown(product):
-    if re.search('rbob', product, re.IGNORECASE):
-        prod = 'Gasoline(rbob)'
-    elif re.search('crack|brent', product, re.IGNORECASE): # Make sure crack is reading from the brent folder
-        prod = 'Brent'
-    else:
-        prod = product
-
-    file_path = Path(blueprint.root_path, 'data', prod.capitalize(), 'expired')
-    files = os.listdir(file_path)
-
-    if re.search('crack', product, re.IGNORECASE): # Make sure that crack doesn't include brent relationships
-        files = [x for x in files if re.search('crack', x , re.IGNORECASE)]
-    elif re.search('brent', product, re.IGNORECASE) and re.search('6', product, re.IGNORECASE): # Make sure that brent 6/12 doesn't include brent
-        files = [x for x in files if (not re.search('crack', x , re.IGNORECASE)) and (re.search('6|12', x))]
-    elif re.search('brent', product, re.IGNORECASE): # Make sure that brent doesn't include crack relationships
-        files = [x for x in files if (not re.search('crack', x , re.IGNORECASE)) and (not re.search('6|12', x, re.IGNORECASE))]
-    else:
-        files = files
-
-    files = [x.split(".")[0] for x in files]
-    files = list(set(files))
-
-    return files
+# Heuristic params used to convert between position and risk, in the order of pos_risk_grid arguments
+pos_risk_params = ['Standard Deviation', 'Standard Deviation Mult', 'Tick Size', 'Tick Value']
 
+# Multiples of the heuristic std multiplier shown in the sensitivity table
+sensitivity_mults = np.array([0.5, 0.75, 1, 1.25, 1.5, 2])
 
 #------------------------------------ TABLES HTML ------------------------------------------#
-def main_table_html():
+def main_table_html(id='main-table'):
 
     table = dash_table.DataTable(
-        id='main-table',
+        id=id,
         merge_duplicate_headers = True,
         fixed_columns = {
             'headers' :True,
@@ -988,6 +1008,32 @@ def tiers_table_html(id):
     )
     return table
 
+def sensitivity_html(id):
+
+    table = dash_table.DataTable(
+        id = id,
+        columns = [],
+        data = [],
+        style_header = {
+            'backgroundColor': 'rgb(230, 230, 230)',
+            'fontWeight': 'bold'},
+        style_cell = {
+            'textAlign':'center',
+            'width' : '100px',
+            'font-family':'open sans'},
+        style_table = {
+            'margin-top' : '20px'
+        },
+        style_data_conditional = [{
+            'if' : {'row_index' : 2},
+            'fontWeight': 'bold',
+            'backgroundColor': 'rgb(247, 247, 247)',
+        }],
+        style_as_list_view=True,
+    )
+
+    return table
+
 def notes_html(id):
     textarea = dcc.Textarea(
         id = id,
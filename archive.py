@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Packed archive of expired contracts. Templates and notes of expired contracts are moved out of the template store
+(and out of the legacy data/<Product>/expired/ folders) into one SQLite file per product per year:
+
+    data/<Product>/archive/<year>.sqlite
+
+Each pack keeps the current version of its members in a table keyed by (contract, kind) and every saved version in a
+versions table keyed by (contract, kind, version), so the history of the template store is kept. The list of members
+of a pack is read once per worker and members themselves are only loaded when a contract is looked up. compact() is run as a periodic Celery
+task to move newly expired contracts into the packs.
+
+@author: sbhargava
+"""
+from .. import celery
+from . import blueprint
+from . import template_store
+from .template_store import StoredTemplate
+from .contract import Contract
+from .profiling import timed_io
+
+from datetime import datetime
+from pathlib import Path
+import sqlite3, threading, json, os
+
+# {pack path : (mtime, set of (contract, kind))}
+_members = {}
+_lock = threading.Lock()
+
+def pack_year(mmyy):
+    try:
+        return str(datetime.strptime(mmyy, '%b%y').year)
+    except ValueError:
+        return 'other'
+
+def pack_path(product, year):
+    return Path(blueprint.root_path, 'data', product, 'archive', year).with_suffix('.sqlite')
+
+def _connect(path, read_only=True):
+    if read_only:
+        return sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+
+    os.makedirs(Path(path).parent, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        '''CREATE TABLE IF NOT EXISTS members (
+            contract TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (contract, kind)
+        ) WITHOUT ROWID'''
+    )
+    conn.execute(
+        '''CREATE TABLE IF NOT EXISTS versions (
+            contract TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (contract, kind, version)
+        ) WITHOUT ROWID'''
+    )
+    return conn
+
+def members(path):
+    # Set of (contract, kind) in pack, read once and again only if the pack changed
+    if not os.path.isfile(path):
+        return set()
+
+    mtime = os.path.getmtime(path)
+    cached = _members.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    conn = _connect(path)
+    try:
+        pack_members = set(conn.execute('SELECT contract, kind FROM members').fetchall())
+    finally:
+        conn.close()
+
+    with _lock:
+        _members[path] = (mtime, pack_members)
+
+    return pack_members
+
+@timed_io('archive')
+def load(contract_name, kind='heuristic'):
+    # Template/notes of an archived contract (StoredTemplate) or None if it isn't in the archive
+    contract = Contract.get(contract_name)
+    path = pack_path(contract.product, pack_year(contract.mmyy))
+
+    if (contract_name, kind) not in members(path):
+        return None
+
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            'SELECT version, updated, data FROM members WHERE contract = ? AND kind = ?', (contract_name, kind)
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+
+    version, updated, data = row
+    return StoredTemplate(contract_name, version, json.loads(data), datetime.fromisoformat(updated), True)
+
+@timed_io('archive')
+def history(contract_name, kind='heuristic'):
+    # Every archived version of a contract's template/notes, latest first, same as template_store.history
+    contract = Contract.get(contract_name)
+    path = pack_path(contract.product, pack_year(contract.mmyy))
+
+    if (contract_name, kind) not in members(path):
+        return []
+
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            'SELECT version, updated, data FROM versions WHERE contract = ? AND kind = ? ORDER BY version DESC',
+            (contract_name, kind)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = [] # Pack written before versions were kept
+    finally:
+        conn.close()
+
+    return [
+        StoredTemplate(contract_name, version, json.loads(data), datetime.fromisoformat(updated), True)
+        for version, updated, data in rows
+    ]
+
+def list_contracts(product):
+    # Names of every archived contract of product, from the pack indices only
+    archive_dir = Path(blueprint.root_path, 'data', product, 'archive')
+    if not os.path.isdir(archive_dir):
+        return []
+
+    contracts = set()
+    for fname in os.listdir(archive_dir):
+        if fname.endswith('.sqlite'):
+            contracts.update(contract for contract, kind in members(Path(archive_dir, fname)))
+
+    return list(contracts)
+
+def _write(product, templates):
+    # Writes StoredTemplates to the packs of product, one transaction per pack. templates is [(kind, [versions])] with
+    # the current version first, every version goes to the versions table. Returns number of members written
+    packs = {}
+    for kind, versions in templates:
+        packs.setdefault(pack_year(Contract.get(versions[0].contract).mmyy), []).append([
+            (x.contract, kind, x.version, x.updated.isoformat(), json.dumps(x.data)) for x in versions
+        ])
+
+    for year, members_rows in packs.items():
+        conn = _connect(pack_path(product, year), read_only=False)
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)', [x[0] for x in members_rows])
+                conn.executemany('INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)', [y for x in members_rows for y in x])
+        finally:
+            conn.close()
+
+    return sum(len(x) for x in packs.values())
+
+def compact(products=None):
+    # Moves expired contracts from the template store and the legacy expired folders into the packs.
+    # Rows/files are only removed after the pack they were written to has been committed
+    base_path = Path(blueprint.root_path, 'data')
+    products = products or [x for x in os.listdir(base_path) if os.path.isdir(Path(base_path, x))]
+
+    count = 0
+    for product in products:
+        # Legacy files
+        expired_dir = Path(base_path, product, 'expired')
+        if os.path.isdir(expired_dir):
+            files = []
+            for fname in os.listdir(expired_dir):
+                stem, kind = os.path.splitext(fname)
+                kind = kind.replace('.', '')
+                if kind not in template_store.kinds:
+                    continue
+                filepath = Path(expired_dir, fname)
+                with open(filepath, "r") as f:
+                    data = json.load(f)
+                contract_name = ' '.join([product, stem.replace('_', ' ')])
+                updated = datetime.fromtimestamp(os.path.getmtime(filepath))
+                files.append((filepath, kind, StoredTemplate(contract_name, 1, data, updated, True)))
+
+            if files:
+                count += _write(product, [(kind, [x]) for filepath, kind, x in files])
+                for filepath, kind, x in files:
+                    os.remove(filepath)
+
+        # Expired contracts in the template store with every saved version (written after legacy files so they take
+        # precedence)
+        templates = [
+            (kind, template_store.history(template.contract, kind))
+            for kind in template_store.kinds
+            for template in template_store.load_product(product, kind, expired=True).values()
+        ]
+        if templates:
+            count += _write(product, templates)
+            template_store.delete(list({x[0].contract for kind, x in templates}), expired=True)
+
+    return count
+
+# Periodic task, moves contracts expired since the last run into the archive
+@celery.task(bind=True, name='Archive-Compaction')
+def compaction_task(self):
+    return 'SUCCESS: {} archived'.format(compact())
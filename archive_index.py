@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index of expired contracts used by the archive dropdowns in algo.py, {product : {mmyy : [relationship + side]}}.
+
+The index for a product is built once from the template store and the packed archive and updated when contracts
+expire, so both dropdowns are served with dict lookups. Routing of products that share a folder (Brent, Brent_6m and
+Brent_crack are all saved under Brent) is resolved when the index is built, using the relationships defined in pdict.
+
+@author: sbhargava
+"""
+from .products import resolve_product, product_folder, product_keys
+from .contract import Contract
+from . import template_store, archive
+
+from datetime import datetime, timedelta
+import threading
+
+# Rebuild the index of a product after this long, in case contracts were expired by another worker
+rebuild_after = timedelta(hours=1)
+
+# {pdict key : {mmyy : [labels]}} and {pdict key : time built}
+_index = {}
+_built = {}
+_lock = threading.Lock()
+
+def _add(contract_names):
+    # Adds expired contracts to the index, only for products that have already been built
+    for contract_name in contract_names:
+        contract = Contract.get(contract_name)
+        if contract.prod_lookup not in _index:
+            continue
+
+        labels = _index[contract.prod_lookup].setdefault(contract.mmyy, [])
+        label = contract.archive_label
+        if label not in labels:
+            labels.append(label)
+            labels.sort()
+
+def build(folder):
+    # (Re)builds the index of every pdict key saved in folder with one query to the template store and the indices
+    # of the archive packs
+    contracts = template_store.list_contracts(folder, expired=True) + archive.list_contracts(folder)
+
+    with _lock:
+        for prod_lookup in product_keys(folder) or [folder]:
+            _index[prod_lookup] = {}
+            _built[prod_lookup] = datetime.now()
+        _add(contracts)
+
+def get(url_product):
+    # {mmyy : [labels]} of expired contracts for product, built on first use
+    prod_lookup = resolve_product(url_product)
+    built = _built.get(prod_lookup)
+
+    if built is None or datetime.now() - built > rebuild_after:
+        build(product_folder(prod_lookup))
+
+    return _index.get(prod_lookup, {})
+
+def _month_key(mmyy):
+    try:
+        return datetime.strptime(mmyy, '%b%y')
+    except ValueError:
+        return datetime.min
+
+def month_options(url_product):
+    # Month year dropdown options, most recent first
+    months = sorted(get(url_product).keys(), key=_month_key, reverse=True)
+    return [{'label' : i, 'value' : i} for i in months]
+
+def relationship_options(url_product, mmyy):
+    # Relationship dropdown options for month year, ex. '1m Fly B'
+    return [{'label' : i, 'value' : i} for i in get(url_product).get(mmyy, [])]
+
+def on_expire(contract_names):
+    with _lock:
+        _add(contract_names)
+
+template_store.expire_hooks.append(on_expire)
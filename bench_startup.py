@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark for the Dash apps. Each mode runs in a fresh interpreter (like a new gunicorn worker) and reports
+the time to register the apps, the time of the first request and the peak memory of the worker.
+
+    eager : algo.Add_Dash(server) and summary.Add_Dash(server) at startup
+    lazy : lazy.register(server), apps built on first request
+
+ex. python -m <package>.bench_startup
+    python -m <package>.bench_startup --factory website:create_app
+
+The factory (module:callable) returns the Flask website without the Dash apps registered, a bare Flask app is used by
+default.
+
+@author: sbhargava
+"""
+import argparse, importlib, resource, subprocess, json, time, sys
+
+modes = ['eager', 'lazy']
+
+def make_server(factory):
+    if factory:
+        module, func = factory.split(':')
+        return getattr(importlib.import_module(module), func)()
+
+    from flask import Flask
+    server = Flask(__name__)
+    server.config['SECRET_KEY'] = 'bench'
+    return server
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run(mode, factory):
+    # Runs one mode in this interpreter and returns the measurements
+    package = __package__
+    server = make_server(factory)
+    base_rss = peak_rss_mb()
+
+    start = time.time()
+    if mode == 'eager':
+        importlib.import_module('.algo', package).Add_Dash(server)
+        importlib.import_module('.summary', package).Add_Dash(server)
+        importlib.import_module('.desk', package).Add_Dash(server)
+    else:
+        importlib.import_module('.lazy', package).register(server)
+    startup = time.time() - start
+    startup_rss = peak_rss_mb()
+    dash_at_startup = 'dash' in sys.modules
+
+    client = server.test_client()
+    start = time.time()
+    for url in ['/dash/', '/dash/Summary/']:
+        client.get(url)
+    first_request = time.time() - start
+
+    return {
+        'mode' : mode,
+        'startup_s' : round(startup, 3),
+        'first_request_s' : round(first_request, 3),
+        'startup_rss_mb' : round(startup_rss - base_rss, 1),
+        'peak_rss_mb' : round(peak_rss_mb(), 1),
+        'dash_at_startup' : dash_at_startup,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time and memory of the Dash apps')
+    parser.add_argument('--factory', default='', help='module:callable returning the Flask website')
+    parser.add_argument('--mode', choices=modes, help='Run a single mode in this interpreter')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.factory)))
+        return
+
+    results = []
+    for mode in modes:
+        cmd = [sys.executable, '-m', __spec__.name, '--mode', mode, '--factory', args.factory]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    row = '{:<8}{:>12}{:>18}{:>18}{:>14}{:>16}'
+    print(row.format('mode', 'startup (s)', 'first request (s)', 'startup RSS (MB)', 'peak RSS (MB)', 'dash at startup'))
+    for x in results:
+        print(row.format(
+            x['mode'], x['startup_s'], x['first_request_s'], x['startup_rss_mb'], x['peak_rss_mb'], str(x['dash_at_startup'])
+        ))
+
+if __name__ == '__main__':
+    main()
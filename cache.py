@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache shared by every worker of the Flask site, used by algo.py and summary.py (and the modules built on them) so
+that main tables, RP snapshots, template indices and ladders are computed once for the whole server.
+
+There are two tiers:
+    - an in-process LRU tier holding values for a few seconds, so repeated reads in one request cycle don't go to
+      the shared tier
+    - a shared tier, a local Redis (CACHE_REDIS_URL environment variable) or a SQLite file next to the other data
+      files when Redis isn't available
+
+Entries are grouped in namespaces. Each namespace has a version kept in the shared tier and part of every key, so
+bump(namespace) invalidates every entry of the namespace in every worker (ex. after a template is saved). Hits and
+misses are counted per namespace, see stats().
+
+Heavy callbacks are memoized by a hash of their effective inputs. Bursts of identical calls are coalesced: the first
+caller takes a short lease on the key and computes the value, the others (threads of the same worker or other
+workers) wait for the value instead of computing it again.
+
+ex.
+    @memoize(ttl=600, key=lambda contract_name, rows : [contract_name, rows], namespace='ladders')
+    def heavy_callback(contract_name, rows):
+        ...
+
+@author: sbhargava
+"""
+from . import blueprint
+from . import profiling
+
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import functools, threading, hashlib, pickle, sqlite3, json, time, os
+import pandas as pd
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+cache_path = Path(blueprint.root_path, 'data', 'cache').with_suffix('.sqlite')
+
+# Marker for a cache miss, None is a valid value
+MISS = object()
+
+class LRUTier:
+    # In-process tier, least recently used entries are dropped after maxsize
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            if entry[1] < time.time():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class SQLiteTier:
+    # Shared tier backed by a SQLite file, safe to use from several processes on the same server
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(Path(self.path).parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISS
+        return pickle.loads(row[0])
+
+    def get_many(self, keys):
+        # Values of keys (MISS if missing/expired) in one query
+        rows = self._conn().execute(
+            'SELECT key, value, expires FROM cache WHERE key IN ({})'.format(','.join('?' * len(keys))), list(keys)
+        ).fetchall() if keys else []
+        found = {k : pickle.loads(v) for k, v, expires in rows if expires >= time.time()}
+        return [found.get(k, MISS) for k in keys]
+
+    def set(self, key, value, ttl):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+            (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), time.time() + ttl)
+        )
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def lease(self, key, ttl):
+        # Takes a lease on key for ttl seconds, False if another caller holds it
+        conn = self._conn()
+        now = time.time()
+        conn.execute('DELETE FROM leases WHERE key = ? AND expires < ?', (key, now))
+        return conn.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)', (key, now + ttl)).rowcount == 1
+
+    def release(self, key):
+        self._conn().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+    def version(self, namespace):
+        row = self._conn().execute('SELECT version FROM versions WHERE namespace = ?', (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO versions VALUES (?, 1) ON CONFLICT(namespace) DO UPDATE SET version = version + 1',
+            (namespace,)
+        )
+        return self.version(namespace)
+
+    def purge(self):
+        # Removes expired entries
+        now = time.time()
+        conn = self._conn()
+        conn.execute('DELETE FROM cache WHERE expires < ?', (now,))
+        conn.execute('DELETE FROM leases WHERE expires < ?', (now,))
+
+class RedisTier:
+    # Shared tier backed by Redis, ex. RedisTier('redis://localhost:6379/1')
+    def __init__(self, url, prefix='dash-cache:'):
+        if redis is None:
+            raise RuntimeError('redis is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return MISS if value is None else pickle.loads(value)
+
+    def get_many(self, keys):
+        values = self.client.mget([self.prefix + k for k in keys]) if keys else []
+        return [MISS if x is None else pickle.loads(x) for x in values]
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def lease(self, key, ttl):
+        return bool(self.client.set(self.prefix + 'lease:' + key, 1, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key):
+        self.client.delete(self.prefix + 'lease:' + key)
+
+    def version(self, namespace):
+        return int(self.client.get(self.prefix + 'version:' + namespace) or 0)
+
+    def bump(self, namespace):
+        return self.client.incr(self.prefix + 'version:' + namespace)
+
+    def purge(self):
+        # Redis expires entries itself
+        pass
+
+class Cache:
+    # Local LRU tier in front of a shared tier, with namespace versions and hit/miss counters
+    def __init__(self, shared, local_size=256, local_ttl=5, version_ttl=1):
+        self.shared = shared
+        self.local = LRUTier(local_size)
+        self.local_ttl = local_ttl # Max time a worker holds a value without checking the shared tier
+        self.version_ttl = version_ttl # Max time a worker uses a namespace version without checking the shared tier
+        self._versions = LRUTier(1024)
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, event):
+        with self._lock:
+            self._counts[(namespace, event)] += 1
+
+    def version(self, namespace):
+        version = self._versions.get(namespace)
+        if version is MISS:
+            version = self.shared.version(namespace)
+            self._versions.set(namespace, version, self.version_ttl)
+        return version
+
+    def bump(self, namespace):
+        # Invalidates every entry of namespace, in every worker
+        version = self.shared.bump(namespace)
+        self._versions.set(namespace, version, self.version_ttl)
+        return version
+
+    def key(self, namespace, parts):
+        return ':'.join([namespace, str(self.version(namespace)), input_hash(parts)])
+
+    def get(self, namespace, parts):
+        return self.get_key(namespace, self.key(namespace, parts))
+
+    def set(self, namespace, parts, value, ttl):
+        self.set_key(self.key(namespace, parts), value, ttl)
+
+    def get_key(self, namespace, key):
+        value = self.local.get(key)
+        if value is not MISS:
+            self._count(namespace, 'local_hits')
+            return value
+
+        value = self.shared.get(key)
+        if value is not MISS:
+            self._count(namespace, 'shared_hits')
+            self.local.set(key, value, self.local_ttl)
+            return value
+
+        self._count(namespace, 'misses')
+        return MISS
+
+    def get_many(self, namespace, parts_list):
+        # Values of several entries of a namespace, missing ones from the shared tier in one read
+        keys = [self.key(namespace, x) for x in parts_list]
+        values = [self.local.get(x) for x in keys]
+        missing = [i for i, x in enumerate(values) if x is MISS]
+
+        for i, value in zip(missing, self.shared.get_many([keys[i] for i in missing]) if missing else []):
+            if value is not MISS:
+                self.local.set(keys[i], value, self.local_ttl)
+            values[i] = value
+
+        for i, value in enumerate(values):
+            self._count(namespace, 'misses' if value is MISS else 'shared_hits' if i in missing else 'local_hits')
+        return values
+
+    def set_key(self, key, value, ttl):
+        self.shared.set(key, value, ttl)
+        self.local.set(key, value, min(ttl, self.local_ttl))
+
+    def get_or_set(self, namespace, parts, func, ttl=300):
+        value = self.get(namespace, parts)
+        if value is MISS:
+            value = func()
+            self.set(namespace, parts, value, ttl)
+        return value
+
+    def stats(self):
+        # {namespace : {'local_hits', 'shared_hits', 'misses'}} counted in this worker since it started
+        with self._lock:
+            counts = dict(self._counts)
+
+        stats = {}
+        for (namespace, event), n in counts.items():
+            stats.setdefault(namespace, {'local_hits' : 0, 'shared_hits' : 0, 'misses' : 0})[event] = n
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+def default_shared():
+    # Redis if configured, otherwise the SQLite file
+    url = os.environ.get('CACHE_REDIS_URL')
+    if url and redis is not None:
+        return RedisTier(url)
+    return SQLiteTier(cache_path)
+
+cache = Cache(default_shared())
+
+def configure(shared=None, local_size=256, local_ttl=5):
+    # Swaps the cache used by the apps, ex. configure(SQLiteTier('/tmp/test.sqlite'))
+    global cache
+    cache = Cache(shared or default_shared(), local_size=local_size, local_ttl=local_ttl)
+    return cache
+
+def get_cache():
+    return cache
+
+class KeyLocks:
+    # One lock per key, kept only while a caller holds or waits for it
+    def __init__(self):
+        self._locks = {} # {key : [lock, users]}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+_key_locks = KeyLocks()
+
+def input_hash(parts):
+    # Stable hash of the (JSON like) inputs of a call
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def memoize(ttl=300, key=None, coalesce_window=2.0, namespace=None):
+    # Memoizes a function by a hash of its effective inputs. 'key' takes the same arguments as the function and
+    # returns the inputs the output actually depends on (all arguments by default), or None to skip the cache.
+    # namespace defaults to the function name. Exceptions (ex. PreventUpdate) are never cached.
+    def decorator(func):
+        ns = namespace or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = key(*args, **kwargs) if key else [list(args), kwargs]
+            if parts is None:
+                return func(*args, **kwargs)
+
+            c = get_cache()
+            cache_key = ':'.join([c.key(ns, parts), func.__name__])
+            value = c.get_key(ns, cache_key)
+            if value is not MISS:
+                return value
+
+            # Check and lease under the key's lock only, the compute runs without it so other keys aren't held up
+            # and a memoized function can call another one
+            with _key_locks(cache_key):
+                value = c.local.get(cache_key)
+                if value is MISS:
+                    value = c.shared.get(cache_key)
+                if value is not MISS:
+                    return value
+                leased = c.shared.lease(cache_key, coalesce_window)
+
+            # Another worker/thread is computing the same state, wait for it and compute it here if it doesn't show up
+            if not leased:
+                value = wait(c, cache_key, coalesce_window)
+                if value is not MISS:
+                    return value
+
+            try:
+                value = func(*args, **kwargs)
+                c.set_key(cache_key, value, ttl)
+            finally:
+                # Only release a lease this call holds, not the one of the caller it waited for
+                if leased:
+                    c.shared.release(cache_key)
+
+            return value
+        return wrapper
+    return decorator
+
+def wait(c, key, timeout, interval=0.05):
+    # Waits up to timeout for another caller to set key in the shared tier
+    end = time.time() + timeout
+    while time.time() < end:
+        value = c.shared.get(key)
+        if value is not MISS:
+            return value
+        time.sleep(interval)
+    return MISS
+
+def file_version(path):
+    # Modified time of a file, used in keys of values derived from data files (ex. daily RP pickle)
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+    except OSError:
+        return None
+
+def read_pickle(path, ttl=86400):
+    # Snapshot read from a pickle (ex. daily RP), read once per version of the file for the whole server.
+    # The DataFrame is shared, callers must not modify it in place
+    def load():
+        with profiling.io('pickle'):
+            return pd.read_pickle(path)
+    return get_cache().get_or_set('pickles', [str(path), file_version(path)], load, ttl)
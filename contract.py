@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contract identity shared by the Dash apps (algo.py, summary.py) and the modules built on top of them.
+
+A contract is parsed once from any of the forms it shows up in and interned, every later lookup of the same contract
+returns the same object:
+- name : 'Brent 1m Fly Jan21 B' (contract-name element, template store)
+- id : 'BRENT_1m_Fly_Jan21_B' (position ids, summary lists, URLs)
+- main table cell : {'row_id' : 'Brent 1m Fly', 'column_id' : 'Jan21 B'}
+- archive dropdowns : product from URL, '1m Fly B' and 'Jan21'
+
+The routing of products saved under the same folder (crack, Brent 6m/12m, rbob) is resolved here once per contract.
+
+@author: sbhargava
+"""
+from .products import resolve_product, product_folder, route
+
+import threading
+
+_interned = {}
+_lock = threading.Lock()
+
+class Contract:
+    __slots__ = (
+        'name', 'product', 'prod_lookup', 'duration', 'relationship', 'mmyy', 'side',
+        'add', 'unwind', 'risk_key', 'position_contract', 'contract_id', 'store_key',
+        'row_id', 'column_id', 'archive_label', 'url_path',
+    )
+
+    def __init__(self, name):
+        prod, rel = name.split(" ", 1)
+        rel, mmyy, b_s = rel.rsplit(" ", 2)
+
+        self.name = name # 'Brent 1m Fly Jan21 B'
+        self.product = prod # 'Brent', product templates are saved under
+        self.prod_lookup = route(prod, rel) # pdict key, ex. 'Brent_crack'
+        self.duration = rel.split(" ")[0] # '1m', '6m', 'consecutive'
+        self.relationship = rel # '1m Fly'
+        self.mmyy = mmyy # 'Jan21'
+        self.side = b_s # 'B' or 'S'
+
+        if b_s == 'B':
+            self.add, self.unwind = 'Buy', 'Sell Back'
+        else:
+            self.add, self.unwind = 'Sell', 'Buy Back'
+
+        self.risk_key = name[:-2].lower() # 'brent 1m fly jan21', index of risk report/daily RP
+        self.position_contract = name[:-2].replace(' ', '_') # 'Brent_1m_Fly_Jan21', risk report input
+        self.contract_id = '_'.join([prod.upper(), ' '.join([rel, mmyy, b_s]).replace(' ', '_')]) # 'BRENT_1m_Fly_Jan21_B'
+        self.store_key = (prod, rel, mmyy, b_s) # template store key
+        self.row_id = ' '.join([prod, rel]) # main table cell
+        self.column_id = ' '.join([mmyy, b_s])
+        self.archive_label = ' '.join([rel, b_s]) # relationship dropdown
+        self.url_path = '/'.join(['dash', self.prod_lookup.lower(), self.contract_id])
+
+    def __setattr__(self, key, value):
+        if hasattr(self, key):
+            raise AttributeError('Contract is immutable')
+        object.__setattr__(self, key, value)
+
+    def __repr__(self):
+        return 'Contract({!r})'.format(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Contract) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    @classmethod
+    def get(cls, name):
+        # Interned contract for name, parsed only the first time it is seen
+        contract = _interned.get(name)
+        if contract is None:
+            contract = cls(name)
+            with _lock:
+                contract = _interned.setdefault(name, contract)
+        return contract
+
+    @classmethod
+    def from_id(cls, contract_id):
+        # 'BRENT_1m_Fly_Jan21_B'
+        prod, rel = contract_id.split("_", 1)
+        return cls.get(' '.join([prod.capitalize(), rel.replace('_', ' ')]))
+
+    @classmethod
+    def from_cell(cls, active_cell):
+        # Selected cell of the main table
+        return cls.get(' '.join([active_cell['row_id'], active_cell['column_id']]))
+
+    @classmethod
+    def from_archive(cls, url_product, label, mmyy):
+        # Archive dropdowns, ex. ('Brent_crack', '1m Crack B', 'Jan21')
+        prod = product_folder(resolve_product(url_product))
+        return cls.get(' '.join([prod, label[:-2], mmyy, label[-1]]))
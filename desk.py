@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Desk view: the main tables of several products on one page, for traders covering more than one product.
+
+The products are selected in the dropdown or from the URL, ex. /dash/Desk/?products=Brent,Ho,Go. The tables are built
+by init_main_tables (algo.py) with one positions query, one risk report and one snapshot read for the whole desk.
+Product names link to the product page for trading logic.
+
+@author: sbhargava
+"""
+from . import blueprint
+from ..dash_utils import apply_layout_with_auth
+from .products import pdict
+from .algo import init_main_tables, main_table_html
+from . import profiling, main_tables
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+import dash_html_components as html
+import dash_core_components as dcc
+from urllib.parse import parse_qs
+from pathlib import Path
+from dash import Dash
+
+url_base = '/dash/Desk/'
+
+def Add_Dash(server):
+
+    external_stylesheets=['https://codepen.io/chriddyp/pen/bWLwgP.css']
+    assets_folder = Path(blueprint.root_path, 'assets')
+    app = Dash(server=server, url_base_pathname = url_base, external_stylesheets=external_stylesheets, assets_folder = assets_folder)
+
+    app.config.suppress_callback_exceptions = True
+
+    layout = html.Div([
+        dcc.Location(id='url', refresh = False),
+
+        # Risk report of every product on the desk
+        dcc.Store(id = 'desk-risk-report'),
+
+        html.Div([
+            dcc.Dropdown(
+                id = 'desk-products',
+                options = [{'label' : x, 'value' : x} for x in pdict],
+                multi = True,
+                placeholder = 'Select Products',
+                className = 'six columns'
+            ),
+        ], className = 'row'),
+
+        html.Div(id = 'desk-tables'),
+    ])
+
+    # Define Dash app to work with the authorizations of Flask app
+    apply_layout_with_auth(app, layout)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    @app.callback(
+    Output('desk-products', 'value'),
+    [Input('url', 'search')])
+    def set_products(search):
+        # Products selected through the URL, ex. ?products=Brent,Ho
+        if not search:
+            raise PreventUpdate
+
+        products = parse_qs(search.lstrip('?')).get('products', [''])[0].split(',')
+        return [x for x in products if x in pdict]
+
+    #-------------------------------------------------------------------------------------------------------------#
+    @app.callback(
+    [Output('desk-tables', 'children'),
+    Output('desk-risk-report', 'data')],
+    [Input('desk-products', 'value')])
+    def create_desk_tables(products):
+        # Main tables of the selected products from one batch (positions, risk report and snapshots)
+        if not products:
+            return [], None
+
+        risk_df, tables = init_main_tables(products)
+
+        children = []
+        for i, prod_lookup in enumerate(products):
+            if prod_lookup not in tables:
+                continue
+
+            columns, data, tooltip, style = tables[prod_lookup]
+            data, tooltip = main_tables.oi_overlay(columns, data, tooltip)
+
+            table = main_table_html(id = 'desk-table-{}'.format(i))
+            table.columns = columns
+            table.data = data
+            table.tooltip_data = tooltip
+            table.style_data_conditional = style
+
+            children.extend([
+                html.H6(
+                    html.A(prod_lookup, href = '/dash/{}/'.format(prod_lookup.lower()), style = {'text-decoration' : 'none'}),
+                    style={"textAlign" : "left", "color" : "#425270", "font-weight" : "600"}
+                ),
+                table,
+            ])
+
+        return children, risk_df.to_json(orient='records')
+
+    profiling.instrument(app)
+
+    return app.server
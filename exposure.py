@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Portfolio-wide aggregation of the add/unwind ladders defined in algo.py. Loads every active template from the
+template store, builds the ladders (through whatif.py) and computes the total target position and risk we would carry by product and
+by outright leg, for the adding and the unwinding ladders, under:
+- std scenarios : every contract's price moves by the same number of standard deviations from settle
+- curve scenarios : the outright curve of a product moves by a shape (parallel, slope, curvature) and each
+                    contract's price moves by the weighted sum of its legs
+
+Runs on demand (scan_all, one product after the other in the caller's app context) or as the background Exposure-Scan
+Celery task, which fans out one Exposure-Scan-Product subtask per product joined by a chord whose Exposure-Save callback
+combines the products and saves the result next to the daily RP pickle.
+
+@author: sbhargava
+"""
+from .. import celery
+from . import blueprint
+from .products import pdict, product_folder
+from .contract import Contract
+from .algo import pos_risk_grid, pos_risk_params, to_float
+from . import whatif, ticker_meta
+from .cache import read_pickle
+
+from celery import chord
+from datetime import datetime, date
+from pathlib import Path
+import re, json
+import pandas as pd
+import numpy as np
+
+# Leg weights of each relationship type. Relationships not in here (crack, cross product spreads) are
+# included in product totals but can't be split into outright legs
+leg_weights = {
+    'fly' : [1, -2, 1],
+    '2x' : [1, -3, 3, -1],
+    'dc' : [1, -1, -1, 1],
+}
+
+# Outright curve shapes, change in price per unit of size for legs 't' months from the front month
+curve_shapes = {
+    'parallel' : lambda t : np.ones(len(t)),
+    'slope' : lambda t : t / 12.0,
+    'curvature' : lambda t : (t / 12.0) ** 2,
+}
+
+default_std_shocks = np.arange(-3, 3.5, 0.5)
+
+def add_months(mmyy, n):
+    # ex. add_months('Nov20', 3) -> 'Feb21'
+    d = datetime.strptime(mmyy, '%b%y')
+    m = d.month - 1 + n
+    return date(d.year + m // 12, m % 12 + 1, 1).strftime('%b%y')
+
+def months_between(mmyy_1, mmyy_2):
+    d1 = datetime.strptime(mmyy_1, '%b%y')
+    d2 = datetime.strptime(mmyy_2, '%b%y')
+    return (d2.year - d1.year) * 12 + d2.month - d1.month
+
+def listed_months(prod):
+    # Months listed for product, read in from file generated by RP morning scripts (same file as the main table)
+    df = read_pickle(Path(blueprint.root_path, 'data', 'prod_mmyy.pkl'))
+    try:
+        return list(filter(None, df[df.index.str.upper() == prod.upper()].values.tolist()[0]))
+    except IndexError:
+        return []
+
+def contract_legs(contract_name, listed):
+    # Splits a contract into its outright legs, [(mmyy, weight)], or [] if the relationship can't be split.
+    # 'Nm' relationships step through calendar months, 'consecutive' relationships step through listed months
+    contract = Contract.get(contract_name)
+    mmyy = contract.mmyy
+    weights = leg_weights.get(contract.relationship.split(" ")[-1].lower())
+    if not weights:
+        return []
+
+    if re.search('consecutive', contract.duration, re.IGNORECASE):
+        if mmyy not in listed:
+            return []
+        i = listed.index(mmyy)
+        months = listed[i:i + len(weights)]
+        if len(months) < len(weights):
+            return []
+    else:
+        step = int(contract.duration.lower().replace('m', ''))
+        months = [add_months(mmyy, step * i) for i in range(len(weights))]
+
+    return list(zip(months, weights))
+
+def risk_params(template, std):
+    # Heuristic values used to convert position to risk, in the order of pos_risk_grid arguments
+    values = {x['Params'] : x['Value'] for x in template.data}
+    values['Standard Deviation'] = std
+    return [to_float(values[x]) for x in pos_risk_params]
+
+def scan_product(prod_lookup, std_shocks=default_std_shocks, curves=None):
+    # Total position and risk for all contracts of the product (pdict key) under each scenario, per ladder ('chart'
+    # column, 'Adding' or 'Unwinding').
+    # curves : {label : (shape, size)}, shape is a key of curve_shapes or a function of months from front month and
+    # size is in price units of the product, ex. {'steepen 0.5' : ('slope', 0.5)}
+    # Returns (totals, legs) DataFrames
+    curves = curves or {}
+    prod = product_folder(prod_lookup)
+    round_to = ticker_meta.round_for(prod_lookup)
+    templates = whatif.load_templates(prod_lookup)
+    std_dict = whatif.get_std(list(templates.keys()))
+    settle = whatif.get_settle_prices()
+    listed = listed_months(prod)
+    front = listed[0] if listed else None
+
+    std_shocks = np.asarray(std_shocks, dtype=float)
+    labels = ['{:+g} std'.format(x) for x in std_shocks] + list(curves.keys())
+
+    contracts, charts, pos_rows, params_rows, contract_leg_list = [], [], [], [], []
+    for contract_name, template in templates.items():
+        key = Contract.get(contract_name).risk_key
+        std = std_dict.get(key)
+        if key not in settle or not std:
+            continue
+
+        try:
+            ladders = whatif.get_ladders(contract_name, template, std, prod_lookup)
+            params = risk_params(template, std)
+        except:
+            continue
+
+        legs = contract_legs(contract_name, listed)
+        prices = [settle[key] + std * std_shocks]
+        for shape, size in curves.values():
+            shape = curve_shapes[shape] if isinstance(shape, str) else shape
+            if legs and front:
+                t = np.array([months_between(front, m) for m, w in legs], dtype=float)
+                w = np.array([w for m, w in legs], dtype=float)
+                prices.append([settle[key] + size * np.dot(w, shape(t))])
+            else:
+                prices.append([settle[key]])
+        prices = np.concatenate(prices)
+
+        # One row per ladder, adding and unwinding exposure are reported separately
+        for chart, (logic_type, ladder) in ladders.items():
+            qty, pos = whatif.evaluate_ladder(ladder, prices, logic_type, round_to)
+            contracts.append(contract_name)
+            charts.append(chart)
+            pos_rows.append(pos)
+            params_rows.append(params)
+            contract_leg_list.append(legs)
+
+    if not contracts:
+        return pd.DataFrame(), pd.DataFrame()
+
+    # ladders x scenarios
+    charts = np.array(charts)
+    pos_arr = np.vstack(pos_rows)
+    std_arr, mult_arr, tick_size_arr, tick_value_arr = np.array(params_rows, dtype=float).T[:, :, None]
+    risk_arr = np.nan_to_num(pos_risk_grid(std_arr, mult_arr, tick_size_arr, tick_value_arr, np.abs(pos_arr), 'risk'))
+
+    totals = pd.concat([
+        pd.DataFrame({
+            'product' : prod_lookup,
+            'chart' : chart,
+            'scenario' : labels,
+            'position' : pos_arr[charts == chart].sum(axis=0),
+            'gross position' : np.abs(pos_arr[charts == chart]).sum(axis=0),
+            'risk' : risk_arr[charts == chart].sum(axis=0),
+            'contracts' : (pos_arr[charts == chart] != 0).sum(axis=0),
+        }) for chart in pd.unique(charts)
+    ], ignore_index=True)
+
+    # Outright legs x ladders weight matrix, shared legs are combined through the matrix product
+    leg_months = sorted({m for legs in contract_leg_list for m, w in legs}, key=lambda x : datetime.strptime(x, '%b%y'))
+    if leg_months:
+        leg_idx = {m : i for i, m in enumerate(leg_months)}
+        legs_list = []
+        for chart in pd.unique(charts):
+            rows = np.flatnonzero(charts == chart)
+            weight_arr = np.zeros((len(leg_months), len(rows)))
+            for j, i in enumerate(rows):
+                for m, w in contract_leg_list[i]:
+                    weight_arr[leg_idx[m], j] += w
+            legs_df = pd.DataFrame(weight_arr @ pos_arr[rows], index=leg_months, columns=labels)
+            legs_df.index.name = 'month'
+            legs_df = legs_df.reset_index().melt(id_vars='month', var_name='scenario', value_name='position')
+            legs_df.insert(0, 'chart', chart)
+            legs_list.append(legs_df)
+        legs_df = pd.concat(legs_list, ignore_index=True)
+        legs_df.insert(0, 'product', prod)
+    else:
+        legs_df = pd.DataFrame()
+
+    return totals, legs_df
+
+def combine(results):
+    # Combines the (totals, legs) of several products. Legs are combined across pdict keys sharing the same outrights
+    # (ex. Brent and Brent_6m)
+    totals_list = [x[0] for x in results if not x[0].empty]
+    totals = pd.concat(totals_list, ignore_index=True) if totals_list else pd.DataFrame()
+    legs_list = [x[1] for x in results if not x[1].empty]
+    if legs_list:
+        legs = pd.concat(legs_list, ignore_index=True)
+        legs = legs.groupby(['product', 'chart', 'month', 'scenario'], sort=False, as_index=False)['position'].sum()
+    else:
+        legs = pd.DataFrame()
+
+    return totals, legs
+
+def scan_all(products=None, std_shocks=default_std_shocks, curves=None):
+    # Scans all products (or the given pdict keys) one after the other in the caller's app context and combines the
+    # results, for on-demand scans. The background scan fans out per product (exposure_scan)
+    # Products missing from TickerData are skipped and reported in totals.attrs['skipped'], {product : error}
+    products = products or list(pdict.keys())
+
+    results, skipped = [], {}
+    for prod_lookup in products:
+        try:
+            results.append(scan_product(prod_lookup, std_shocks, curves))
+        except ticker_meta.UnknownTicker as e:
+            skipped[prod_lookup] = str(e)
+
+    totals, legs = combine(results)
+    totals.attrs['skipped'] = skipped
+    return totals, legs
+
+# Per product subtask, runs in the worker's app context like the other tasks of the site. curves shapes must be keys
+# of curve_shapes so they can be sent to the worker
+@celery.task(bind=True, name='Exposure-Scan-Product')
+def scan_product_task(self, prod_lookup, std_shocks, curves=None):
+    try:
+        totals, legs = scan_product(prod_lookup, std_shocks, curves)
+    except Exception as exc:
+        # Reported in the result of the save task, the other products are still saved
+        return {'product' : prod_lookup, 'status' : 'ERROR', 'error' : repr(exc)}
+
+    return {
+        'product' : prod_lookup,
+        'status' : 'SUCCESS',
+        'totals' : json.loads(totals.to_json(orient='records')),
+        'legs' : json.loads(legs.to_json(orient='records')),
+    }
+
+# Chord callback: combines every product that was scanned and saves the result
+@celery.task(bind=True, name='Exposure-Save')
+def save_task(self, results):
+    succeeded = [x for x in results if x['status'] == 'SUCCESS']
+    totals, legs = combine([(pd.DataFrame(x['totals']), pd.DataFrame(x['legs'])) for x in succeeded])
+    errors = {x['product'] : x['error'] for x in results if x['status'] != 'SUCCESS'}
+
+    fpath = Path(blueprint.root_path, 'data', 'exposure').with_suffix('.pkl')
+    pd.to_pickle({'totals' : totals, 'legs' : legs, 'errors' : errors, 'timestamp' : datetime.now()}, fpath)
+
+    return {'scenarios' : totals.shape[0], 'errors' : errors}
+
+# Background job, result is read in by other processes the same way as the daily RP pickle
+# Fans out one subtask per product, joined by a chord that combines and saves them
+@celery.task(bind=True, name='Exposure-Scan')
+def exposure_scan(self, products=None):
+    products = products or list(pdict.keys())
+    std_shocks = [float(x) for x in default_std_shocks]
+
+    result = chord(scan_product_task.s(x, std_shocks) for x in products)(save_task.s())
+
+    return 'STARTED: {} products, save task {}'.format(len(products), result.id)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Celery task to create Google Calendar invites outside of the Dash request, so that a slow Google API call doesn't tie
+up a web worker. The UI in algo.py polls invite_status() until the invite is created, has failed or is still pending
+invite_timeout seconds after it was submitted (ex. unknown task id, or no worker running).
+
+The client creating the invite is pluggable, set_client(FakeInviteClient()) stands in for Google during tests
+(with Celery's task_always_eager setting so the task runs in the same process).
+
+@author: sbhargava
+"""
+from .. import celery
+from .google_invite import google_calendar_invite
+
+from datetime import datetime
+import time
+
+# Anything with main(event_name, start_date) that returns the link to the event
+_client = google_calendar_invite
+
+# Seconds after which a pending invite is reported as failed, covers the retries of create_invite
+invite_timeout = 60
+
+def set_client(client):
+    global _client
+    _client = client
+
+def get_client():
+    return _client
+
+class FakeInviteClient:
+    # Local stand in for the Google client, records invites instead of creating them
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.invites = []
+
+    def main(self, event_name, start_date):
+        if self.fail:
+            raise RuntimeError('Fake invite failure')
+        self.invites.append((event_name, start_date))
+        return 'https://calendar.google.com/calendar/fake/{}'.format(len(self.invites))
+
+@celery.task(bind=True, name='Calendar-Invite', max_retries=2, default_retry_delay=5)
+def create_invite(self, event_name, start_date):
+    # start_date is in the format of the date picker, 'YYYY-MM-DD'. Returns the link to the event
+    start_date = datetime.strptime(start_date, '%Y-%m-%d')
+    try:
+        return get_client().main(event_name=event_name, start_date=start_date)
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+def invite_status(task_id, submitted=None):
+    # ('pending', None), ('created', link) or ('failed', error message). submitted is the time.time() the task was
+    # queued at, Celery reports unknown task ids as pending so they fail once invite_timeout has passed
+    result = create_invite.AsyncResult(task_id)
+
+    if result.successful():
+        return 'created', result.result
+    elif result.failed():
+        return 'failed', str(result.result)
+    elif submitted is not None and time.time() - submitted > invite_timeout:
+        return 'failed', 'no response after {} seconds'.format(invite_timeout)
+    else:
+        return 'pending', None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled export of the add/unwind ladders of every contract with a trading template, for the execution side.
+
+Each contract's ladders are written to data/ladders/<prod_lookup>/<contract_id>.ladder, a fixed-width binary file
+(see ladder_reader.py for the format and the reader) holding the price, qty/level and cumulative position arrays of
+each side, with the template version and std they were built from.
+
+Saving a heuristic template queues the Ladder-Export-Contract task for the contract (template_store.save_hooks). The
+periodic Ladder-Export task goes through every product with one risk report per product and only recompiles the
+contracts whose template version or std changed, and removes the files of contracts without an active template.
+
+@author: sbhargava
+"""
+from .. import celery
+from . import blueprint
+from .products import pdict
+from .contract import Contract
+from . import template_store, ticker_meta, ladder_reader
+
+from pathlib import Path
+import os
+import numpy as np
+
+def ladder_dir():
+    return Path(blueprint.root_path, 'data', 'ladders')
+
+def ladder_path(contract_name):
+    contract = Contract.get(contract_name)
+    return Path(ladder_dir(), contract.prod_lookup, contract.contract_id + ladder_reader.suffix)
+
+def _std(std):
+    # Std as stored in the header, nan if unknown ('' when the risk report isn't available)
+    try:
+        return float(std)
+    except (TypeError, ValueError):
+        return np.nan
+
+def up_to_date(path, version, std):
+    stored = ladder_reader.read_header(path)
+    if stored is None or stored[0] != version:
+        return False
+    return stored[1] == _std(std) or (np.isnan(stored[1]) and np.isnan(_std(std)))
+
+def write(path, ladders, version, std, round_to):
+    # Writes the ladders ({'Adding' / 'Unwinding' : (logic, (price, qty, position))}, see whatif.get_ladders) next to
+    # the file and renames it into place, readers never see a partial file
+    sides = [ladders[x] for x in ladder_reader.charts]
+    head = ladder_reader.header.pack(
+        ladder_reader.magic, ladder_reader.format_version, round_to,
+        *[b'B' if logic.lower().startswith('buy') else b'S' for logic, arrays in sides], # 'Buy' and 'Buy Back'
+        version, *[len(arrays[0]) for logic, arrays in sides], _std(std)
+    )
+
+    os.makedirs(path.parent, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(head)
+        for logic, arrays in sides:
+            for x in arrays:
+                f.write(np.ascontiguousarray(x, dtype='<f8').tobytes())
+    os.replace(tmp, path)
+
+def export_contract(contract_name, template=None, std=None, force=False):
+    # Compiles the ladders of a contract if its template or std changed since the last export. Returns True if the
+    # file was (re)written. The file is removed if the contract has no active template
+    from . import whatif # whatif imports algo
+
+    contract = Contract.get(contract_name)
+    path = ladder_path(contract_name)
+    template = template or template_store.load(contract_name, 'heuristic')
+    if template is None or template.expired:
+        if path.exists():
+            os.remove(path)
+        return False
+
+    if std is None:
+        std = whatif.get_std([contract_name]).get(contract.risk_key, '')
+    if not force and up_to_date(path, template.version, std):
+        return False
+
+    ladders = whatif.get_ladders(contract_name, template, std, contract.prod_lookup)
+    write(path, ladders, template.version, std, ticker_meta.round_for(contract.prod_lookup))
+    return True
+
+def export_product(prod_lookup, force=False):
+    # Recompiles the changed ladders of a product (one risk report for every contract) and removes the files of
+    # contracts without an active template. Returns the number of files written, skipped, failed and removed
+    from . import whatif
+
+    templates = whatif.load_templates(prod_lookup)
+    std_dict = whatif.get_std(list(templates.keys()))
+    counts = {'written' : 0, 'skipped' : 0, 'failed' : 0, 'removed' : 0}
+
+    for contract_name, template in templates.items():
+        try:
+            written = export_contract(contract_name, template, std_dict.get(Contract.get(contract_name).risk_key, ''), force)
+            counts['written' if written else 'skipped'] += 1
+        except:
+            counts['failed'] += 1 # Incomplete templates can't be built
+
+    active = {Contract.get(x).contract_id for x in templates}
+    for path in Path(ladder_dir(), prod_lookup).glob('*' + ladder_reader.suffix):
+        if path.stem not in active:
+            os.remove(path)
+            counts['removed'] += 1
+
+    return counts
+
+def export_all(products=None, force=False):
+    return {x : export_product(x, force) for x in products or pdict}
+
+def on_save(contract_name, kind, version):
+    # template_store.save hook, the ladders are compiled by a worker so saving in the Dash app isn't slowed down
+    if kind == 'heuristic':
+        try:
+            export_contract_task.delay(contract_name)
+        except Exception:
+            pass # Broker unavailable, the periodic Ladder-Export task catches up
+
+template_store.save_hooks.append(on_save)
+
+@celery.task(bind=True, name='Ladder-Export-Contract')
+def export_contract_task(self, contract_name):
+    try:
+        return 'SUCCESS: {} {}'.format(contract_name, 'written' if export_contract(contract_name) else 'up to date')
+    except Exception as e:
+        return 'ERROR: {} ({})'.format(contract_name, e)
+
+# Periodic task (ex. every morning after the risk report data is generated, and during the day)
+@celery.task(bind=True, name='Ladder-Export')
+def export_task(self, products=None):
+    return export_all(products)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reader of the compiled ladder files written by ladder_export.py, for the execution side and anything else that needs
+the add/unwind ladders of a contract without going through the Dash app.
+
+Only depends on numpy, so it can be copied next to the consumer. Files are memory-mapped and the arrays are views on
+the mapping, nothing is parsed or copied when a ladder is opened.
+
+File format (little-endian), data/ladders/<prod_lookup>/<contract_id>.ladder:
+
+    header (32 bytes) : magic b'LADR', format version (uint16), price decimals (uint8), adding logic (b'B' or b'S'),
+                        unwinding logic (b'B' or b'S'), 3 pad bytes, template version (uint32), adding levels (uint32),
+                        unwinding levels (uint32), std (float64, nan if unknown)
+    adding : price, qty/level, cumulative position (float64 x adding levels each), sorted by price
+    unwinding : price, qty/level, cumulative position (float64 x unwinding levels each), sorted by price
+
+ex.
+    ladders = open_product('/path/to/data/ladders/Brent')
+    qty, position = ladders['BRENT_1m_Fly_Jan21_B'].lookup([0.12, 0.15], 'Adding')
+
+@author: sbhargava
+"""
+from pathlib import Path
+import struct, mmap
+import numpy as np
+
+magic = b'LADR'
+format_version = 1
+header = struct.Struct('<4sHBcc3xIIId')
+charts = ['Adding', 'Unwinding']
+suffix = '.ladder'
+
+def read_header(path):
+    # (template version, std) of a ladder file without mapping it, None if it doesn't exist or isn't a ladder file
+    try:
+        with open(path, 'rb') as f:
+            values = header.unpack(f.read(header.size))
+    except (OSError, struct.error):
+        return None
+    if values[0] != magic or values[1] != format_version:
+        return None
+    return values[5], values[8]
+
+class Ladder:
+    # Memory-mapped ladders of one contract. sides : {'Adding' / 'Unwinding' : (logic, price, qty, position)}
+    def __init__(self, path):
+        self.path = Path(path)
+        self.contract_id = self.path.stem
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        values = header.unpack_from(self._mm, 0)
+        if values[0] != magic or values[1] != format_version:
+            raise ValueError('{} is not a ladder file (format {})'.format(path, format_version))
+        _, _, self.round_to, add, unwind, self.template_version, n_add, n_unwind, self.std = values
+
+        self.sides = {}
+        offset = header.size
+        for chart, logic, n in zip(charts, [add, unwind], [n_add, n_unwind]):
+            arrays = []
+            for i in range(3):
+                arrays.append(np.frombuffer(self._mm, dtype='<f8', count=n, offset=offset))
+                offset += n * 8
+            self.sides[chart] = ('Buy' if logic == b'B' else 'Sell',) + tuple(arrays)
+
+    def lookup(self, prices, chart='Adding'):
+        # (qty, position) at each price, same lookup as whatif.evaluate_ladder: buy ladders fill the lowest level at or
+        # above the price, sell ladders the highest level at or below it. Prices before the first level (above a buy
+        # ladder, below a sell ladder) return 0, prices past the last level get the last level
+        logic, price, qty, position = self.sides[chart]
+        prices = np.round(np.asarray(prices, dtype=float), self.round_to)
+        if len(price) == 0:
+            return np.zeros(prices.shape), np.zeros(prices.shape)
+
+        if logic == 'Buy':
+            idx = np.searchsorted(price, prices, side='left')
+            hit = idx < len(price)
+        else:
+            idx = np.searchsorted(price, prices, side='right') - 1
+            hit = idx >= 0
+        idx = np.clip(idx, 0, len(price) - 1)
+
+        return np.where(hit, qty[idx], 0), np.where(hit, position[idx], 0)
+
+    def close(self):
+        # The arrays are views on the mapping, they can't be used after this
+        self.sides = {}
+        self._mm.close()
+
+def open_product(folder):
+    # Every ladder of a product folder (data/ladders/<prod_lookup>), {contract_id : Ladder}
+    return {x.stem : Ladder(x) for x in sorted(Path(folder).glob('*' + suffix))}
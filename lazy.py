@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lazy registration of the Dash apps (algo.py and summary.py) on the Flask website.
+
+register(server) replaces the calls to algo.Add_Dash(server) and summary.Add_Dash(server) in the site factory. The
+routes of the apps are registered on the website at startup, Dash, pandas, numpy and the app modules are only
+imported, and the layouts only built, when the first request for one of the apps reaches a worker. The app is built
+against a Flask app that only holds its routes (never served itself), and the website's route hands each request to
+the matching Dash view, so requests go through the website's before/after_request and teardown functions and login
+hooks like eagerly registered apps, without adding anything to the website once it serves requests. Workers that
+never serve the Dash pages never load them.
+
+warm_up(server) optionally builds the apps and preloads the RP snapshot, ticker metadata and the main table of every
+product in a background thread, ex. for workers that are recycled during the day.
+
+ex.
+    from .algo import lazy
+    lazy.register(server, warm=True)
+
+@author: sbhargava
+"""
+from flask import Flask, request
+import importlib, threading, time
+
+# url_base_pathname : module with Add_Dash(server)
+apps = {
+    '/dash/Summary/' : 'summary',
+    '/dash/Desk/' : 'desk',
+    '/dash/' : 'algo',
+}
+
+# Methods of the Dash routes (POST for the callbacks)
+methods = ['GET', 'POST']
+
+class LazyDispatcher:
+    # Routes every url of a Dash app to the app, building it the first time it is requested
+    def __init__(self, server, apps):
+        self.server = server
+        self.apps = apps
+        self._routes = {} # {url_base : Flask app holding the routes of the built Dash app}
+        self._lock = threading.Lock()
+        self.build_times = {}
+
+    def add_routes(self):
+        # Registers a route per app on the website, at startup like any other route
+        for url_base in self.apps:
+            endpoint = 'lazy_dash' + url_base.replace('/', '_').rstrip('_')
+            view = self.view(url_base)
+            self.server.add_url_rule(url_base, endpoint, view, methods=methods, defaults={'path' : ''})
+            self.server.add_url_rule(url_base + '<path:path>', endpoint, view, methods=methods)
+
+    def view(self, url_base):
+        def dispatch(path):
+            return self.dispatch(url_base)
+        return dispatch
+
+    def build(self, url_base):
+        # Builds the Dash app of url_base, once per worker, and returns the Flask app holding its routes
+        routes = self._routes.get(url_base)
+        if routes is not None:
+            return routes
+
+        with self._lock:
+            routes = self._routes.get(url_base)
+            if routes is None:
+                start = time.time()
+                routes = Flask(self.server.import_name, static_folder=None)
+                routes.config.update(self.server.config)
+                module = importlib.import_module('.' + self.apps[url_base], __package__)
+                module.Add_Dash(routes)
+
+                # Never served itself, so the functions Dash registers to run before the first request run here
+                with self.server.app_context():
+                    for func in routes.before_first_request_funcs:
+                        func()
+
+                self._routes[url_base] = routes
+                self.build_times[url_base] = time.time() - start
+        return routes
+
+    def dispatch(self, url_base):
+        # Runs the Dash view matching the request in the website's request context
+        routes = self.build(url_base)
+        endpoint, values = routes.url_map.bind_to_environ(request.environ).match()
+        try:
+            return routes.view_functions[endpoint](**values)
+        except Exception as e:
+            # Error handlers Dash registers on its server (ex. PreventUpdate), anything else is raised to the website
+            return routes.handle_user_exception(e)
+
+def register(server, warm=False):
+    # Registers the Dash apps lazily on server, returns the dispatcher. Called in the site factory, before the
+    # website serves requests
+    dispatcher = LazyDispatcher(server, apps)
+    dispatcher.add_routes()
+    server.extensions['lazy_dash'] = dispatcher
+
+    if warm:
+        warm_up(server)
+
+    return dispatcher
+
+def warm_up(server, build_main_tables=True):
+    # Builds the Dash apps and preloads the data used on the first page load in a background thread
+    def run():
+        dispatcher = server.extensions.get('lazy_dash')
+        if dispatcher is not None:
+            for url_base in apps:
+                dispatcher.build(url_base)
+
+        with server.app_context():
+            preload(build_main_tables)
+
+    thread = threading.Thread(target=run, name='dash-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def preload(build_main_tables=True):
+    # RP snapshot, ticker metadata and main tables are cached for every worker (see cache.py), so only the first
+    # worker warming up does the work
+    from pathlib import Path
+    from . import blueprint, ticker_meta
+    from .cache import read_pickle
+    from . import main_tables
+
+    for fname in ['daily_rp.pkl', 'prod_mmyy.pkl']:
+        read_pickle(Path(blueprint.root_path, 'data', fname))
+
+    ticker_meta.refresh()
+
+    if build_main_tables:
+        # Only products without a snapshot for the current morning file are built
+        missing = [x for x in main_tables.pdict if main_tables.snapshot(x) is None]
+        if missing:
+            main_tables.refresh_positions(missing)
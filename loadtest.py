@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load tester for the Dash apps, replaying callback requests recorded from real sessions.
+
+Recording: record(server) wraps the website with a WSGI middleware that appends every Dash callback request
+(POST .../_dash-update-component) to data/loadtest/<session>.jsonl, one file per browser session. Sessions are
+recorded while using the pages as usual (open a product, click cells, edit heuristics, type lookups), then
+stop_recording(server) removes the middleware.
+
+Replay: replay() sends the recorded requests of each session in order, sessions in parallel at the given concurrency,
+either through the Flask test client of the website or to a running server. Timestamps in the payloads (data_timestamp,
+n_clicks_timestamp) are moved to the time of the replay so edits are handled as fresh edits. The report has the
+throughput and p50/p99 latency of every callback, named by its output ids.
+
+ex.
+    python -m <package>.loadtest --url http://localhost:5000 --cookie "session=..." --concurrency 8 --repeat 3
+    loadtest.report(loadtest.replay(loadtest.load_sessions(), server=create_app(), concurrency=4))
+
+@author: sbhargava
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from pathlib import Path
+from io import BytesIO
+import argparse, threading, hashlib, urllib.request, urllib.error, json, time, os
+
+callback_path = '_dash-update-component'
+
+# Props holding times (ms) that the callbacks compare to the current time
+timestamp_props = ['data_timestamp', 'n_clicks_timestamp']
+
+def sessions_dir():
+    from . import blueprint
+    return Path(blueprint.root_path, 'data', 'loadtest')
+
+class Recorder:
+    # WSGI middleware appending Dash callback requests to one file per session
+    def __init__(self, wsgi_app, path):
+        self.wsgi_app = wsgi_app
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def session_id(self, environ):
+        # Hash of the session cookie, the cookie itself isn't written to disk
+        cookie = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+        value = cookie['session'].value if 'session' in cookie else environ.get('REMOTE_ADDR', 'anonymous')
+        return hashlib.sha1(value.encode()).hexdigest()[:12]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD') == 'POST' and path.endswith(callback_path):
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length)
+            environ['wsgi.input'] = BytesIO(body)
+            try:
+                record = {'time' : time.time(), 'path' : path, 'payload' : json.loads(body)}
+                with self._lock, open(Path(self.path, self.session_id(environ)).with_suffix('.jsonl'), 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+            except ValueError:
+                pass
+
+        return self.wsgi_app(environ, start_response)
+
+def record(server, path=None):
+    # Starts recording callback requests made to server
+    server.wsgi_app = Recorder(server.wsgi_app, path or sessions_dir())
+    return server.wsgi_app
+
+def stop_recording(server):
+    if isinstance(server.wsgi_app, Recorder):
+        server.wsgi_app = server.wsgi_app.wsgi_app
+
+def load_sessions(path=None):
+    # {session : [recorded requests in order]}
+    path = Path(path or sessions_dir())
+    sessions = {}
+    for fname in sorted(os.listdir(path)):
+        if fname.endswith('.jsonl'):
+            with open(Path(path, fname)) as f:
+                sessions[Path(fname).stem] = [json.loads(line) for line in f if line.strip()]
+    return sessions
+
+def callback_id(payload):
+    # Output ids of the callback, ex. 'base-heuristic.columns...base-heuristic.data_previous'
+    return payload.get('output') or '.'.join([str(x.get('id')) for x in payload.get('outputs', [])])
+
+def shift_timestamps(payload, offset_ms):
+    # Moves recorded timestamps to the time of the replay
+    payload = json.loads(json.dumps(payload))
+    for group in ['inputs', 'state']:
+        for item in payload.get(group, []):
+            if isinstance(item, dict) and item.get('property') in timestamp_props and isinstance(item.get('value'), int):
+                item['value'] += offset_ms
+    return payload
+
+class TestClientTarget:
+    # Sends requests through the Flask test client, login(client) can be used to authenticate first
+    def __init__(self, server, login=None):
+        self.server = server
+        self.login = login
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self.server.test_client()
+            if self.login:
+                self.login(client)
+            self._local.client = client
+        return client
+
+    def post(self, path, payload):
+        response = self.client().post(path, json=payload)
+        return response.status_code, len(response.get_data())
+
+class UrlTarget:
+    # Sends requests to a running server, cookie authenticates the requests (ex. 'session=...')
+    def __init__(self, url, cookie=None, timeout=60):
+        self.url = url.rstrip('/')
+        self.cookie = cookie
+        self.timeout = timeout
+
+    def post(self, path, payload):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode(), headers={'Content-Type' : 'application/json'}
+        )
+        if self.cookie:
+            request.add_header('Cookie', self.cookie)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, 0
+
+def replay_session(target, requests, results):
+    # Replays one session in order, keeping the recorded think time out (requests are sent back to back). Timestamps
+    # are shifted per request right before it is sent, so they are as recent as they were when it was recorded
+    for x in requests:
+        payload = shift_timestamps(x['payload'], int((time.time() - x['time']) * 1000))
+        start = time.time()
+        status, size = target.post(x['path'], payload)
+        results.append((callback_id(payload), time.time() - start, status, size))
+
+def replay(sessions, server=None, url=None, cookie=None, login=None, concurrency=4, repeat=1):
+    # Replays sessions ({session : requests}) at concurrency, returns [(callback id, latency, status, size)] and time
+    target = TestClientTarget(server, login) if server is not None else UrlTarget(url, cookie)
+    jobs = [requests for i in range(repeat) for requests in sessions.values()]
+    results = []
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(replay_session, target, x, results) for x in jobs]:
+            future.result()
+
+    return results, time.time() - start
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def summarize(results, elapsed):
+    # {callback id : {'calls', 'errors', 'throughput', 'p50_ms', 'p99_ms', 'mean_kb'}}, '__all__' for every callback
+    by_callback = {}
+    for cb, latency, status, size in results:
+        by_callback.setdefault(cb, []).append((latency, status, size))
+    by_callback['__all__'] = [(latency, status, size) for cb, latency, status, size in results]
+
+    summary = {}
+    for cb, rows in by_callback.items():
+        latencies = [x[0] for x in rows]
+        summary[cb] = {
+            'calls' : len(rows),
+            'errors' : sum(1 for x in rows if x[1] >= 400),
+            'throughput' : round(len(rows) / elapsed, 2) if elapsed else 0,
+            'p50_ms' : round(percentile(latencies, 50) * 1000, 1),
+            'p99_ms' : round(percentile(latencies, 99) * 1000, 1),
+            'mean_kb' : round(sum(x[2] for x in rows) / len(rows) / 1024, 1) if rows else 0,
+        }
+    return summary
+
+def report(replayed):
+    # Prints the summary of replay(), slowest callbacks (p99) first
+    results, elapsed = replayed
+    summary = summarize(results, elapsed)
+
+    row = '{:<60}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'
+    print(row.format('callback', 'calls', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'mean KB'))
+    for cb, x in sorted(summary.items(), key=lambda x : (x[0] != '__all__', -x[1]['p99_ms'])):
+        print(row.format(cb[:59], x['calls'], x['errors'], x['throughput'], x['p50_ms'], x['p99_ms'], x['mean_kb']))
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded Dash callback requests')
+    parser.add_argument('--url', required=True, help='Base url of a running server, ex. http://localhost:5000')
+    parser.add_argument('--cookie', default=None, help="Session cookie, ex. 'session=...'")
+    parser.add_argument('--sessions', default=None, help='Folder with recorded sessions')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.sessions)
+    report(replay(sessions, url=args.url, cookie=args.cookie, concurrency=args.concurrency, repeat=args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Main tables (month x relationship grid with positions) of the algo page, precomputed for every product in pdict.
+
+The grid only depends on pdict and the prod_mmyy file written by the RP morning scripts, it is built once in the
+morning by the Main-Table-Precompute task (chained after the morning scripts, ex.
+chain(morning_rp.s(), precompute_task.si())). Intraday, the Main-Table-Positions task pulls positions for every
+product in one query and only re-overlays positions and reruns the risk report of products whose positions changed
+(or whose risk report is older than risk_max_age).
+
+Snapshots are kept in the shared cache (cache.py) so opening a product page reads a ready snapshot, algo.py falls
+back to building the table on request if there is no snapshot for the current prod_mmyy file.
+
+@author: sbhargava
+"""
+from .. import celery
+from . import blueprint
+from ..positions import positions
+from ..base.models import IntraDayPositions
+from .products import pdict, product_folder
+from .cache import get_cache, read_pickle, file_version, input_hash
+from . import profiling, oi_queries
+
+from datetime import datetime, timedelta
+from pathlib import Path
+import itertools
+import pandas as pd
+import numpy as np
+
+snapshot_ttl = 86400
+
+# Rerun the risk report of a product after this long even if its positions didn't change
+risk_max_age = timedelta(minutes=15)
+
+def mmyy_path():
+    return Path(blueprint.root_path, 'data', 'prod_mmyy.pkl')
+
+def product_dur(prod_lookup):
+    # Duration suffix of the product in the prod_mmyy file, ex. Brent_6m -> '_6m'
+    return '_6m' if '6' in prod_lookup else ''
+
+def main_table_grid(relationships, prod, dur):
+    # Columns, tooltips, style and empty rows of the main table, everything that doesn't depend on positions
+
+    # Create columns
+    # Read in file that is generated from RP morning scripts
+    df = read_pickle(mmyy_path())
+    columns = df[df.index.str.upper() == ''.join([prod, dur]).upper()].values.tolist()[0]
+    columns = list(filter(None, columns))
+
+    columns_dict = [
+        {'name' : [i, j], 'id' : ' '.join([i, j])}
+        for i, j in itertools.product(columns, ['B', 'S'])
+    ]
+    columns_dict.insert(0, {'name' : ['', ''], 'id' : 'Future'})
+
+    rows = []
+    rows.extend(relationships)
+
+    # Create tooltip data
+    tooltip_columns = [x['id'] for x in columns_dict]
+    tooltip = []
+    for rel in rows:
+        tooltip.append({i : ' '.join([rel, i]) for i in tooltip_columns})
+
+    # Create rows
+    df = pd.DataFrame(columns=tooltip_columns)
+    df['id'] = list(map(lambda x : ' '.join([prod.split("_")[0], x]), rows))
+    df['Future'] = rows
+    df = df.fillna('')
+
+    style = []
+    header_style = [{
+        'if' : {'column_id' : 'Future'},
+        'backgroundColor': 'rgb(230, 230, 230)',
+        'fontWeight': 'bold'},
+    ]
+
+    style.extend(header_style)
+
+    sell_style=[{
+        'if': {'column_id': str(x), 'filter_query': '{{{0}}} < 0'.format(x)},
+            'backgroundColor': 'rgb(250, 217, 222)',
+        } for x in tooltip_columns
+    ]
+
+    style.extend(sell_style)
+
+    buy_style=[{
+        'if': {'column_id': str(x), 'filter_query': '{{{0}}} > 0'.format(x)},
+            'backgroundColor': 'rgb(217, 230, 250)',
+        } for x in tooltip_columns
+    ]
+    style.extend(buy_style)
+
+    return {'columns' : columns_dict, 'tooltip' : tooltip, 'style' : style, 'rows' : df.to_dict('records')}
+
+def product_positions(prod):
+    # Intraday positions of a product (folder). The query only narrows down the rows, folder_positions picks the
+    # product's so they are the same as the ones positions_by_folder gives the product
+    folder = product_folder(prod)
+    query = IntraDayPositions.query.filter(IntraDayPositions.contract.ilike(folder + '%'))
+    with profiling.io('positions'):
+        return folder_positions(positions.get_positions(query = query), folder)
+
+def product_tokens(pos_df):
+    # Product of each position, the first token of the contract in lower case (ex. 'Brent 1m Fly Jan21' -> 'brent')
+    return pos_df.contract.astype(str).str.replace('_', ' ').str.split(' ', n=1).str[0].str.lower()
+
+def folder_positions(pos_df, folder, tokens=None):
+    # Positions of a product folder, matched on the whole product token so 'Ho' doesn't pick up 'Leanhogs'
+    if pos_df.empty:
+        return pos_df
+    tokens = product_tokens(pos_df) if tokens is None else tokens
+    return pos_df[tokens == folder.lower()]
+
+def main_table_overlay(grid, pos_df, prod, risk_df=None):
+    # Adds positions to the grid rows and gets the risk report of the product (unless given, ex. by batch()).
+    # Returns data and risk df
+    df = pd.DataFrame(grid['rows'])
+
+    if not pos_df.empty:
+        df = main_table_positions(df.set_index('id'), pos_df, prod)
+
+    # Get risk report for current product and add to storage div
+    if risk_df is None:
+        risk_df = risk_report(pos_df)
+
+    return df.to_dict('records'), risk_df
+
+def risk_report(pos_df):
+    # Risk report of positions, contracts as risk keys (ex. 'brent 1m fly jan21')
+    if pos_df.empty:
+        return pd.DataFrame()
+    with profiling.io('risk_report'):
+        risk_df = positions.get_risk_report(pos_df)
+    risk_df.contract = risk_df.contract.str.lower().str.replace("_", " ")
+    return risk_df
+
+def main_table_positions(row_df, pos_df, prod):
+    # Places the positions of the product in the cells of the grid (row_df indexed by row id), one pivot
+    return position_grid(row_df, pos_df).reset_index()
+
+def position_cells(pos_df):
+    # Canonical ids and grid coordinates of a positions frame (contract, position), vectorized over the rows:
+    #   key : risk key, ex. 'brent 1m fly jan21'
+    #   id : position/template id, ex. 'BRENT_1m_Fly_Jan21_B' (B for long positions, S for short)
+    #   row : main table row id (lower case), ex. 'brent 1m fly'
+    #   column : main table column, ex. 'Jan21 B'
+    if pos_df.empty:
+        return pos_df.assign(key=[], id=[], row=[], column=[])
+
+    name = pos_df.contract.astype(str).str.replace('_', ' ')
+    prod_rel = name.str.split(' ', n=1)
+    row_month = name.str.rsplit(' ', n=1)
+    side = pd.Series(np.where(pos_df.position > 0, 'B', 'S'), index=pos_df.index)
+
+    return pos_df.assign(
+        key = name.str.lower(),
+        id = prod_rel.str[0].str.upper() + '_' + prod_rel.str[1].str.replace(' ', '_') + '_' + side,
+        row = row_month.str[0].str.lower(),
+        column = row_month.str[1] + ' ' + side,
+    )
+
+def position_grid(row_df, pos_df):
+    # Grid rows (indexed by row id, ex. 'Brent 1m Fly') with the net position of each contract in its month/side cell.
+    # Positions are netted per contract first, the side comes from the net position
+    row_df = row_df.copy()
+    if pos_df.empty:
+        return row_df
+
+    net = pos_df.groupby('contract', as_index=False, sort=False)['position'].sum()
+    cells = position_cells(net[net.position != 0])
+    if cells.empty:
+        return row_df
+
+    grid = cells.pivot_table(index='row', columns='column', values='position', aggfunc='sum')
+    grid = grid.reindex(index=row_df.index.str.lower(), columns=[x for x in row_df.columns if x in grid.columns])
+    grid.index = row_df.index
+
+    for x in grid.columns[grid.notnull().any().values]:
+        values = grid[x].round().astype('Int64').astype(object)
+        row_df[x] = values.where(grid[x].notnull(), row_df[x])
+
+    return row_df
+
+def oi_overlay(columns, data, tooltip):
+    # Joins the latest OI of every cell's contract into the rows ('OI <mmyy>' fields) and tooltips in one reindex.
+    # Applied when the table is served so the OI is current even if the snapshot was built before the OI task ran
+    oi = oi_queries.latest_lookup()
+    cells = [x['id'] for x in columns if x['id'] != 'Future']
+    if oi.empty or not cells or not data:
+        return data, tooltip
+
+    months = np.array([x.split(' ')[0] for x in cells])
+    ids = np.array([x['id'] for x in data], dtype=str)
+    keys = np.char.lower(np.char.add(np.char.add(ids[:, None], ' '), months[None, :]))
+    values = oi.reindex(keys.ravel()).values.reshape(keys.shape)
+
+    data = [dict(row) for row in data]
+    tooltip = [dict(row) for row in tooltip]
+    for i, row in enumerate(data):
+        for j in np.flatnonzero(~np.isnan(values[i])):
+            row['OI ' + months[j]] = values[i, j]
+            tooltip[i][cells[j]] = '{} | OI {:,.0f}'.format(tooltip[i][cells[j]], values[i, j])
+
+    return data, tooltip
+
+# ------------------------------------------------------------------------------------------------------------------- #
+# Snapshots
+# ------------------------------------------------------------------------------------------------------------------- #
+def positions_hash(pos_df):
+    if pos_df is None or pos_df.empty:
+        return None
+    return input_hash(pos_df.sort_values(by=list(pos_df.columns)).to_dict('records'))
+
+def snapshot(prod_lookup):
+    # Snapshot of the main table of a product for the current prod_mmyy file, None if it hasn't been built
+    snap = get_cache().get('main_table_snapshot', [prod_lookup])
+    if not isinstance(snap, dict) or snap['grid_version'] != file_version(mmyy_path()):
+        return None
+    return snap
+
+def current_snapshot(prod_lookup):
+    # Snapshot of a product with its current positions, re-overlaid and stored if positions changed since the last
+    # overlay (the Main-Table-Positions task only runs every so often). None if it hasn't been built
+    snap = snapshot(prod_lookup)
+    if snap is None:
+        return None
+
+    prod = product_folder(prod_lookup)
+    pos_df = product_positions(prod)
+    if snap['positions_hash'] != positions_hash(pos_df):
+        snap = _store(overlay(snap, pos_df, prod))
+    return snap
+
+def snapshots(prod_lookups):
+    # Snapshots of several products in one read of the shared cache, {prod_lookup : snapshot or None}
+    grid_version = file_version(mmyy_path())
+    snaps = get_cache().get_many('main_table_snapshot', [[x] for x in prod_lookups])
+    return {
+        x : snap if isinstance(snap, dict) and snap['grid_version'] == grid_version else None
+        for x, snap in zip(prod_lookups, snaps)
+    }
+
+def _store(snap):
+    get_cache().set('main_table_snapshot', [snap['prod_lookup']], snap, snapshot_ttl)
+    return snap
+
+def build(prod_lookup, pos_df=None):
+    # Builds the grid and position overlay of a product and stores the snapshot
+    prod = product_folder(prod_lookup)
+    grid_version = file_version(mmyy_path())
+    grid = main_table_grid(pdict[prod_lookup]['rel'], prod, product_dur(prod_lookup))
+    pos_df = product_positions(prod) if pos_df is None else pos_df
+
+    return _store(overlay(dict(grid, prod_lookup=prod_lookup, grid_version=grid_version), pos_df, prod))
+
+def overlay(snap, pos_df, prod, risk_df=None):
+    # (Re)applies positions to a snapshot's grid
+    data, risk_df = main_table_overlay(snap, pos_df, prod, risk_df)
+    snap = dict(snap)
+    snap.update({
+        'data' : data,
+        'risk_json' : risk_df.to_json(orient='records'),
+        'positions_hash' : positions_hash(pos_df),
+        'positions_at' : datetime.now(),
+    })
+    return snap
+
+def precompute(products=None):
+    # Builds the snapshot of every product. Returns the products built
+    built = []
+    for prod_lookup in products or pdict:
+        try:
+            build(prod_lookup)
+            built.append(prod_lookup)
+        except (IndexError, KeyError):
+            # Product not in the morning file
+            pass
+    return built
+
+def positions_by_folder(folders):
+    # Positions of every product folder from one query, {folder : pos_df}
+    with profiling.io('positions'):
+        pos_df = positions.get_positions(query = IntraDayPositions.query)
+
+    if pos_df.empty:
+        return {x : pos_df for x in folders}
+    tokens = product_tokens(pos_df)
+    return {x : folder_positions(pos_df, x, tokens) for x in folders}
+
+def refresh_positions(products=None):
+    # Re-overlays positions of the products whose positions changed or whose risk report is stale. Products without a
+    # snapshot for the current morning file are built. Returns the products updated
+    products = list(products or pdict)
+    by_folder = positions_by_folder({product_folder(x) for x in products})
+
+    updated = []
+    for prod_lookup in products:
+        prod = product_folder(prod_lookup)
+        pos_df = by_folder[prod]
+        snap = snapshot(prod_lookup)
+
+        try:
+            if snap is None:
+                build(prod_lookup, pos_df)
+            elif snap['positions_hash'] != positions_hash(pos_df) or datetime.now() - snap['positions_at'] > risk_max_age:
+                _store(overlay(snap, pos_df, prod))
+            else:
+                continue
+        except (IndexError, KeyError):
+            continue
+        updated.append(prod_lookup)
+
+    return updated
+
+def product_risk(risk_df, prod):
+    # Rows of a risk report (contract as risk key, ex. 'brent 1m fly jan21') belonging to a product folder
+    if risk_df.empty:
+        return risk_df
+    return risk_df[risk_df.contract.str.startswith(prod.lower() + ' ')]
+
+def batch(prod_lookups):
+    # Main tables of several products with one positions query, one risk report and one snapshot read. Products whose
+    # snapshot is missing or has other positions are (re)overlaid and stored. Returns ({prod_lookup : snapshot}, risk df)
+    prod_lookups = [x for x in prod_lookups if x in pdict]
+    folders = {product_folder(x) for x in prod_lookups}
+    snaps = snapshots(prod_lookups)
+    by_folder = positions_by_folder(folders)
+
+    pos_df = pd.concat([by_folder[x] for x in folders]) if folders else pd.DataFrame()
+    risk_df = risk_report(pos_df)
+
+    grid_version = file_version(mmyy_path())
+    tables = {}
+    for prod_lookup in prod_lookups:
+        prod = product_folder(prod_lookup)
+        snap = snaps[prod_lookup]
+        try:
+            if snap is None:
+                grid = main_table_grid(pdict[prod_lookup]['rel'], prod, product_dur(prod_lookup))
+                snap = dict(grid, prod_lookup=prod_lookup, grid_version=grid_version, positions_hash=False)
+            if snap['positions_hash'] != positions_hash(by_folder[prod]):
+                snap = _store(overlay(snap, by_folder[prod], prod, product_risk(risk_df, prod)))
+        except (IndexError, KeyError):
+            # Product not in the morning file
+            continue
+        tables[prod_lookup] = snap
+
+    return tables, risk_df
+
+# Chained after the RP morning scripts, the result of the previous task is ignored
+@celery.task(bind=True, name='Main-Table-Precompute')
+def precompute_task(self, *args):
+    return 'SUCCESS: {} built'.format(len(precompute()))
+
+# Periodic task (ex. every minute during trading hours)
+@celery.task(bind=True, name='Main-Table-Positions')
+def positions_task(self):
+    return 'SUCCESS: {} updated'.format(len(refresh_positions()))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar history of open interest for research (seasonality, roll behaviour, ...) without loading the database.
+
+The Open-Interest-to-DB task appends each day's outright and contract frames to a Parquet dataset partitioned by
+product and trade month:
+
+    data/oi_history/<kind>/product=<product>/trade_month=<YYYY-MM>/<YYYYMMDD>.parquet
+
+read() loads a kind with column projection and product/date predicates pushed down to the partitions and row groups.
+compact() merges the daily files of past months into one file per partition (compacted.parquet). A day appended again
+to a compacted partition replaces its rows in compacted.parquet, so readers never see a day twice.
+
+ex. oi_history.read('contract', columns=['date', 'contract', 'oi_1'], products=['HO'], start=date(2020, 1, 1))
+    python -m <package>.oi_history compact
+
+Requires pyarrow.
+
+@author: sbhargava
+"""
+from . import blueprint
+
+from datetime import date, datetime
+from pathlib import Path
+import argparse, shutil, os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pq = None
+
+kinds = ['outright', 'contract']
+
+partitioning = ['product', 'trade_month']
+
+def root(kind):
+    return Path(blueprint.root_path, 'data', 'oi_history', kind)
+
+def _check():
+    if pa is None:
+        raise RuntimeError('pyarrow is required for the OI history dataset')
+
+def normalize(kind, df):
+    # Column names and types of the dataset from the frames of oi_to_db.main
+    df = df.copy()
+    if kind == 'outright':
+        df = df.rename(columns={'Product' : 'product', 'Month' : 'contract_month', 'OpenInterest' : 'oi'})
+        df['oi'] = pd.to_numeric(df['oi'], errors='coerce')
+    else:
+        parts = df.contract.str.split(' ')
+        df['product'] = parts.str[0]
+        df['relationship'] = parts.str[1:-1].str.join(' ')
+        df['contract_month'] = parts.str[-1]
+        for x in ['oi_1', 'oi_2', 'oi_3', 'oi_4']:
+            df[x] = pd.to_numeric(df.get(x), errors='coerce')
+
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    df['trade_month'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m')
+    return df
+
+def _without_days(table, days):
+    # Rows of a table whose date isn't one of days
+    return table.filter(pc.invert(pc.is_in(table['date'], value_set=pa.array(list(days), pa.date32()))))
+
+def _drop_days(path, days):
+    # Removes the rows of days from a compacted file, rewritten next to it and renamed into place
+    table = pq.read_table(path)
+    kept = _without_days(table, days)
+    if kept.num_rows == table.num_rows:
+        return
+
+    tmp = path.with_name('_compacted.tmp')
+    pq.write_table(kept, tmp)
+    shutil.move(str(tmp), str(path))
+
+def append(kind, df):
+    # Writes the frame to its partitions, one file per day (rewriting a day replaces its file, and its rows in the
+    # compacted file of the partition). Returns files written
+    _check()
+    df = normalize(kind, df)
+
+    written = 0
+    for (product, trade_month), part in df.groupby(partitioning):
+        folder = Path(root(kind), 'product={}'.format(product), 'trade_month={}'.format(trade_month))
+        os.makedirs(folder, exist_ok=True)
+        if Path(folder, 'compacted.parquet').exists():
+            _drop_days(Path(folder, 'compacted.parquet'), part['date'].unique())
+        for day, rows in part.groupby('date'):
+            table = pa.Table.from_pandas(rows.drop(columns=partitioning), preserve_index=False)
+            pq.write_table(table, Path(folder, day.strftime('%Y%m%d')).with_suffix('.parquet'))
+            written += 1
+
+    return written
+
+def dataset(kind):
+    _check()
+    return ds.dataset(
+        str(root(kind)), format='parquet',
+        partitioning=ds.partitioning(pa.schema([('product', pa.string()), ('trade_month', pa.string())]), flavor='hive')
+    )
+
+def read(kind, columns=None, products=None, start=None, end=None, where=None):
+    # Loads the history of a kind. columns are projected, products/start/end (dates) are pushed down to the partitions
+    # (product, trade month) and to the row groups (date). where is an extra pyarrow expression
+    _check()
+    expression = None
+
+    def add(x):
+        nonlocal expression
+        expression = x if expression is None else expression & x
+
+    if products:
+        add(ds.field('product').isin(list(products)))
+    if start:
+        add(ds.field('trade_month') >= start.strftime('%Y-%m'))
+        add(ds.field('date') >= pa.scalar(start, pa.date32()))
+    if end:
+        add(ds.field('trade_month') <= end.strftime('%Y-%m'))
+        add(ds.field('date') <= pa.scalar(end, pa.date32()))
+    if where is not None:
+        add(where)
+
+    if not os.path.isdir(root(kind)):
+        return pd.DataFrame(columns=columns or [])
+
+    return dataset(kind).to_table(columns=columns, filter=expression).to_pandas()
+
+def compact(kind, before=None):
+    # Merges the daily files of every partition older than the trade month of before (today by default) into one
+    # file. The merged file is written next to the daily files and renamed into place before they are removed
+    # Returns the number of partitions compacted
+    _check()
+    before = (before or date.today()).strftime('%Y-%m')
+    count = 0
+
+    for product_dir in sorted(Path(root(kind)).glob('product=*')):
+        for month_dir in sorted(product_dir.glob('trade_month=*')):
+            if month_dir.name.split('=')[1] >= before:
+                continue
+
+            files = sorted(x for x in month_dir.glob('*.parquet') if x.stem != 'compacted')
+            if not files or (len(files) == 1 and not Path(month_dir, 'compacted.parquet').exists()):
+                continue
+
+            parts = [pq.read_table(x) for x in files]
+            if Path(month_dir, 'compacted.parquet').exists():
+                # Days in both are taken from the daily files, they were written last
+                days = [datetime.strptime(x.stem, '%Y%m%d').date() for x in files]
+                parts.insert(0, _without_days(pq.read_table(Path(month_dir, 'compacted.parquet')), days))
+            table = pa.concat_tables(parts)
+
+            tmp = Path(month_dir, '_compacted.tmp') # '_' files are ignored by readers
+            pq.write_table(table, tmp)
+            shutil.move(str(tmp), str(Path(month_dir, 'compacted.parquet')))
+            for x in files:
+                os.remove(x)
+            count += 1
+
+    return count
+
+def export_from_db(start, end=None):
+    # Backfills the dataset from the OpenInterest/Outright_OI tables for dates between start and end
+    from .. import db
+    from ..base.models import OpenInterest, Outright_OI
+
+    end = end or date.today()
+    count = 0
+    for kind, model in [('contract', OpenInterest), ('outright', Outright_OI)]:
+        query = model.query.filter(model.date >= start, model.date <= end)
+        df = pd.read_sql(query.statement, db.session.bind)
+        if not df.empty:
+            count += append(kind, df.drop(columns=['id'], errors='ignore'))
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='OI history dataset maintenance')
+    parser.add_argument('command', choices=['compact'])
+    parser.add_argument('--before', default=None, help='Compact trade months before this date (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    before = datetime.strptime(args.before, '%Y-%m-%d').date() if args.before else None
+    for kind in kinds:
+        print(kind, compact(kind, before), 'partitions compacted')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cached accessors on the materialized open interest summaries (oi_summary.py) for the apps on the site.
+
+Reads are indexed lookups on the summary tables, cached for every worker in the 'oi' namespace of cache.py which is
+invalidated when the Open-Interest-to-DB task updates the summaries. DataFrames returned are shared, callers must not
+modify them in place.
+
+latest_lookup() keeps the latest OI of every contract in memory for the algo main table, reloaded only when the task
+updates the summaries.
+
+ex. oi_queries.latest('HO')
+    oi_queries.change_series('HO 1m Fly Jan21', days=60)
+
+@author: sbhargava
+"""
+from .. import db
+from .oi_summary import OILatest, OutrightLatest, OIDaily, RelationshipTotal, leg_columns, daily_columns
+from .cache import memoize, get_cache
+
+from datetime import date, timedelta
+import pandas as pd
+
+def _frame(query, columns):
+    return pd.DataFrame(query.with_entities(*columns).all(), columns=[x.key for x in columns])
+
+@memoize(ttl=3600, namespace='oi')
+def latest(product):
+    # Latest snapshot of every contract of a product, indexed by contract
+    columns = [OILatest.contract, OILatest.relationship, OILatest.month, OILatest.date, OILatest.oi] + \
+        [getattr(OILatest, x) for x in leg_columns]
+    return _frame(OILatest.query.filter_by(product=product), columns).set_index('contract')
+
+@memoize(ttl=3600, namespace='oi')
+def latest_all():
+    # Latest contract OI of every product, {contract : oi}
+    return dict(db.session.query(OILatest.contract, OILatest.oi).all())
+
+@memoize(ttl=3600, namespace='oi')
+def latest_outrights(product):
+    # Latest OI of every outright of a product, indexed by month
+    columns = [OutrightLatest.month, OutrightLatest.date, OutrightLatest.oi]
+    return _frame(OutrightLatest.query.filter_by(product=product), columns).set_index('month')
+
+@memoize(ttl=3600, namespace='oi')
+def change_series(contract, days=60):
+    # Daily OI of a contract with its changes and 5/20 day exponential averages, oldest first
+    columns = [
+        OIDaily.date, OIDaily.oi, OIDaily.change_1d, OIDaily.change_pct, OIDaily.change_1w, OIDaily.ema_5d, OIDaily.ema_20d
+    ]
+    query = OIDaily.query.filter(OIDaily.contract == contract, OIDaily.date >= date.today() - timedelta(days))
+    return _frame(query.order_by(OIDaily.date), columns).set_index('date')
+
+@memoize(ttl=3600, namespace='oi')
+def product_changes(product, day=None):
+    # OI and changes of every contract and leg of a product on a day (latest day by default), indexed by contract
+    day = day or db.session.query(db.func.max(OIDaily.date)).filter(OIDaily.product == product).scalar()
+    columns = [getattr(OIDaily, x) for x in daily_columns if x not in ['date', 'product']]
+    return _frame(OIDaily.query.filter_by(product=product, date=day), columns).set_index('contract')
+
+@memoize(ttl=3600, namespace='oi')
+def relationship_totals(product, days=60):
+    # Total OI per relationship and day, one column per relationship
+    columns = [RelationshipTotal.date, RelationshipTotal.relationship, RelationshipTotal.oi]
+    query = RelationshipTotal.query.filter(
+        RelationshipTotal.product == product, RelationshipTotal.date >= date.today() - timedelta(days)
+    )
+    df = _frame(query, columns)
+    if df.empty:
+        return df
+    return df.pivot(index='date', columns='relationship', values='oi').sort_index()
+
+# (oi cache version, Series of latest contract OI indexed by lowercase contract)
+_lookup = (None, pd.Series(dtype=float))
+
+def latest_lookup():
+    # Latest OI of every contract indexed by lowercase contract name, ex. 'ho 1m fly jan21' (same as Contract.risk_key).
+    # Kept in memory per worker and swapped when the OI task bumps the 'oi' cache version
+    global _lookup
+    version = get_cache().version('oi')
+    if _lookup[0] != version:
+        oi = pd.Series(latest_all(), dtype=float)
+        oi.index = oi.index.str.lower()
+        _lookup = (version, oi[~oi.index.duplicated()])
+    return _lookup[1]
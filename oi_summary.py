@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Materialized open interest summaries maintained by the Open-Interest-to-DB task (oi_to_db.py), read through
+oi_queries.py by the apps on the site instead of running group-bys over the OpenInterest/Outright_OI history.
+
+    oi_latest : latest snapshot per contract (legs and contract OI)
+    oi_outright_latest : latest OI per outright
+    oi_daily : OI of each contract and leg per day with its changes and averages (see below)
+    oi_relationship_totals : total OI per product, relationship and day
+
+The OI of a contract (fly, 2x, ...) is the OI of its thinnest leg. materialize() is called with the day's frames
+after they are written to the raw tables, rebuild() backfills the summaries from the raw tables.
+
+Changes are computed at ingest so reading them costs nothing: the last days of oi_daily for the products of the day
+are loaded in one query and, in one vectorized pass, every contract and leg gets its day over day change (absolute
+and %), the contract its week over week change, and both 5/20 day exponential averages updated from the previous
+snapshot (ema = previous ema + 2 / (span + 1) * (oi - previous ema)).
+
+@author: sbhargava
+"""
+from .. import db
+from ..base.models import OpenInterest, Outright_OI
+from .cache import get_cache
+
+from datetime import timedelta
+import pandas as pd
+import numpy as np
+
+leg_columns = ['oi_1', 'oi_2', 'oi_3', 'oi_4']
+
+# Days of oi_daily read at ingest, enough to find the previous snapshot and the one a week before
+history_days = 10
+
+ema_spans = {'ema_5d' : 5, 'ema_20d' : 20}
+
+class OILatest(db.Model):
+    __tablename__ = 'oi_latest'
+
+    contract = db.Column(db.String(64), primary_key=True) # ex. 'HO 1m Fly Jan21'
+    product = db.Column(db.String(32), nullable=False, index=True)
+    relationship = db.Column(db.String(32), nullable=False)
+    month = db.Column(db.String(8), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    oi_1 = db.Column(db.Float)
+    oi_2 = db.Column(db.Float)
+    oi_3 = db.Column(db.Float)
+    oi_4 = db.Column(db.Float)
+    oi = db.Column(db.Float)
+
+class OutrightLatest(db.Model):
+    __tablename__ = 'oi_outright_latest'
+
+    product = db.Column(db.String(32), primary_key=True)
+    month = db.Column(db.String(8), primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    oi = db.Column(db.Float)
+
+class OIDaily(db.Model):
+    __tablename__ = 'oi_daily'
+
+    contract = db.Column(db.String(64), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    product = db.Column(db.String(32), nullable=False)
+    relationship = db.Column(db.String(32), nullable=False)
+    oi = db.Column(db.Float)
+    change_1d = db.Column(db.Float)
+    change_pct = db.Column(db.Float)
+    change_1w = db.Column(db.Float)
+    ema_5d = db.Column(db.Float)
+    ema_20d = db.Column(db.Float)
+    oi_1 = db.Column(db.Float)
+    oi_2 = db.Column(db.Float)
+    oi_3 = db.Column(db.Float)
+    oi_4 = db.Column(db.Float)
+    oi_1_change = db.Column(db.Float)
+    oi_2_change = db.Column(db.Float)
+    oi_3_change = db.Column(db.Float)
+    oi_4_change = db.Column(db.Float)
+    oi_1_pct = db.Column(db.Float)
+    oi_2_pct = db.Column(db.Float)
+    oi_3_pct = db.Column(db.Float)
+    oi_4_pct = db.Column(db.Float)
+    oi_1_ema_5d = db.Column(db.Float)
+    oi_2_ema_5d = db.Column(db.Float)
+    oi_3_ema_5d = db.Column(db.Float)
+    oi_4_ema_5d = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_oi_daily_product_date', 'product', 'date'),
+    )
+
+class RelationshipTotal(db.Model):
+    __tablename__ = 'oi_relationship_totals'
+
+    product = db.Column(db.String(32), primary_key=True)
+    relationship = db.Column(db.String(32), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    oi = db.Column(db.Float)
+    contracts = db.Column(db.Integer)
+
+def split_contracts(rel_df):
+    # Adds product, relationship and month columns from 'contract', ex. 'HO 1m Fly Jan21' -> ('HO', '1m Fly', 'Jan21')
+    parts = rel_df.contract.str.split(' ')
+    rel_df = rel_df.assign(
+        product = parts.str[0],
+        relationship = parts.str[1:-1].str.join(' '),
+        month = parts.str[-1],
+    )
+    return rel_df
+
+def contract_oi(rel_df):
+    # OI of each contract, the OI of its thinnest leg
+    legs = rel_df.reindex(columns=leg_columns).apply(pd.to_numeric, errors='coerce')
+    return legs.min(axis=1, skipna=True)
+
+def _records(df, columns):
+    # Records with NaN as None for the database
+    df = df[columns]
+    return df.astype(object).where(pd.notnull(df), None).to_dict('records')
+
+# Columns of oi_daily computed at ingest, and the ones read back from the previous snapshot
+daily_columns = ['contract', 'date', 'product', 'relationship', 'oi', 'change_1d', 'change_pct', 'change_1w'] + \
+    list(ema_spans) + leg_columns + ['{}_{}'.format(x, y) for y in ['change', 'pct', 'ema_5d'] for x in leg_columns]
+snapshot_columns = ['contract', 'date', 'oi'] + list(ema_spans) + leg_columns + ['{}_ema_5d'.format(x) for x in leg_columns]
+
+def _asof(today, history, lag_days):
+    # Last history row of each contract dated at least lag_days before the row of today (NaN if there is none)
+    left = today[['contract', 'date']].assign(key = pd.to_datetime(today['date']) - pd.Timedelta(days=lag_days))
+    right = history.assign(key = pd.to_datetime(history['date'])).drop(columns=['date'])
+    merged = pd.merge_asof(
+        left.reset_index().sort_values(by='key'), right.sort_values(by='key'), on='key', by='contract', direction='backward'
+    )
+    return merged.set_index('index').reindex(today.index)
+
+def _ema(value, previous, span):
+    # Exponential average updated from the previous one, starts at the value
+    return previous.where(previous.notnull(), value) + 2 / (span + 1) * (value - previous.where(previous.notnull(), value))
+
+def _pct(change, previous):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (change / previous.replace(0, np.nan)) * 100
+
+def compute_changes(today, history):
+    # Changes and averages of the contracts and legs of today from the snapshots in history (previous days of oi_daily)
+    today = today.copy()
+    if history.empty:
+        history = pd.DataFrame(columns=snapshot_columns)
+    history = history[snapshot_columns].copy()
+    for x in history.columns.drop(['contract', 'date']):
+        history[x] = pd.to_numeric(history[x], errors='coerce')
+
+    prev = _asof(today, history, 1)
+    week = _asof(today, history, 7)
+
+    today['change_1d'] = today['oi'] - prev['oi']
+    today['change_pct'] = _pct(today['change_1d'], prev['oi'])
+    today['change_1w'] = today['oi'] - week['oi']
+    for x, span in ema_spans.items():
+        today[x] = _ema(today['oi'], prev[x], span)
+
+    for x in leg_columns:
+        value = pd.to_numeric(today[x], errors='coerce')
+        today[x + '_change'] = value - prev[x]
+        today[x + '_pct'] = _pct(today[x + '_change'], prev[x])
+        today[x + '_ema_5d'] = _ema(value, prev[x + '_ema_5d'], 5)
+
+    return today
+
+def materialize(rel_df, out_df, bump=True):
+    # Updates the summaries with the day's contract (rel_df) and outright (out_df) frames written by oi_to_db.py.
+    # bump=False leaves the invalidation of the cached queries to the caller (ex. after several products)
+    rel_df = split_contracts(rel_df)
+    rel_df['oi'] = contract_oi(rel_df)
+    rel_df['date'] = pd.to_datetime(rel_df['date']).dt.date
+    products = rel_df['product'].unique().tolist()
+    dates = rel_df['date'].unique().tolist()
+
+    # Previous snapshots of the products, one indexed query
+    start = min(dates) - timedelta(history_days)
+    rows = OIDaily.query.filter(
+        OIDaily.product.in_(products), OIDaily.date >= start, OIDaily.date < max(dates)
+    ).with_entities(*[getattr(OIDaily, x) for x in snapshot_columns]).all()
+    history = pd.DataFrame(rows, columns=snapshot_columns)
+
+    daily = compute_changes(
+        rel_df.reindex(columns=['contract', 'product', 'relationship', 'date', 'oi'] + leg_columns), history
+    )
+
+    totals = rel_df.groupby(['product', 'relationship', 'date']).agg(
+        oi = ('oi', 'sum'), contracts = ('contract', 'count')
+    ).reset_index()
+
+    out = out_df.rename(columns={'Product' : 'product', 'Month' : 'month', 'OpenInterest' : 'oi'})
+    out['date'] = pd.to_datetime(out['date']).dt.date
+
+    # Replace the rows of the day (the task can be rerun) and the latest snapshots of the products
+    OIDaily.query.filter(OIDaily.product.in_(products), OIDaily.date.in_(dates)).delete(synchronize_session=False)
+    RelationshipTotal.query.filter(
+        RelationshipTotal.product.in_(products), RelationshipTotal.date.in_(dates)
+    ).delete(synchronize_session=False)
+    OILatest.query.filter(OILatest.product.in_(products)).delete(synchronize_session=False)
+    OutrightLatest.query.filter(
+        OutrightLatest.product.in_(out['product'].unique().tolist())
+    ).delete(synchronize_session=False)
+
+    latest = rel_df.sort_values(by='date').drop_duplicates('contract', keep='last').reindex(
+        columns=['contract', 'product', 'relationship', 'month', 'date', 'oi'] + leg_columns
+    )
+    out_latest = out.sort_values(by='date').drop_duplicates(['product', 'month'], keep='last')
+
+    db.session.bulk_insert_mappings(OIDaily, _records(daily, daily_columns))
+    db.session.bulk_insert_mappings(RelationshipTotal, _records(
+        totals, ['product', 'relationship', 'date', 'oi', 'contracts']
+    ))
+    db.session.bulk_insert_mappings(OILatest, _records(latest, list(latest.columns)))
+    db.session.bulk_insert_mappings(OutrightLatest, _records(out_latest, ['product', 'month', 'date', 'oi']))
+    db.session.commit()
+
+    if bump:
+        get_cache().bump('oi')
+
+    return len(latest)
+
+def rebuild(days=40):
+    # Backfills the summaries from the raw tables for the last days, one day at a time
+    last = db.session.query(db.func.max(OpenInterest.date)).scalar()
+    if last is None:
+        return 0
+
+    count = 0
+    for day in pd.date_range(last - timedelta(days), last).date:
+        rel_df = pd.read_sql(OpenInterest.query.filter(OpenInterest.date == day).statement, db.session.bind)
+        if rel_df.empty:
+            continue
+        out_df = pd.read_sql(Outright_OI.query.filter(Outright_OI.date == day).statement, db.session.bind)
+        count += materialize(rel_df, out_df)
+
+    return count
@@ -8,10 +8,12 @@ Celery process to download daily open interest from CME website and upload to th
 
 from .. import db, celery
 from ..base.models import OpenInterest, Outright_OI
+from . import ticker_meta, oi_summary, oi_history, report_parser
+from .cache import get_cache
 import requests
 import pandas as pd
 import datetime as dt
-from time import sleep
+from celery import chord
 
 # Define the CME products to look for and their URL ids, relationships for trading
 p_dict = {
@@ -30,137 +32,212 @@ p_dict = {
 
 
 # Base url for downloading open interest data from CME website
-# Change DATE, PORF and PRODUCTID
+# Change DATE, PORF, PRODUCTID and MEDIA
 # ex. https://www.cmegroup.com/CmeWS/exp/voiTotalsViewExport.ctl?media=xls&tradeDate=20200218&reportType=F&productId=HO
-base_url = 'https://www.cmegroup.com/CmeWS/exp/voiProductDetailsViewExport.ctl?media=xls&tradeDate=DATE&reportType=PORF&productId=PRODUCTID'
+base_url = 'https://www.cmegroup.com/CmeWS/exp/voiProductDetailsViewExport.ctl?media=MEDIA&tradeDate=DATE&reportType=PORF&productId=PRODUCTID'
 
-def request_data(url):
-    # Pulls in csv file and returns as a dataframe
-    r = requests.get(url)
-    output = open('temp_output.xls', 'wb')
-    output.write(r.content)
-    output.close()
+# Format of the downloaded reports ('xls' or 'csv'), parsed by the fastest available backend (see report_parser.py)
+report_format = 'xls'
 
-    df = pd.read_excel('temp_output.xls', nrows = 100, header=5, thousands=',')
+def request_data(url, name=None):
+    # Pulls in the report and returns its Month/At Close columns as a dataframe
+    # (read from memory, product subtasks can run in parallel on the same worker)
+    r = requests.get(url)
+    if name:
+        report_parser.record(r.content, '.'.join([name, report_format]))
 
-    return df
+    return report_parser.parse(r.content, report_format)
 
 def get_relevant_file(date, value, p_or_f):
     # Pulls in prelimnary/final result for open interest data for given product
     url = base_url.replace('DATE', date.strftime('%Y%m%d')).replace('PORF', p_or_f).replace('PRODUCTID', str(value))
-    df = request_data(url)
+    url = url.replace('MEDIA', report_format)
+    df = request_data(url, '_'.join([str(value), date.strftime('%Y%m%d'), p_or_f]))
     if df['Month'].isnull().idxmax() == 0: # returns an empty dataframe if the file is incomplete/incorrect
         return pd.DataFrame(), True
     else:
         df = df.iloc[:df['Month'].isnull().idxmax() - 1]
         return df, False
 
-def get_relationships_oi(df, rel_list, prod, date_yest):
+# Fields of the typed rows flowing from the parsed report to the database, in the order of the row tuples
+outright_fields = ('Product', 'Month', 'OpenInterest', 'date')
+contract_fields = ('contract', 'oi_1', 'oi_2', 'oi_3', 'oi_4', 'date')
+
+# Rows per executemany
+chunk_size = 1000
+
+def _num(x):
+    # float, None for missing values (NaN isn't valid in the database)
+    return None if x is None or x != x else float(x)
+
+def outright_rows(df, prod, date_yest):
+    # Outright wise open interest rows (Product, Month, OpenInterest, date) of a parsed report
+    for month, oi in zip(df['Month'], df['At Close']):
+        month = month.replace(' ', '').capitalize()
+        if prod == 'LEANHOGS' and 'May' in month: # traders don't trade May outright
+            continue
+        yield (prod, month, _num(oi), date_yest)
+
+def get_relationships_oi(outrights, rel_list, prod, date_yest):
     # Calculates the open interest per contract by getting individual outrights' open interest
-    # Relevant contracts are chosen according to the relationship defined
-    rows_list = []
-    for rel in rel_list:
-        # rel = rel_list[0]
+    # Relevant contracts are chosen according to the relationship defined. Yields (contract, oi_1..oi_4, date) rows
+    # Legs are picked by position, only the months and OI of the outrights are kept (outrights can be a generator)
+    months, oi = [], []
+    for x in outrights:
+        months.append(x[1])
+        oi.append(x[2])
 
+    for rel in rel_list:
+        # (months between legs, number of legs)
         if rel == '1m Fly' or rel == 'consecutive Fly' or (rel == '2m Fly' and prod == 'LIVECATTLE'):
-            for i in range(df.shape[0]-2):
-                cntr = ' '.join([prod, rel, df.loc[i, 'Month']])
-                x = df.loc[i:i+2, 'OpenInterest']
-                rows_list.append({'contract' : cntr, 'oi_1' : x.iloc[0], 'oi_2' : x.iloc[1], 'oi_3' : x.iloc[2] })
-
+            step, legs = 1, 3
         elif rel == '2m Fly':
-            for i in range(df.shape[0]-4):
-                cntr = ' '.join([prod, rel, df.loc[i, 'Month']])
-                x = df.loc[i:i+4:2, 'OpenInterest']
-                rows_list.append({'contract' : cntr, 'oi_1' : x.iloc[0], 'oi_2' : x.iloc[1], 'oi_3' : x.iloc[2] })
-
+            step, legs = 2, 3
         elif rel == '1m 2x' or rel == 'consecutive 2x' or (rel == '2m 2x' and prod == 'LIVECATTLE'):
-            for i in range(df.shape[0]-3):
-                cntr = ' '.join([prod, rel, df.loc[i, 'Month']])
-                x = df.loc[i:i+3, 'OpenInterest']
-                rows_list.append({'contract' : cntr, 'oi_1' : x.iloc[0], 'oi_2' : x.iloc[1], 'oi_3' : x.iloc[2], 'oi_4' : x.iloc[3] })
-
+            step, legs = 1, 4
         elif rel == '2m 2x':
-            for i in range(df.shape[0]-6):
-                cntr = ' '.join([prod, rel, df.loc[i, 'Month']])
-                x = df.loc[i:i+6:2, 'OpenInterest']
-                rows_list.append({'contract' : cntr, 'oi_1' : x.iloc[0], 'oi_2' : x.iloc[1], 'oi_3' : x.iloc[2], 'oi_4' : x.iloc[3] })
+            step, legs = 2, 4
         else:
             print (rel + ' Relationship not defined')
+            continue
+
+        span = step * (legs - 1)
+        for i in range(len(months) - span):
+            x = tuple(oi[i:i + span + 1:step]) + (None,) * (4 - legs)
+            yield (' '.join([prod, rel, months[i]]),) + x + (date_yest,)
+
+def chunked(rows, size=chunk_size):
+    # Lists of at most size rows from an iterable of rows
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def insert_rows(model, fields, rows):
+    # Inserts the rows in chunks (one executemany each), returns the number of rows. The caller commits
+    count = 0
+    for chunk in chunked(rows):
+        db.session.bulk_insert_mappings(model, [dict(zip(fields, x)) for x in chunk])
+        count += len(chunk)
+    return count
+
+def frame(fields, rows):
+    return pd.DataFrame.from_records(list(rows), columns=fields)
+
+# Retry policy of the per-product tasks, products whose reports are often late get more/longer retries
+retry_policies = {
+    'default' : {'max_retries' : 3, 'countdown' : 120},
+    'NATURALGAS' : {'max_retries' : 6, 'countdown' : 300},
+    'LIGHTSWEETCRUDEOIL' : {'max_retries' : 6, 'countdown' : 300},
+}
+
+# Oldest date to go back to when looking for the last available report
+max_lookback = 7
+
+def fetch_product(prod, value, date_yest):
+    # Gets the most recent open interest report of a product, returns the parsed report and its date
+
+    if ticker_meta.lookup(prod) is None: # Product names here are the TickerData ids, flag any that drifted
+        print (prod + ' not in ticker data')
+
+    flag = True
+    # Getting the relevant file
+    # 1) Try to get 'final' open interest data for most recent date (yesterday). If that fails
+    #    get the 'prelimnary' data for the most recent date.
+    # 2) If no data is available for yesterday, continue loop until the last available date.
+    lookback = 0
+    while flag:
+        df, flag = get_relevant_file(date_yest, value['id'], 'F')
+
+        if df.empty:
+            df, flag = get_relevant_file(date_yest, value['id'], 'P')
+
+        if flag:
+            date_yest = date_yest - dt.timedelta(1)
+            lookback += 1
+            if lookback > max_lookback:
+                raise ValueError('No open interest report in the last {} days'.format(max_lookback))
+
+    return df, date_yest
+
+def write_product(prod, df, rel_list, date_yest):
+    # Streams the contract and outright rows of a parsed report into the database in one transaction, then updates
+    # the summaries and the columnar history of the product. Rows are generated again for each step instead of being
+    # kept. Returns the row counts and the status of each step, raises if the rows couldn't be written
+    outrights = lambda : outright_rows(df, prod, date_yest)
+    contracts = lambda : get_relationships_oi(outrights(), rel_list, prod, date_yest)
 
-    rel_df = pd.DataFrame(rows_list)
-    rel_df['date'] = date_yest
-
-    return rel_df
-
-# Define periodic task that runs every morning at 7 am
-@celery.task(bind=True, name='Open-Interest-to-DB')
-def main(self):
-    date_today = dt.date.today()
-    date_yest = date_today - dt.timedelta(1)
-
-    rel_df_list = []
-    out_df_list = []
-    for prod, value in p_dict.items():
-        # prod = 'LEANHOGS'; value = {'id' : 19, 'rel' : ['consecutive Fly', 'consecutive 2x']}
-        print (prod)
-
-        flag = True
-        # Getting the relevant file
-        # 1) Try to get 'final' open interest data for most recent date (yesterday). If that fails
-        #    get the 'prelimnary' data for the most recent date.
-        # 2) If no data is available for yesterday, continue loop until the last available date.
-        while flag:
-            df, flag = get_relevant_file(date_yest, value['id'], 'F')
-
-            if df.empty:
-                df, flag = get_relevant_file(date_yest, value['id'], 'P')
-
-            if flag:
-                date_yest = date_yest - dt.timedelta(1)
-
-        # Outright wise open interest
-        df = df[['Month', 'At Close']]
-        df.columns = ['Month', 'OpenInterest']
-        df['Month'] = df['Month'].str.replace(' ', '').str.capitalize()
-        df['Product'] = prod
-        df['date'] = date_yest
-
-        if prod == 'LEANHOGS':
-        # traders don't trade May outright
-            df = df[~df.Month.str.contains('May')].reset_index(drop=True)
-
-        # Contract wise open interest
-        rel_df = get_relationships_oi(df, value['rel'], prod, date_yest)
-        rel_df_list.append(rel_df)
-        out_df_list.append(df)
-
-        sleep(2) # To prevent multiple, fast requests to the CME website
-
-    rel_df = pd.concat(rel_df_list, ignore_index=True)
-    rel_df = rel_df.astype(object).where(pd.notnull(rel_df), None)
-
-
-    ret_vals = []
     try:
-        # Add contract-wise data to the database using SQLAlchemy
-        db.session.bulk_insert_mappings(OpenInterest, rel_df.to_dict('records'))
+        # Add contract-wise and outright data to the database using SQLAlchemy
+        n_contract = insert_rows(OpenInterest, contract_fields, contracts())
+        n_outright = insert_rows(Outright_OI, outright_fields, outrights())
         db.session.commit()
-        ret_vals.append('SUCESS: contract OI')
     except:
         db.session.rollback()
-        ret_vals.append('ERROR: contract OI')
-
-    out_df = pd.concat(out_df_list, ignore_index=True)
+        raise
 
+    ret_vals = {'contract_rows' : n_contract, 'outright_rows' : n_outright}
+    rel_df = frame(contract_fields, contracts())
+    out_df = frame(outright_fields, outrights())
     try:
-        # Add outright data to the database using SQLAlchemy
-        db.session.bulk_insert_mappings(Outright_OI, out_df.to_dict('records'))
-        db.session.commit()
-        ret_vals.append('SUCESS: outright OI')
-    except:
+        # Update the summary tables read by oi_queries.py, the cached queries are invalidated by the chord callback
+        oi_summary.materialize(rel_df, out_df, bump=False)
+        ret_vals['summary'] = 'SUCCESS'
+    except Exception as e:
         db.session.rollback()
-        ret_vals.append('ERROR: outright OI')
+        ret_vals['summary'] = 'ERROR: {}'.format(e)
+
+    try:
+        # Append the day to the columnar history used for research
+        oi_history.append('contract', rel_df)
+        oi_history.append('outright', out_df)
+        ret_vals['history'] = 'SUCCESS'
+    except Exception as e:
+        ret_vals['history'] = 'ERROR: {}'.format(e)
 
     return ret_vals
 
+# Per product subtask: fetch, parse, build relationships and write the product. Runs on any worker, rate limited per
+# worker so the CME website doesn't get multiple, fast requests
+@celery.task(bind=True, name='Open-Interest-Product', rate_limit='30/m')
+def product_task(self, prod, date_yest):
+    policy = retry_policies.get(prod, retry_policies['default'])
+    try:
+        df, date_report = fetch_product(prod, p_dict[prod], dt.date.fromisoformat(date_yest))
+        written = write_product(prod, df, p_dict[prod]['rel'], date_report)
+    except Exception as exc:
+        if self.request.retries < policy['max_retries']:
+            raise self.retry(exc=exc, countdown=policy['countdown'], max_retries=policy['max_retries'])
+        # Out of retries, report the failure so the other products are still written
+        return {'product' : prod, 'status' : 'ERROR', 'error' : repr(exc), 'retries' : self.request.retries}
+
+    return dict(written, product=prod, status='SUCCESS', date=date_report.isoformat(), retries=self.request.retries)
+
+# Chord callback: report of every product and invalidation of the cached OI queries
+@celery.task(bind=True, name='Open-Interest-Write')
+def write_task(self, results):
+    get_cache().bump('oi')
+
+    succeeded = [x for x in results if x['status'] == 'SUCCESS']
+    return {
+        'products' : {x['product'] : x['status'] for x in results},
+        'errors' : {x['product'] : x['error'] for x in results if x['status'] != 'SUCCESS'},
+        'rows' : {x['product'] : [x['contract_rows'], x['outright_rows']] for x in succeeded},
+        'summaries' : {x['product'] : x['summary'] for x in succeeded},
+        'history' : {x['product'] : x['history'] for x in succeeded},
+    }
+
+# Define periodic task that runs every morning at 7 am
+# Fans out one subtask per product writing the product to the database, joined by a chord that reports them
+@celery.task(bind=True, name='Open-Interest-to-DB')
+def main(self, products=None):
+    date_yest = dt.date.today() - dt.timedelta(1)
+    products = products or list(p_dict)
+
+    result = chord(product_task.s(prod, date_yest.isoformat()) for prod in products)(write_task.s())
+
+    return 'STARTED: {} products, write task {}'.format(len(products), result.id)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Products and relationships traded, shared by the trading logic app (algo.py) and the modules built on top of it
+
+@author: sbhargava
+"""
+import re
+
+# Making a change to any of these variables will require restarting the server
+# Define all products and relationships traded. Tick configuration (including the number of decimals prices are rounded
+# to) comes from ticker_meta.py
+pdict = {
+    'Brent': {'rel': ['1m Fly', '1m 2x', '1m DC', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
+    'Brent_6m': {'rel': ['6m Fly', '6m 2x', '12m Fly', '12m 2x']},
+    'Brent_crack': {'rel': ['1m Crack', '2m Crack', '3m Crack', '6m Crack', '12m Crack']},
+    'Cocoa': {'rel': ['consecutive fly', 'consecutive 2x']},
+    'Cocoaliffe': {'rel': ['consecutive fly', 'consecutive 2x']},
+    'Cocoa-cocoaliffe': {'rel': ['consecutive sp']},
+    'Feedercattle': {'rel': ['consecutive Fly', 'consecutive 2x']},
+    'Leanhogs': {'rel': ['consecutive Fly', 'consecutive 2x']},
+    'Livecattle': {'rel': ['2m Fly', '2m 2x']},
+    'Go': {'rel': ['1m 2x', '2m 2x', '3m Fly', '3m 2x', '6m Fly', '6m 2x', '12m Fly', '12m 2x']},
+    'Ho': {'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
+    'Ho-go': {'rel': ['1m Sp', '2m Sp', '3m Sp', '6m Sp', '12m Sp']},
+    'Naturalgas': {'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '12m 2x']},
+    'Gasoline(rbob)': {'rel': ['1m Fly', '1m 2x', '2m Fly', '2m 2x', '3m Fly', '3m 2x']},
+    'Soybeanoil': {'rel': ['consecutive Fly', 'consecutive 2x']},
+    'Sugarno.11': {'rel': ['consecutive Fly', 'consecutive 2x']},
+    'Wheat': {'rel': ['consecutive Fly', 'consecutive 2x']},
+    'Kcwheat': {'rel': ['consecutive Fly', 'consecutive 2x']},
+}
+
+def resolve_product(url_product):
+    # Product as read off the URL to pdict key, accounting for naming convention anomalies present in legacy system
+    if re.search('rbob', url_product, re.IGNORECASE):
+        return 'Gasoline(rbob)'
+    return url_product.capitalize()
+
+def product_folder(prod_lookup):
+    # pdict keys map to the product templates are saved under (Brent_6m and Brent_crack are saved under Brent)
+    return prod_lookup.split("_")[0]
+
+def product_keys(folder):
+    # pdict keys whose templates are saved under folder, ex. 'Brent' -> ['Brent', 'Brent_6m', 'Brent_crack']
+    return [k for k in pdict.keys() if product_folder(k) == folder]
+
+def route(folder, relationship):
+    # pdict key a relationship of folder belongs to, defaults to the key that is the same as folder
+    for prod_lookup in product_keys(folder):
+        if relationship.lower() in [x.lower() for x in pdict[prod_lookup]['rel']]:
+            return prod_lookup
+    return folder
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling of the Dash callbacks in algo.py and summary.py.
+
+instrument(app) wraps every callback of a Dash app to record its wall time, response size and, for the calls in
+progress, the time spent between mark() calls (ex. the STEP blocks of generate_tables_charts) and in file/DB I/O
+(io() blocks and the @timed_io functions). Exceptions swallowed by a callback are recorded with swallowed().
+
+Calls are aggregated per worker into latency histograms per callback and a buffer of recent calls, exposed as JSON by
+the endpoint <url_base>_profile, protected by the PROFILE_TOKEN setting (Flask config or environment variable,
+passed as the X-Profile-Token header, never in the URL where it would end up in access logs). The endpoint is disabled
+if no token is set.
+
+The sampling profiler is opt-in (enable_sampling(), or PROFILE_SAMPLING=1): a background thread samples the stacks
+of the threads running callbacks and the hottest lines are kept with each call.
+
+@author: sbhargava
+"""
+from collections import deque, Counter
+from flask import request, jsonify, abort, current_app
+import functools, threading, traceback, bisect, hmac, time, sys, os
+
+# Upper bounds of the latency histogram buckets in ms, the last bucket is everything above
+buckets_ms = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+recent_size = 500
+
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {} # {callback : [count per bucket]}
+_totals = {} # {callback : [calls, total ms, errors]}
+_recent = deque(maxlen=recent_size)
+
+class CallRecord:
+    # Timings of one callback call
+    def __init__(self, callback):
+        self.callback = callback
+        self.start = time.time()
+        self.steps = []
+        self.io = Counter()
+        self.errors = []
+        self.samples = None
+        self._mark = None
+
+    def mark(self, name):
+        now = time.time()
+        self.close_mark(now)
+        self._mark = (name, now)
+
+    def close_mark(self, now=None):
+        if self._mark:
+            name, start = self._mark
+            self.steps.append((name, round(((now or time.time()) - start) * 1000, 2)))
+            self._mark = None
+
+def current():
+    # Record of the callback running in this thread, None outside of instrumented callbacks
+    return getattr(_local, 'record', None)
+
+def mark(name):
+    # Starts timing a step of the current callback, ending the previous step
+    record = current()
+    if record:
+        record.mark(name)
+
+class io:
+    # Times a block of file/DB I/O, ex. with profiling.io('risk_report'): ...
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        record = current()
+        if record:
+            record.io[self.kind] += (time.time() - self.start) * 1000
+        return False
+
+def timed_io(kind):
+    # Decorator timing every call of a function as I/O of kind
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with io(kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def swallowed(where):
+    # Records the exception being handled, for callbacks that return empty elements instead of raising
+    record = current()
+    if record:
+        record.errors.append({'where' : where, 'error' : traceback.format_exc(limit=5)})
+
+# ------------------------------------------------------------------------------------------------------------------- #
+# Sampling profiler
+# ------------------------------------------------------------------------------------------------------------------- #
+class Sampler:
+    # Samples the stacks of threads running callbacks every interval seconds
+    def __init__(self, interval=0.005, depth=3):
+        self.interval = interval
+        self.depth = depth
+        self.active = {} # {thread id : Counter}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='dash-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Stops the sampling thread and waits for it to exit
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, counter in list(self.active.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    stack.append('{}:{} {}'.format(
+                        os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name
+                    ))
+                    frame = frame.f_back
+                if stack:
+                    counter[' < '.join(stack)] += 1
+
+_sampler = None
+
+def enable_sampling(interval=0.005):
+    global _sampler
+    if _sampler is not None:
+        return _sampler
+    _sampler = Sampler(interval)
+    _sampler.start()
+    return _sampler
+
+def disable_sampling():
+    global _sampler
+    sampler, _sampler = _sampler, None
+    if sampler is not None:
+        sampler.stop()
+
+if os.environ.get('PROFILE_SAMPLING') == '1':
+    enable_sampling()
+
+# ------------------------------------------------------------------------------------------------------------------- #
+# Callback instrumentation
+# ------------------------------------------------------------------------------------------------------------------- #
+def response_size(result):
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    return getattr(result, 'content_length', None)
+
+def _finish(record, result, status):
+    record.close_mark()
+    wall_ms = (time.time() - record.start) * 1000
+
+    call = {
+        'callback' : record.callback,
+        'time' : record.start,
+        'wall_ms' : round(wall_ms, 2),
+        'status' : status,
+        'size' : response_size(result),
+        'steps' : record.steps,
+        'io_ms' : {k : round(v, 2) for k, v in record.io.items()},
+        'errors' : record.errors,
+    }
+    if record.samples:
+        call['hot'] = record.samples.most_common(10)
+
+    with _lock:
+        histogram = _histograms.setdefault(record.callback, [0] * (len(buckets_ms) + 1))
+        histogram[bisect.bisect_left(buckets_ms, wall_ms)] += 1
+        totals = _totals.setdefault(record.callback, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += wall_ms
+        totals[2] += int(status == 'error' or bool(record.errors))
+        _recent.append(call)
+
+def wrap(callback_id, func):
+    from dash.exceptions import PreventUpdate
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = CallRecord(callback_id)
+        parent, _local.record = current(), record
+
+        sampler = _sampler
+        ident = threading.get_ident()
+        if sampler:
+            record.samples = sampler.active[ident] = Counter()
+
+        result, status = None, 'ok'
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except PreventUpdate:
+            status = 'prevented'
+            raise
+        except Exception:
+            status = 'error'
+            record.errors.append({'where' : 'callback', 'error' : traceback.format_exc(limit=5)})
+            raise
+        finally:
+            if sampler:
+                sampler.active.pop(ident, None)
+            _local.record = parent
+            _finish(record, result, status)
+    wrapper.__profiled__ = True
+    return wrapper
+
+def instrument(app):
+    # Wraps every callback registered on the Dash app and adds the profile endpoint to its server
+    for callback_id, callback in app.callback_map.items():
+        func = callback.get('callback')
+        if func is not None and not getattr(func, '__profiled__', False):
+            callback['callback'] = wrap(callback_id, func)
+
+    server = app.server
+    if 'dash_profile' not in server.view_functions:
+        server.add_url_rule(
+            app.config.routes_pathname_prefix + '_profile', 'dash_profile', profile_endpoint, methods=['GET']
+        )
+
+    return app
+
+# ------------------------------------------------------------------------------------------------------------------- #
+# Endpoint
+# ------------------------------------------------------------------------------------------------------------------- #
+def snapshot(slowest=20):
+    # Histograms and totals per callback and the slowest recent calls of this worker
+    with _lock:
+        histograms = {k : list(v) for k, v in _histograms.items()}
+        totals = {k : list(v) for k, v in _totals.items()}
+        recent = list(_recent)
+
+    labels = ['<={}'.format(x) for x in buckets_ms] + ['>{}'.format(buckets_ms[-1])]
+    return {
+        'pid' : os.getpid(),
+        'sampling' : _sampler is not None,
+        'callbacks' : {
+            k : {
+                'calls' : totals[k][0],
+                'mean_ms' : round(totals[k][1] / totals[k][0], 2) if totals[k][0] else 0,
+                'errors' : totals[k][2],
+                'histogram_ms' : dict(zip(labels, histograms[k])),
+            } for k in histograms
+        },
+        'slowest' : sorted(recent, key=lambda x : x['wall_ms'], reverse=True)[:slowest],
+    }
+
+def profile_endpoint():
+    token = current_app.config.get('PROFILE_TOKEN') or os.environ.get('PROFILE_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Profile-Token', '').encode(), token.encode()):
+        abort(403)
+
+    return jsonify(snapshot(int(request.args.get('slowest', 20))))
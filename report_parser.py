@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parsers of the CME open interest reports downloaded by oi_to_db.py.
+
+Every backend returns the same frame: the 'Month' (str, None for blank cells) and 'At Close' (float) columns of the
+first 100 rows under the header row, which is all oi_to_db.py uses. Backends by format:
+
+    xls : 'calamine' (python-calamine, Rust reader, optional), 'pandas' (pd.read_excel, default engine)
+    csv : 'csv' (csv module), 'pandas' (pd.read_csv)
+
+parse() uses the first available backend of the format in the order of the backends setting. Raw reports are kept in
+data/oi_reports/ when recording is on (OI_RECORD_REPORTS=1), and the benchmark times every backend on them and
+checks they return the same frame as the pandas backend:
+
+    python -m <package>.report_parser bench --repeat 20
+
+@author: sbhargava
+"""
+from . import blueprint
+
+from pathlib import Path
+from io import BytesIO, StringIO
+import argparse, csv, timeit, os
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+columns = ['Month', 'At Close']
+
+# Rows read under the header, same as the nrows the reports were always read with
+nrows = 100
+
+# Row of the header in the xls reports (pd.read_excel header). The other backends look for the header row instead
+header_row = 5
+
+# Backends tried in order for each format, the first available is used
+backends = {
+    'xls' : ['calamine', 'pandas'],
+    'csv' : ['csv', 'pandas'],
+}
+
+def reports_dir():
+    return Path(blueprint.root_path, 'data', 'oi_reports')
+
+def typed(df):
+    # Month as str (None if blank), At Close as float (thousands separators removed)
+    month = df['Month'].where(df['Month'].notnull(), None)
+    month = month.map(lambda x : None if x is None or str(x).strip() == '' else str(x))
+    close = df['At Close']
+    if close.dtype == object:
+        close = close.astype(str).str.replace(',', '', regex=False)
+    return pd.DataFrame({'Month' : month.astype(object), 'At Close' : pd.to_numeric(close, errors='coerce').astype(float)})
+
+def from_rows(rows):
+    # Frame of the report from its rows (lists of cell values): finds the header and keeps the non blank rows under it
+    for i, row in enumerate(rows):
+        cells = [str(x).strip() for x in row]
+        if all(x in cells for x in columns):
+            index = [cells.index(x) for x in columns]
+            break
+    else:
+        raise ValueError('No header with {} in the report'.format(columns))
+
+    data = []
+    for row in rows[i + 1:]:
+        if not any(str(x).strip() for x in row):
+            continue # Blank rows are skipped, like pandas does
+        data.append([row[j] if j < len(row) else None for j in index])
+        if len(data) == nrows:
+            break
+
+    return typed(pd.DataFrame(data, columns=columns))
+
+def parse_pandas_xls(content):
+    df = pd.read_excel(BytesIO(content), nrows=nrows, header=header_row, thousands=',')
+    return typed(df[columns])
+
+def parse_calamine(content):
+    sheet = CalamineWorkbook.from_filelike(BytesIO(content)).get_sheet_by_index(0)
+    return from_rows(sheet.to_python(skip_empty_area=False))
+
+def parse_csv(content):
+    text = content.decode('utf-8-sig', errors='replace')
+    return from_rows(list(csv.reader(StringIO(text))))
+
+def parse_pandas_csv(content):
+    text = content.decode('utf-8-sig', errors='replace')
+    lines = text.splitlines()
+    header = next(i for i, x in enumerate(lines) if all(y in x for y in columns))
+    df = pd.read_csv(StringIO(text), skiprows=header, nrows=nrows, thousands=',', skip_blank_lines=True)
+    return typed(df[columns])
+
+# {format : {backend : (parser, available)}}
+parsers = {
+    'xls' : {
+        'calamine' : (parse_calamine, CalamineWorkbook is not None),
+        'pandas' : (parse_pandas_xls, True),
+    },
+    'csv' : {
+        'csv' : (parse_csv, True),
+        'pandas' : (parse_pandas_csv, True),
+    },
+}
+
+def available(fmt):
+    return [x for x in backends[fmt] if parsers[fmt][x][1]]
+
+def parse(content, fmt='xls', backend=None):
+    # Frame of a raw report (bytes) of the given format with the given backend, or the first available one
+    backend = backend or available(fmt)[0]
+    return parsers[fmt][backend][0](content)
+
+def record(content, name):
+    # Keeps a raw report for the benchmark if recording is on (OI_RECORD_REPORTS=1)
+    if os.environ.get('OI_RECORD_REPORTS') != '1':
+        return
+    os.makedirs(reports_dir(), exist_ok=True)
+    with open(Path(reports_dir(), name), 'wb') as f:
+        f.write(content)
+
+# ------------------------------------------------------------------------------------------------------------------- #
+# Benchmark
+# ------------------------------------------------------------------------------------------------------------------- #
+def samples(folder=None):
+    # {format : [content]} of the recorded reports
+    out = {}
+    for path in sorted(Path(folder or reports_dir()).glob('*')):
+        fmt = path.suffix.lstrip('.').lower()
+        if fmt in parsers:
+            out.setdefault(fmt, []).append(path.read_bytes())
+    return out
+
+def same(df, ref):
+    try:
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), ref.reset_index(drop=True), check_dtype=True)
+        return True
+    except AssertionError:
+        return False
+
+def bench(folder=None, repeat=10):
+    # Mean ms per report of every available backend on the recorded reports, and whether its output matches the
+    # pandas backend. Returns {format : {backend : {'ms', 'matches', 'reports'}}}
+    results = {}
+    for fmt, contents in samples(folder).items():
+        refs = [parse(x, fmt, 'pandas') for x in contents]
+        for backend, (func, ok) in parsers[fmt].items():
+            if not ok:
+                continue
+            seconds = timeit.timeit(lambda : [func(x) for x in contents], number=repeat)
+            results.setdefault(fmt, {})[backend] = {
+                'ms' : seconds / repeat / len(contents) * 1000,
+                'matches' : all(same(func(x), ref) for x, ref in zip(contents, refs)),
+                'reports' : len(contents),
+            }
+    return results
+
+def fastest(results):
+    # Fastest backend matching pandas per format, ex. to set the backends order
+    return {
+        fmt : min((x for x in res if res[x]['matches']), key=lambda x : res[x]['ms'])
+        for fmt, res in results.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='OI report parsers')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--folder', default=None, help='Folder with recorded reports (.xls/.csv)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    results = bench(args.folder, args.repeat)
+    for fmt, res in results.items():
+        for backend, x in sorted(res.items(), key=lambda x : x[1]['ms']):
+            print('{:<4} {:<10} {:>8.2f} ms/report {:>4} reports{}'.format(
+                fmt, backend, x['ms'], x['reports'], '' if x['matches'] else '  (output differs from pandas)'
+            ))
+    print('fastest:', fastest(results))
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,12 @@ Script to organize and track trading templates
 """
 from . import blueprint
 from ..positions.positions import get_positions
-from ..positions.risk_report import _create_id_
 from ..dash_utils import apply_layout_with_auth
+from . import template_store
+from .contract import Contract
+from .cache import read_pickle
+from .main_tables import position_cells
+from . import profiling
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_html_components as html
@@ -20,10 +24,9 @@ import datetime as dt
 from dash import Dash
 import pandas as pd
 import numpy as np
-import dash_table, json, os, re
+import dash_table, json
 
 url_base = '/dash/Summary/'
-base_path = Path(blueprint.root_path, 'data') # Path where trading templates are stored in JSON format
 
 def Add_Dash(server):
 
@@ -80,21 +83,14 @@ def Add_Dash(server):
             raise PreventUpdate
 
         # Get position df
-        df = get_positions()
-        df['id'] = df.apply(lambda x : _create_id_(x), axis=1)
-        df['split'] = df.id.str.split("_", 1)
+        with profiling.io('positions'):
+            df = get_positions()
+        # Template ids of the positions, vectorized (same ids as the risk report's _create_id_)
+        df['id'] = position_cells(df)['id']
         df['contract'] = df.contract.str.replace("_", " ").str.lower()
 
-        # Get list of algo_exists
-        algo_exists = []
-        base_directories = os.listdir(base_path)
-        for dirs in base_directories:
-            prod_dir = Path(base_path, dirs)
-            if os.path.isdir(prod_dir):
-                 algo_exists.extend(
-                 [ '_'.join([dirs.upper(), x.replace('.heuristic', '')]) for x in os.listdir(prod_dir) if re.search('heuristic', x, re.IGNORECASE)]
-                 )
-
+        # Get list of algo_exists (active templates in one query to the template store)
+        algo_exists = [template_id(x) for x in template_store.load_all('heuristic').keys()]
 
         return df.to_json(orient='records'), algo_exists
 
@@ -126,7 +122,7 @@ def Add_Dash(server):
         df = pd.DataFrame(json.loads(df))
         # Get dataframe of RP from pickle and convert to dict
         fpath = Path(blueprint.root_path, 'data', 'daily_rp').with_suffix('.pkl')
-        rp_df = pd.read_pickle(fpath)
+        rp_df = read_pickle(fpath)
         rp_dict = rp_df.to_dict('series')['RP']
 
         table = pd.DataFrame()
@@ -147,7 +143,8 @@ def Add_Dash(server):
             return []
 
         df = pd.DataFrame(json.loads(df))
-        df['incomplete algo'] = df.split.map(lambda x : check_incomplete_algo(x))
+        templates = {template_id(k) : v for k, v in template_store.load_all('heuristic').items()}
+        df['incomplete algo'] = df.id.map(lambda x : check_incomplete_algo(templates.get(x)))
         table = df[df['incomplete algo']].reset_index()
         table['link'] = table.id.map(lambda x : generate_algo_link(x))
 
@@ -160,35 +157,36 @@ def Add_Dash(server):
         if not algo_exists:
             return []
 
+        templates = {template_id(k) : v for k, v in template_store.load_all('heuristic').items()}
+
         table = pd.DataFrame()
-        table['id'] = algo_exists
+        table['id'] = [x for x in algo_exists if x in templates]
         table['link'] = table.id.map(lambda x : generate_algo_link(x))
-        table['date'] = table.id.map(lambda x: recently_updated(x.split("_", 1)))
+        table['date'] = table.id.map(lambda x: recently_updated(templates[x]))
         table = table.sort_values(by='date', ascending = False)
         table = table[table.date > dt.datetime.now() - dt.timedelta(10)]
         table['date'] = table.date.dt.strftime('%a %I:%S %p')
 
         return generate_table(table, rp=['date'])
 
+    profiling.instrument(app)
+
     return app.server
 # -------------------------------------------------------------------------------------------------------------------------------------------------------- #
-def recently_updated(x):
-    prod, rel = x
-    filepath = Path(base_path, prod.capitalize(), rel).with_suffix('.heuristic')
+def template_id(contract_name):
+    # 'Brent 1m Fly Jan21 B' -> 'BRENT_1m_Fly_Jan21_B', same format as the position ids
+    return Contract.get(contract_name).contract_id
 
-    file_json = json.load(open(Path(filepath), "r"))
-    algo_df = pd.DataFrame(file_json).set_index('Params')
+def recently_updated(template):
+    algo_df = pd.DataFrame(template.data).set_index('Params')
     return dt.datetime.strptime(algo_df.loc['Last Updated', 'Value'], "%b %d %Y %X")
 
 
-def check_incomplete_algo(x):
-    prod, rel = x
-    filepath = Path(base_path, prod.capitalize(), rel).with_suffix('.heuristic')
+def check_incomplete_algo(template):
     ret = True
 
-    if os.path.isfile(filepath):
-        file_json = json.load(open(Path(filepath), "r"))
-        algo_df = pd.DataFrame(file_json).set_index('Params')
+    if template:
+        algo_df = pd.DataFrame(template.data).set_index('Params')
         algo_df.drop(labels = ['', 'Standard Deviation', 'Risk', 'Unwind Position'], axis = 0, inplace=True)
 
         if algo_df[algo_df.Value == ''].empty:
@@ -197,8 +195,11 @@ def check_incomplete_algo(x):
     return ret
 
 def generate_algo_link(x):
-    prod = x.split("_")[0].lower()
-    contract_url = '/'.join(['dash', prod,x])
+    try:
+        contract_url = Contract.from_id(x).url_path
+    except ValueError:
+        # Ids that do not parse as a contract (ex. missing month or side) keep the link built from the id itself
+        contract_url = '/'.join(['dash', x.split("_")[0].lower(), x])
     return ''.join([request.url_root, contract_url])
 
 
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Database store for the trading templates (heuristic tables) and notes created in algo.py.
+
+Every save adds a new version of the template in a single transaction, the latest version is flagged as current.
+Concurrent saves to the same contract can't create the same version (unique constraint), the losing save is retried
+on top of the new version. Reads are bulk queries on the indexed (product, relationship, month, side, expired) key, cached for every worker in
+the 'templates' namespace of cache.py which is invalidated by every write.
+
+create_table() creates the algo_templates table (and its indexes) if it doesn't exist and import_file_tree() loads the
+legacy data/<Product>/*.heuristic|notes and data/<Product>/expired/ files into the store, in that order when moving
+from the file tree. Contracts are flagged as expired by the Template-Expiry task once their month is no longer listed.
+
+@author: sbhargava
+"""
+from .. import db, celery
+from . import blueprint
+from .contract import Contract
+from .cache import memoize, get_cache, read_pickle
+from .profiling import timed_io
+
+from sqlalchemy.exc import IntegrityError
+from flask import current_app
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+import json, os
+
+kinds = ['heuristic', 'notes']
+
+# Functions called with the contract names after contracts are expired, ex. to update the archive index
+expire_hooks = []
+
+# Functions called with the contract name, kind and version after a template/notes is saved, ex. to export ladders
+save_hooks = []
+
+StoredTemplate = namedtuple('StoredTemplate', ['contract', 'version', 'data', 'updated', 'expired'])
+
+class AlgoTemplate(db.Model):
+    __tablename__ = 'algo_templates'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False) # 'heuristic' or 'notes'
+    product = db.Column(db.String(32), nullable=False) # ex. 'Brent', folder name templates were saved in
+    relationship = db.Column(db.String(32), nullable=False) # ex. '1m Fly'
+    month = db.Column(db.String(8), nullable=False) # ex. 'Jan21'
+    side = db.Column(db.String(1), nullable=False) # 'B' or 'S'
+    expired = db.Column(db.Boolean, nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False)
+    current = db.Column(db.Boolean, nullable=False, default=True)
+    data = db.Column(db.Text, nullable=False) # JSON
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'product', 'relationship', 'month', 'side', 'version', name='uq_algo_templates_version'),
+        db.Index('ix_algo_templates_key', 'product', 'relationship', 'month', 'side', 'expired'),
+        db.Index('ix_algo_templates_bulk', 'kind', 'product', 'current', 'expired'),
+    )
+
+    def to_stored(self):
+        return StoredTemplate(
+            contract = ' '.join([self.product, self.relationship, self.month, self.side]),
+            version = self.version,
+            data = json.loads(self.data),
+            updated = self.updated,
+            expired = self.expired,
+        )
+
+def _run_hooks(hooks, *args):
+    # Hooks run after the write is committed, errors are logged so they can't fail it
+    for hook in hooks:
+        try:
+            hook(*args)
+        except Exception:
+            current_app.logger.exception('Template store hook {} failed'.format(getattr(hook, '__name__', hook)))
+
+def create_table():
+    # Creates the algo_templates table with its constraint and indexes, does nothing if it already exists
+    AlgoTemplate.__table__.create(db.engine, checkfirst=True)
+
+def template_key(contract_name):
+    # 'Brent 1m Fly Jan21 B' -> ('Brent', '1m Fly', 'Jan21', 'B')
+    return Contract.get(contract_name).store_key
+
+def _key_filter(query, contract_name, kind):
+    prod, rel, mmyy, b_s = template_key(contract_name)
+    return query.filter_by(kind=kind, product=prod, relationship=rel, month=mmyy, side=b_s)
+
+@timed_io('db')
+def load(contract_name, kind='heuristic'):
+    # Current version of a contract's template/notes (StoredTemplate) or None if it doesn't exist
+    row = _key_filter(AlgoTemplate.query, contract_name, kind).filter_by(current=True).first()
+    return row.to_stored() if row else None
+
+@timed_io('db')
+def save(contract_name, data, kind='heuristic', expired=False, updated=None, retries=3):
+    # Saves a new version of the template/notes and returns the version number
+    prod, rel, mmyy, b_s = template_key(contract_name)
+
+    for attempt in range(retries):
+        try:
+            current = _key_filter(AlgoTemplate.query, contract_name, kind).filter_by(current=True).with_for_update().first()
+            if current:
+                current.current = False
+                expired = expired or current.expired
+
+            version = current.version + 1 if current else 1
+            db.session.add(AlgoTemplate(
+                kind = kind,
+                product = prod,
+                relationship = rel,
+                month = mmyy,
+                side = b_s,
+                expired = expired,
+                version = version,
+                current = True,
+                data = json.dumps(data),
+                updated = updated or datetime.now(),
+            ))
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Another worker saved a version first, retry on top of it
+            db.session.rollback()
+    else:
+        raise RuntimeError('Could not save {} {} after {} attempts'.format(contract_name, kind, retries))
+
+    get_cache().bump('templates')
+
+    # The version is committed, a failing hook (ex. broker down) doesn't fail the save
+    _run_hooks(save_hooks, contract_name, kind, version)
+    return version
+
+@memoize(ttl=600, namespace='templates')
+@timed_io('db')
+def load_product(product, kind='heuristic', expired=False):
+    # All current templates/notes of a product in one query, {contract_name : StoredTemplate}.
+    # expired=None returns both active and expired contracts
+    query = AlgoTemplate.query.filter_by(kind=kind, product=product, current=True)
+    if expired is not None:
+        query = query.filter_by(expired=expired)
+
+    return {x.contract : x for x in (row.to_stored() for row in query.all())}
+
+@memoize(ttl=600, namespace='templates')
+@timed_io('db')
+def load_all(kind='heuristic', expired=False):
+    # All current templates/notes of every product in one query, {contract_name : StoredTemplate}
+    query = AlgoTemplate.query.filter_by(kind=kind, current=True)
+    if expired is not None:
+        query = query.filter_by(expired=expired)
+
+    return {x.contract : x for x in (row.to_stored() for row in query.all())}
+
+def history(contract_name, kind='heuristic'):
+    # Every saved version of a contract's template/notes, latest first
+    query = _key_filter(AlgoTemplate.query, contract_name, kind).order_by(AlgoTemplate.version.desc())
+    return [row.to_stored() for row in query.all()]
+
+def list_contracts(product, expired=False):
+    # Names of contracts with a template or notes for product, without loading the data
+    query = db.session.query(
+        AlgoTemplate.relationship, AlgoTemplate.month, AlgoTemplate.side
+    ).filter_by(product=product, current=True, expired=expired).distinct()
+
+    return [' '.join([product, rel, mmyy, b_s]) for rel, mmyy, b_s in query.all()]
+
+def expire(contract_names):
+    # Flags contracts as expired (templates and notes), they then only show up in the archive
+    for contract_name in contract_names:
+        prod, rel, mmyy, b_s = template_key(contract_name)
+        AlgoTemplate.query.filter_by(product=prod, relationship=rel, month=mmyy, side=b_s).update({'expired' : True})
+    db.session.commit()
+    get_cache().bump('templates')
+
+    _run_hooks(expire_hooks, contract_names)
+
+def expire_unlisted(products=None):
+    # Expires the active contracts whose month is before the front month listed for their product in the prod_mmyy
+    # file (written by the RP morning scripts). Products missing from the file are left alone.
+    # Returns the names of the contracts expired
+    df = read_pickle(Path(blueprint.root_path, 'data', 'prod_mmyy.pkl'))
+    if products is None:
+        products = [x for x, in db.session.query(AlgoTemplate.product).filter_by(current=True, expired=False).distinct()]
+
+    contract_names = []
+    for product in products:
+        listed = df[df.index.str.upper() == product.upper()].values.tolist()
+        listed = list(filter(None, listed[0])) if listed else []
+        if not listed:
+            continue
+
+        front = datetime.strptime(listed[0], '%b%y')
+        contract_names.extend(
+            x for x in list_contracts(product)
+            if datetime.strptime(Contract.get(x).mmyy, '%b%y') < front
+        )
+
+    if contract_names:
+        expire(contract_names)
+    return contract_names
+
+def delete(contract_names, expired=True):
+    # Deletes every version of the contracts' templates and notes, ex. once they have been moved to the archive
+    for contract_name in contract_names:
+        prod, rel, mmyy, b_s = template_key(contract_name)
+        AlgoTemplate.query.filter_by(
+            product=prod, relationship=rel, month=mmyy, side=b_s, expired=expired
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    get_cache().bump('templates')
+
+def import_file_tree(base_path=None):
+    # Loads the legacy file tree (data/<Product>/<rel>.heuristic|notes and data/<Product>/expired/) into the store.
+    # Contracts already in the store are skipped so this can be run more than once.
+    # Returns the number of templates/notes imported
+    base_path = base_path or Path(blueprint.root_path, 'data')
+    count = 0
+
+    for prod in os.listdir(base_path):
+        prod_dir = Path(base_path, prod)
+        if not os.path.isdir(prod_dir):
+            continue
+
+        for folder, expired in [(prod_dir, False), (Path(prod_dir, 'expired'), True)]:
+            if not os.path.isdir(folder):
+                continue
+
+            for fname in os.listdir(folder):
+                stem, kind = os.path.splitext(fname)
+                kind = kind.replace('.', '')
+                if kind not in kinds:
+                    continue
+
+                contract_name = ' '.join([prod, stem.replace('_', ' ')])
+                if load(contract_name, kind):
+                    continue
+
+                filepath = Path(folder, fname)
+                with open(filepath, "r") as f:
+                    data = json.load(f)
+                save(contract_name, data, kind, expired=expired, updated=datetime.fromtimestamp(os.path.getmtime(filepath)))
+                count += 1
+
+    return count
+
+# Periodic task (ex. every morning after the prod_mmyy file is generated, before Archive-Compaction)
+@celery.task(bind=True, name='Template-Expiry')
+def expiry_task(self, products=None):
+    return 'SUCCESS: {} expired'.format(len(expire_unlisted(products)))
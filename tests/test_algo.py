@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversion between max position and risk: the array form (pos_risk_grid) against the single value form used by the
+heuristic table (calculate_pos_risk)
+
+@author: sbhargava
+"""
+from ..algo import pos_risk_grid, calculate_pos_risk, pos_risk_params
+
+import numpy as np
+
+std = np.array([0.05, 0.12, 1.5, 25.0])
+std_mult = np.array([1, 1.5, 2, 0.75])
+tick_size = np.array([0.01, 0.005, 0.25, 1])
+tick_value = np.array([10, 42, 12.5, 10])
+
+def table(i, **values):
+    # Heuristic table values of sample i, formatted the way they are entered
+    table = dict(zip(pos_risk_params, ['{:,}'.format(x[i]) for x in [std, std_mult, tick_size, tick_value]]))
+    table.update(values)
+    return table
+
+def test_risk():
+    max_pos = np.array([10, 250, 3, 1200])
+    risk = pos_risk_grid(std, std_mult, tick_size, tick_value, max_pos, 'risk')
+
+    for i in range(len(std)):
+        assert calculate_pos_risk(table(i, **{'Max Position' : '{:,}'.format(max_pos[i])}), 'risk') == round(risk[i], 2)
+
+def test_position():
+    risk = np.array([5000, 12500.5, 800, 250000])
+    position = pos_risk_grid(std, std_mult, tick_size, tick_value, risk)
+
+    for i in range(len(std)):
+        assert calculate_pos_risk(table(i, Risk='{:,}'.format(risk[i]))) == int(position[i])
+
+def test_grid_broadcast():
+    # A range of std multipliers against one contract, same as the sensitivity table
+    mults = std_mult[0] * np.array([0.5, 1, 2])
+    risk = pos_risk_grid(std[0], mults, tick_size[0], tick_value[0], 10, 'risk')
+
+    for m, r in zip(mults, risk):
+        values = table(0, **{'Standard Deviation Mult' : m, 'Max Position' : 10})
+        assert calculate_pos_risk(values, 'risk') == round(r, 2)
+
+def test_incomplete():
+    assert calculate_pos_risk(table(0, **{'Max Position' : ''}), 'risk') == ''
+    assert calculate_pos_risk(table(0, **{'Tick Value' : ''}, Risk='100')) == ''
+    assert calculate_pos_risk({'Risk' : '100'}) == ''
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Calendar invite task and the status polled by the UI, with FakeInviteClient standing in for Google
+
+@author: sbhargava
+"""
+from .. import invite_tasks
+from ..invite_tasks import FakeInviteClient
+
+from celery import states
+from celery.result import EagerResult
+import time
+import pytest
+
+@pytest.fixture
+def client():
+    previous = invite_tasks.get_client()
+    fake = FakeInviteClient()
+    invite_tasks.set_client(fake)
+    yield fake
+    invite_tasks.set_client(previous)
+
+@pytest.fixture
+def task_state(monkeypatch):
+    # Result of any task id is the state set by the test, no result backend needed
+    state = {'state' : states.PENDING, 'result' : None}
+    monkeypatch.setattr(
+        invite_tasks.create_invite, 'AsyncResult',
+        lambda task_id : EagerResult(task_id, state['result'], state['state'])
+    )
+    return state
+
+def test_create_invite(client):
+    result = invite_tasks.create_invite.apply(args=('Roll Brent 1m Fly', '2021-01-04'))
+
+    assert result.successful()
+    assert result.result == 'https://calendar.google.com/calendar/fake/1'
+    assert client.invites == [('Roll Brent 1m Fly', invite_tasks.datetime(2021, 1, 4))]
+
+def test_create_invite_failure(client):
+    client.fail = True
+    result = invite_tasks.create_invite.apply(args=('Roll Brent 1m Fly', '2021-01-04'))
+
+    assert result.failed()
+    assert client.invites == []
+
+def test_status_created(task_state):
+    task_state.update(state=states.SUCCESS, result='https://calendar.google.com/calendar/fake/1')
+    assert invite_tasks.invite_status('task', time.time()) == ('created', 'https://calendar.google.com/calendar/fake/1')
+
+def test_status_unknown_id_times_out(task_state):
+    # Celery reports unknown ids as pending forever
+    assert invite_tasks.invite_status('unknown', time.time()) == ('pending', None)
+
+    status, message = invite_tasks.invite_status('unknown', time.time() - invite_tasks.invite_timeout - 1)
+    assert status == 'failed'
+    assert str(invite_tasks.invite_timeout) in message
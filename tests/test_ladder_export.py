@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Round trip of the compiled ladder files: ladders written by ladder_export.write and read back with ladder_reader give
+the same qty and position as whatif.evaluate_ladder, for the adding and unwinding ladders of both sides
+
+@author: sbhargava
+"""
+from .. import ladder_export, ladder_reader
+from ..contract import Contract
+from ..whatif import evaluate_ladder
+
+import numpy as np
+import pytest
+
+round_to = 2
+
+def make_ladders(contract):
+    # Ladders of a contract in the format of whatif.get_ladders, prices sorted ascending
+    price = np.round(np.arange(0.10, 0.21, 0.01), round_to)
+    qty = np.arange(1.0, len(price) + 1)
+    return {
+        'Adding' : (contract.add, (price, qty, np.cumsum(qty))),
+        'Unwinding' : (contract.unwind, (price + 0.05, qty[::-1].copy(), np.cumsum(qty[::-1]))),
+    }
+
+@pytest.mark.parametrize('contract_name', ['Brent 1m Fly Jan21 B', 'Brent 1m Fly Jan21 S'])
+def test_round_trip(tmp_path, contract_name):
+    contract = Contract.get(contract_name)
+    ladders = make_ladders(contract)
+    path = tmp_path / (contract.contract_id + ladder_reader.suffix)
+    ladder_export.write(path, ladders, 3, 0.05, round_to)
+
+    assert ladder_reader.read_header(path) == (3, 0.05)
+
+    ladder = ladder_reader.Ladder(path)
+    prices = np.round(np.arange(0.05, 0.30, 0.005), 3)
+    try:
+        for chart, (logic_type, arrays) in ladders.items():
+            # 'Buy Back' (unwinding of a short) is stored and looked up as a buy ladder
+            assert ladder.sides[chart][0] == ('Buy' if logic_type.lower().startswith('buy') else 'Sell')
+
+            qty, position = ladder.lookup(prices, chart)
+            expected_qty, expected_position = evaluate_ladder(arrays, prices, logic_type, round_to)
+            np.testing.assert_array_equal(qty, expected_qty)
+            np.testing.assert_array_equal(position, expected_position)
+    finally:
+        ladder.close()
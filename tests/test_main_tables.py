@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Positions of a product folder, the same whether they come from the product query or the one query for all products,
+and the vectorized position ids against the risk report's _create_id_
+
+@author: sbhargava
+"""
+from ..main_tables import folder_positions, positions_hash, position_cells
+from ...positions.risk_report import _create_id_
+
+import pandas as pd
+
+pos_df = pd.DataFrame({
+    'contract' : ['Ho 1m Fly Jan21', 'HO_Go Spread Feb21', 'Leanhogs 1m Spread Feb21', 'Brent 1m Fly Jan21',
+                  'Brent_6m 6m Spread Jun21', 'Ho-go 1m Spread Mar21'],
+    'position' : [5, -3, 10, 2, -1, 4],
+})
+
+def test_product_token():
+    # Whole token and case insensitive, not a substring of another product
+    assert folder_positions(pos_df, 'Ho').contract.tolist() == ['Ho 1m Fly Jan21', 'HO_Go Spread Feb21']
+    assert folder_positions(pos_df, 'Leanhogs').contract.tolist() == ['Leanhogs 1m Spread Feb21']
+    assert folder_positions(pos_df, 'Ho-go').contract.tolist() == ['Ho-go 1m Spread Mar21']
+
+def test_folder_key():
+    # Brent_6m positions are under the Brent folder
+    assert folder_positions(pos_df, 'Brent').position.tolist() == [2, -1]
+
+def test_same_hash():
+    # A query narrowed down to the product gives the same positions and hash as filtering every position
+    narrowed = pos_df[pos_df.contract.str.lower().str.startswith('ho')].reset_index(drop=True)
+    assert positions_hash(folder_positions(narrowed, 'Ho')) == positions_hash(folder_positions(pos_df, 'Ho'))
+
+def test_empty():
+    assert folder_positions(pd.DataFrame(), 'Ho').empty
+
+def test_position_ids():
+    # Same ids as the risk report, long and short positions, '_' and ' ' separated contracts
+    sample = pd.DataFrame({
+        'contract' : ['Brent_1m_Fly_Jan21', 'Brent 1m Fly Jan21', 'Ho 2m 2x Mar21', 'Leanhogs_consecutive_Fly_Jun21',
+                      'Gasoline(rbob) 1m Fly Apr21'],
+        'position' : [5, -3, 10, -1, 2],
+    })
+    expected = sample.apply(lambda x : _create_id_(x), axis=1)
+    assert position_cells(sample)['id'].tolist() == expected.tolist()
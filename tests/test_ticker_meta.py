@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decimals of the ticker table against the ones pdict products were rounded to before, and products missing from it
+
+@author: sbhargava
+"""
+from .. import ticker_meta
+from ..ticker_meta import Ticker, tick_decimals
+from ..products import pdict
+
+from types import MappingProxyType
+import pytest
+
+def tickers(**tick_sizes):
+    return MappingProxyType({
+        x : Ticker(x, 1, size, 10, tick_decimals(size)) for x, size in tick_sizes.items()
+    })
+
+def test_previous_round_covers_pdict():
+    assert set(ticker_meta.previous_round) == set(pdict)
+
+def test_tick_decimals():
+    assert [tick_decimals(x) for x in [0.01, 0.025, 0.001, 1, 5, '0.10']] == [2, 3, 3, 0, 0, 1]
+
+def test_check():
+    table = tickers(BRENT=0.01, HO=0.0001)
+    unmapped, changed = ticker_meta.check(table)
+
+    assert 'Brent' not in unmapped and 'Brent_6m' not in unmapped
+    assert 'Ho' not in unmapped and 'Ho-go' in unmapped and 'Sugarno.11' in unmapped
+    assert changed == {'Ho' : (0, 4)} # Brent keeps 2 decimals
+
+def test_round_for_unknown(monkeypatch):
+    monkeypatch.setattr(ticker_meta, 'table', lambda : tickers(BRENT=0.01))
+
+    assert ticker_meta.round_for('Brent_6m') == 2
+    with pytest.raises(ticker_meta.UnknownTicker):
+        ticker_meta.round_for('Ho-go')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Price lookup of whatif.evaluate_ladder against lookup_logic in algo.py, for prices on a level, between levels and
+outside of the ladder
+
+@author: sbhargava
+"""
+from ..algo import lookup_logic
+from ..whatif import evaluate_ladder, ladder_arrays
+
+import pandas as pd
+import pytest
+
+round_to = 2
+
+charts = {
+    'Buy' : pd.DataFrame({'Price' : [1.0, 1.1, 1.2], 'Qty/Level' : [3.0, 2.0, 1.0], 'Position' : [6.0, 3.0, 1.0]}),
+    'Sell' : pd.DataFrame({'Price' : [1.0, 1.1, 1.2], 'Qty/Level' : [1.0, 2.0, 3.0], 'Position' : [-1.0, -3.0, -6.0]}),
+}
+
+def lookup(chart_df, logic_type, price):
+    # (qty, position) of lookup_logic for a price entered in the adding lookup row
+    data = [
+        {'Chart' : 'Adding Lookup', 'Price' : '', 'Qty/Level' : '', 'Position' : ''},
+        {'Chart' : 'Adding Diff', 'Price' : '', 'Qty/Level' : '', 'Position' : ''},
+    ]
+    change = pd.DataFrame([['Adding Lookup', price]], columns=['Chart', 'Price']).set_index('Chart')
+    data_df = lookup_logic(chart_df.set_index('Price'), data, logic_type, change=change)
+    return data_df.loc['Adding Lookup', 'Qty/Level'], data_df.loc['Adding Lookup', 'Position']
+
+def evaluate(chart_df, logic_type, price):
+    qty, position = evaluate_ladder(ladder_arrays(chart_df, round_to), [price], logic_type, round_to)
+    return qty[0], position[0]
+
+@pytest.mark.parametrize('logic_type', ['Buy', 'Sell'])
+def test_on_level(logic_type):
+    chart_df = charts[logic_type]
+    for price in chart_df['Price']:
+        assert evaluate(chart_df, logic_type, price) == lookup(chart_df, logic_type, price)
+
+@pytest.mark.parametrize('logic_type, price, expected', [
+    ('Buy', 1.05, (2.0, 3.0)), # Between levels, buy fills the level above
+    ('Buy', 1.3, (0, 0)), # Above the first buy level
+    ('Buy', 0.9, (3.0, 6.0)), # Below the last buy level
+    ('Sell', 1.05, (1.0, -1.0)), # Between levels, sell fills the level below
+    ('Sell', 0.9, (0, 0)), # Below the first sell level
+    ('Sell', 1.3, (3.0, -6.0)), # Above the last sell level
+])
+def test_off_level(logic_type, price, expected):
+    chart_df = charts[logic_type]
+    assert evaluate(chart_df, logic_type, price) == expected
+
+    # lookup_logic only takes prices on a level
+    with pytest.raises(KeyError):
+        lookup(chart_df, logic_type, price)
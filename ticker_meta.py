@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory ticker metadata (std multiplier, tick size, tick value) loaded once per worker from TickerData.
+
+The table is immutable and replaced as a whole when it is refreshed, either after refresh_interval or when another
+process signals a change with signal_change() (ex. after TickerData is edited). It is the single source of the tick
+configuration, including the number of decimals prices are rounded to. check() lists the pdict products missing from
+TickerData and the products whose decimals differ from the ones they were rounded to before (previous_round), it is
+logged every time the table is loaded.
+
+ex. ticker_meta.lookup('BRENT').tick_value
+    ticker_meta.round_for('Brent_crack')
+
+@author: sbhargava
+"""
+from . import blueprint
+from ..base.models import TickerData
+from .products import pdict
+
+from collections import namedtuple
+from types import MappingProxyType
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from flask import current_app
+import threading, os, re
+
+Ticker = namedtuple('Ticker', ['shiny_id', 'std_mult', 'tick_size', 'tick_value', 'round'])
+
+refresh_interval = timedelta(minutes=30)
+
+# Decimals prices were rounded to when they were defined in pdict ('round'), before they came from the tick size
+previous_round = {
+    'Brent' : 2, 'Brent_6m' : 2, 'Brent_crack' : 2, 'Cocoa' : 0, 'Cocoaliffe' : 0, 'Cocoa-cocoaliffe' : 0,
+    'Feedercattle' : 3, 'Leanhogs' : 3, 'Livecattle' : 3, 'Go' : 2, 'Ho' : 0, 'Ho-go' : 2, 'Naturalgas' : 3,
+    'Gasoline(rbob)' : 0, 'Soybeanoil' : 2, 'Sugarno.11' : 2, 'Wheat' : 2, 'Kcwheat' : 2,
+}
+
+class UnknownTicker(KeyError):
+    # Product without a row in TickerData
+    pass
+
+# File touched to signal workers that TickerData changed
+signal_path = Path(blueprint.root_path, 'data', 'ticker_meta').with_suffix('.signal')
+
+_table = MappingProxyType({})
+_loaded_at = None
+_lock = threading.Lock()
+
+def tick_decimals(tick_size):
+    # Number of decimals of the tick size, ex. 0.025 -> 3, 1 -> 0
+    try:
+        return max(0, -Decimal(str(tick_size)).normalize().as_tuple().exponent)
+    except Exception:
+        return 2
+
+def shiny_id(product):
+    # Product (pdict key or product name) to the id used in TickerData, accounting for legacy naming conventions
+    if re.search('crack', product, re.IGNORECASE):
+        return 'BRENT-CRACK'
+    return product.split("_")[0].upper()
+
+def _signal_time():
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(signal_path))
+    except OSError:
+        return None
+
+def refresh():
+    # Loads every ticker in one query and swaps the table
+    global _table, _loaded_at
+
+    rows = TickerData.query.all()
+    table = {
+        x.shiny_id : Ticker(x.shiny_id, x.std_mult, x.custom_tick_size, x.tick_value, tick_decimals(x.custom_tick_size))
+        for x in rows
+    }
+
+    with _lock:
+        _table = MappingProxyType(table)
+        _loaded_at = datetime.now()
+
+    unmapped, changed = check(table)
+    if unmapped or changed:
+        current_app.logger.warning('TickerData: products missing {}, decimals changed (previous, current) {}'.format(unmapped, changed))
+
+    return _table
+
+def table():
+    # Current table, refreshed if it is stale or a change was signalled since it was loaded
+    loaded_at = _loaded_at
+    if loaded_at is None or datetime.now() - loaded_at > refresh_interval:
+        return refresh()
+
+    signalled = _signal_time()
+    if signalled and signalled > loaded_at:
+        return refresh()
+
+    return _table
+
+def lookup(product):
+    # Ticker for product (pdict key, product name or shiny id), None if it isn't in TickerData
+    return table().get(shiny_id(product))
+
+def round_for(product):
+    # Decimals prices of the product are rounded to. Raises KeyError if the product isn't in TickerData, prices of a
+    # traded product are never rounded to a guessed number of decimals
+    ticker = lookup(product)
+    if ticker is None:
+        raise UnknownTicker('{} ({}) is not in TickerData'.format(product, shiny_id(product)))
+    return ticker.round
+
+def check(tickers=None):
+    # pdict products missing from TickerData and {product : (previous decimals, current decimals)} of the products
+    # whose decimals differ from previous_round. tickers defaults to the current table
+    tickers = table() if tickers is None else tickers
+    unmapped = [x for x in pdict if shiny_id(x) not in tickers]
+    changed = {
+        x : (previous_round.get(x), tickers[shiny_id(x)].round)
+        for x in pdict if shiny_id(x) in tickers and tickers[shiny_id(x)].round != previous_round.get(x)
+    }
+    return unmapped, changed
+
+def signal_change():
+    # Tells every worker to reload the table on their next lookup
+    os.makedirs(signal_path.parent, exist_ok=True)
+    with open(signal_path, "a"):
+        os.utime(signal_path, None)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch what-if evaluation of the trading logic defined in algo.py. For a product (or every product in pdict) and a
+vector of prices or price shocks, returns the target position and qty at each price for every contract that has a
+trading template.
+
+ex. evaluate_product('Brent', shocks=np.arange(-0.5, 0.51, 0.01))
+    evaluate_all(shocks=np.linspace(-1, 1, 201))
+
+@author: sbhargava
+"""
+from . import blueprint
+from ..positions import positions
+from .products import pdict, product_folder
+from .contract import Contract
+from .algo import build_ladders
+from . import template_store, ticker_meta
+from .cache import get_cache, read_pickle
+
+from pathlib import Path
+import re
+import pandas as pd
+import numpy as np
+
+def load_templates(prod_lookup):
+    # Returns {contract_name : StoredTemplate} for every active template of the relationships defined for the product
+    templates = template_store.load_product(product_folder(prod_lookup), 'heuristic')
+
+    return {k : v for k, v in templates.items() if Contract.get(k).prod_lookup == prod_lookup}
+
+def get_std(contract_names):
+    # Gets standard deviation of all contracts in one risk report call, {risk key : std}
+    # (data generation depends on legacy process and is sometimes not available)
+    pos_df = pd.DataFrame({
+        'contract' : [Contract.get(x).position_contract for x in contract_names],
+        'position' : 0
+    }).drop_duplicates('contract')
+
+    try:
+        risk = positions.get_risk_report(pos_df)
+        risk.contract = risk.contract.str.lower().str.replace("_", " ")
+        return risk.set_index('contract')['std'].to_dict()
+    except:
+        return {}
+
+def get_settle_prices():
+    # Settle prices from daily RP script, {risk key : price}
+    fpath = Path(blueprint.root_path, 'data', 'daily_rp').with_suffix('.pkl')
+    return read_pickle(fpath)['Price'].to_dict()
+
+def get_ladders(contract_name, template, std, prod_lookup):
+    # Build (or get from the shared cache) the adding and unwinding charts for a contract, ladders are only rebuilt
+    # when the template or std changed
+    return get_cache().get_or_set(
+        'ladders', [contract_name, template.version, std], lambda : _build_ladders(contract_name, template, std, prod_lookup)
+    )
+
+def _build_ladders(contract_name, template, std, prod_lookup):
+    contract = Contract.get(contract_name)
+    add, unwind = contract.add, contract.unwind
+    rows_df = pd.DataFrame(template.data).set_index('Params')
+    rows_df.loc['Standard Deviation', 'Value'] = std
+
+    chart_df, unwind_chart_df = build_ladders(rows_df, add, unwind, prod_lookup)
+    ladders = {
+        'Adding' : (add, ladder_arrays(chart_df, ticker_meta.round_for(prod_lookup))),
+        'Unwinding' : (unwind, ladder_arrays(unwind_chart_df, ticker_meta.round_for(prod_lookup))),
+    }
+
+    return ladders
+
+def ladder_arrays(chart_df, round_to):
+    # Converts a chart to sorted numpy arrays of (price, qty/level, position)
+    df = chart_df.reset_index() if 'Price' not in chart_df.columns else chart_df
+    df = df[['Price', 'Qty/Level', 'Position']].apply(pd.to_numeric, errors='coerce').dropna(subset=['Price'])
+    df = df.sort_values(by='Price')
+
+    return (
+        np.round(df['Price'].values.astype(float), round_to),
+        df['Qty/Level'].fillna(0).values.astype(float),
+        df['Position'].fillna(0).values.astype(float),
+    )
+
+def evaluate_ladder(ladder, prices, logic_type, round_to):
+    # Vectorized version of the price lookup in lookup_logic. Returns (qty, position) at each price.
+    # Buy logic fills levels as price falls: the level hit is the lowest ladder price at or above the price.
+    # Sell logic fills levels as price rises: the level hit is the highest ladder price at or below the price.
+    # Prices on a level match lookup_logic. lookup_logic only takes prices on a level, here prices between levels get
+    # the last level reached, prices before the first level (above a buy ladder, below a sell ladder) return a qty and
+    # position of 0 and prices past the last level get the last level.
+    lvl_price, lvl_qty, lvl_pos = ladder
+    prices = np.round(np.asarray(prices, dtype=float), round_to)
+
+    if len(lvl_price) == 0:
+        return np.zeros(prices.shape), np.zeros(prices.shape)
+
+    if re.search('buy', logic_type, re.IGNORECASE):
+        idx = np.searchsorted(lvl_price, prices, side='left')
+        hit = idx < len(lvl_price)
+    else:
+        idx = np.searchsorted(lvl_price, prices, side='right') - 1
+        hit = idx >= 0
+    idx = np.clip(idx, 0, len(lvl_price) - 1)
+
+    return np.where(hit, lvl_qty[idx], 0), np.where(hit, lvl_pos[idx], 0)
+
+def evaluate_product(prod_lookup, prices=None, shocks=None, as_array=False):
+    # Evaluates the trading logic of every contract with a template for the product (pdict key).
+    # Either 'prices' (same absolute prices for every contract) or 'shocks' (added to each contract's settle price)
+    # must be given.
+    # Returns a DataFrame with columns [contract, chart, logic, price, qty, position], or if as_array is set,
+    # (contracts, charts, prices, qty, position) where the last three are arrays of shape (contracts x charts, prices)
+    if (prices is None) == (shocks is None):
+        raise ValueError('Provide either prices or shocks')
+
+    round_to = ticker_meta.round_for(prod_lookup)
+    templates = load_templates(prod_lookup)
+    std_dict = get_std(list(templates.keys()))
+    settle = get_settle_prices() if shocks is not None else {}
+    vector = np.asarray(prices if prices is not None else shocks, dtype=float)
+
+    contracts, charts, logics, price_rows, qty_rows, pos_rows = [], [], [], [], [], []
+    for contract_name, template in templates.items():
+        key = Contract.get(contract_name).risk_key
+        if shocks is not None:
+            if key not in settle:
+                continue
+            contract_prices = settle[key] + vector
+        else:
+            contract_prices = vector
+
+        try:
+            ladders = get_ladders(contract_name, template, std_dict.get(key, ''), prod_lookup)
+        except:
+            continue # Incomplete templates can't be built, same as the Dash callback returning empty tables
+
+        for chart, (logic_type, ladder) in ladders.items():
+            qty, pos = evaluate_ladder(ladder, contract_prices, logic_type, round_to)
+            contracts.append(contract_name)
+            charts.append(chart)
+            logics.append(logic_type)
+            price_rows.append(np.round(contract_prices, round_to))
+            qty_rows.append(qty)
+            pos_rows.append(pos)
+
+    shape = (0, len(vector))
+    price_arr = np.vstack(price_rows) if price_rows else np.empty(shape)
+    qty_arr = np.vstack(qty_rows) if qty_rows else np.empty(shape)
+    pos_arr = np.vstack(pos_rows) if pos_rows else np.empty(shape)
+
+    if as_array:
+        return contracts, charts, price_arr, qty_arr, pos_arr
+
+    n = len(vector)
+    df = pd.DataFrame({
+        'contract' : np.repeat(contracts, n),
+        'chart' : np.repeat(charts, n),
+        'logic' : np.repeat(logics, n),
+        'price' : price_arr.ravel(),
+        'qty' : qty_arr.ravel(),
+        'position' : pos_arr.ravel(),
+    })
+    if shocks is not None:
+        df['shock'] = np.tile(vector, len(contracts))
+
+    return df
+
+def evaluate_all(prices=None, shocks=None):
+    # Evaluates every product in pdict and returns a single DataFrame with an added 'product' column. Products missing
+    # from TickerData are skipped and reported in df.attrs['skipped'], {product : error}
+    df_list, skipped = [], {}
+    for prod_lookup in pdict.keys():
+        try:
+            df = evaluate_product(prod_lookup, prices=prices, shocks=shocks)
+        except ticker_meta.UnknownTicker as e:
+            skipped[prod_lookup] = str(e)
+            continue
+        df.insert(0, 'product', prod_lookup)
+        df_list.append(df)
+
+    df = pd.concat(df_list, ignore_index=True) if df_list else pd.DataFrame()
+    df.attrs['skipped'] = skipped
+    return df